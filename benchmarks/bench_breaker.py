@@ -0,0 +1,97 @@
+"""
+Latency of mongo operations while mongo stalls and after it recovers, with and without the circuit breaker, against
+the stand-in mongo server of the tests, paused like a stuck mongod.
+Operations keep arriving at a steady rate like bot commands do: without the breaker every one of them waits for its
+whole timeout and they pile up in the executor, with it they are refused right away until a probe finds mongo again.
+"""
+from argparse import ArgumentParser
+from asyncio import gather as asyncio_gather, get_running_loop as asyncio_get_running_loop, run as asyncio_run, \
+    sleep as asyncio_sleep
+from json import load as json_load
+from os import environ
+from os.path import join as path_join
+from time import perf_counter
+
+import common  # noqa: F401
+from common import milliseconds
+from fakes import FakeMongoServer
+from pymongo.errors import PyMongoError
+from src.utils.mongo import MongoUnavailableError, MongoUtil
+
+_PHASES = ['healthy', 'stalled', 'recovered']
+
+
+async def _request(mongo_util, phase, results):
+    start = perf_counter()
+    try:
+        await mongo_util.run(mongo_util.db().command, 'ping')
+        outcome = 'ok'
+    except MongoUnavailableError:
+        outcome = 'rejected'
+    except PyMongoError:
+        outcome = 'failed'
+    results[phase].append((outcome, perf_counter() - start, start))
+
+
+async def _load(mongo_util, server, arguments):
+    # Steady arrivals through a healthy period, a stall and the recovery, recording when operations work again
+    results = {phase: [] for phase in _PHASES}
+    requests = []
+    peak_pending = 0
+    resumed_at = None
+    for phase, duration in zip(_PHASES, (arguments.healthy, arguments.stall, arguments.healthy)):
+        if phase == 'stalled':
+            server.pause()
+        elif phase == 'recovered':
+            server.resume()
+            resumed_at = perf_counter()
+        end = perf_counter() + duration
+        while perf_counter() < end:
+            requests.append(asyncio_get_running_loop().create_task(_request(mongo_util, phase, results)))
+            peak_pending = max(peak_pending, mongo_util.pending)
+            await asyncio_sleep(1 / arguments.rate)
+    await asyncio_gather(*requests)
+    recovered = [start + latency for outcome, latency, start in results['recovered'] if outcome == 'ok']
+    return results, peak_pending, min(recovered, default=float('nan')) - resumed_at
+
+
+def _run(server, options, arguments):
+    # Brand new singleton for every run, so that clients and breakers do not carry over
+    MongoUtil._MongoUtil__instance = None
+    mongo_util = MongoUtil(server.uri, arguments.workers, options)
+    try:
+        return asyncio_run(_load(mongo_util, server, arguments))
+    finally:
+        MongoUtil._MongoUtil__mongo_client.close()
+        MongoUtil._MongoUtil__executor.shutdown()
+
+
+def main(arguments):
+    with open(path_join('bot', environ['BOT_CONFIG']), 'r', encoding='utf-8') as f:
+        options = {**json_load(f)['mongo_options'], 'operation_timeout': arguments.timeout,
+                   'breaker_probe_interval': arguments.probe_interval}
+    print(f"{arguments.rate} operations/s, {arguments.workers} workers, {arguments.timeout}s operation timeout, "
+          f"{arguments.stall}s stall, {arguments.probe_interval}s probe interval:")
+    for name, breaker_failures in (('without breaker', 10 ** 9), ('with breaker', options['breaker_failures'])):
+        server = FakeMongoServer()
+        try:
+            results, peak_pending, recovery = _run(server, {**options, 'breaker_failures': breaker_failures},
+                                                   arguments)
+        finally:
+            server.stop()
+        print(f"{name}: peak pending {peak_pending}, ok again {recovery:.2f}s after mongo recovered")
+        for phase in _PHASES:
+            outcomes = [outcome for outcome, _, _ in results[phase]]
+            counts = ', '.join(f"{outcomes.count(outcome)} {outcome}" for outcome in ('ok', 'rejected', 'failed'))
+            print(f"  {phase:>9}: {milliseconds([latency for _, latency, _ in results[phase]])}  {counts}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=20, help="operations started every second")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=2, help="operation timeout in seconds")
+    parser.add_argument('--probe-interval', type=float, default=1)
+    parser.add_argument('--healthy', type=float, default=3, help="seconds before and after the stall")
+    parser.add_argument('--stall', type=float, default=6, help="seconds mongo stays stuck")
+    main(parser.parse_args())
@@ -0,0 +1,91 @@
+"""
+Shard startup and gateway event throughput of the same shards run by a single process and split into clusters by the
+launcher, reporting how long every cluster takes to connect its shards and handle their events, and its memory.
+Every cluster is its own interpreter importing the bot module with a sharded config, like the launcher starts them.
+A fake gateway stands in for discord, and handling every event burns a fixed cpu time.
+"""
+from argparse import ArgumentParser
+from asyncio import run as asyncio_run, sleep as asyncio_sleep
+from json import dump as json_dump, dumps as json_dumps, load as json_load, loads as json_loads
+from os import environ
+from os.path import join as path_join
+from subprocess import PIPE, Popen
+from sys import argv, executable as sys_executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from discord.gateway import DiscordWebSocket
+
+import common  # noqa: F401
+from fakes import FakeGateway
+from launcher import cluster_shards
+
+
+def _rss():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+
+
+async def _cluster(arguments):
+    # Connect the shards given by the launcher, and wait for all of their events to be handled
+    gateway = FakeGateway(arguments.events, arguments.cpu / 1000)
+    DiscordWebSocket.from_client = gateway.from_client
+    start = perf_counter()
+    from main import bot
+    await bot._async_setup_hook()
+    connection = bot.loop.create_task(bot.connect())
+    while len(bot.shards) < len(bot.shard_ids):
+        await asyncio_sleep(0.001)
+    connected = perf_counter() - start
+    while sum(gateway.handled.values()) < arguments.events * len(bot.shard_ids):
+        await asyncio_sleep(0.001)
+    elapsed = perf_counter() - start
+    await bot.close()
+    await connection
+    print(json_dumps({'connected': connected, 'elapsed': elapsed, 'rss': _rss(), 'shards': len(bot.shard_ids)}))
+
+
+def _run(arguments, clusters, config):
+    # Start every cluster at once, like the launcher does
+    processes = []
+    start = perf_counter()
+    for shard_ids in cluster_shards(arguments.shards, clusters):
+        env = {**environ, 'BOT_CONFIG': config, 'SHARD_IDS': ','.join(map(str, shard_ids)),
+               'SHARD_COUNT': str(arguments.shards)}
+        processes.append(Popen([sys_executable, argv[0], '--cluster', '--events', str(arguments.events),
+                                '--cpu', str(arguments.cpu)], env=env, stdout=PIPE, text=True))
+    results = [json_loads(process.communicate()[0]) for process in processes]
+    return perf_counter() - start, results
+
+
+def main(arguments):
+    with open(path_join('bot', 'bot_config.json'), 'r', encoding='utf-8') as f:
+        config = json_load(f)
+    config.update(sharded=True, shard_count=arguments.shards)
+    with TemporaryDirectory() as directory:
+        path = path_join(directory, 'sharded.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json_dump(config, f)
+        print(f"{arguments.shards} shards, {arguments.events} events each taking {arguments.cpu}ms of cpu:")
+        for clusters in sorted({1, arguments.clusters}):
+            elapsed, results = _run(arguments, clusters, path)
+            print(f"  {clusters:3d} clusters: all events handled in {elapsed:.2f}s, "
+                  f"{arguments.shards * arguments.events / elapsed:8.0f} events/s")
+            for cluster_id, result in enumerate(results):
+                print(f"    cluster {cluster_id}: {result['shards']:3d} shards connected in "
+                      f"{result['connected'] * 1000:7.1f}ms, events handled in {result['elapsed']:.2f}s, "
+                      f"{result['rss'] / 2 ** 20:6.1f}MiB resident")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--clusters', type=int, default=4)
+    parser.add_argument('--events', type=int, default=500, help="gateway events of every shard")
+    parser.add_argument('--cpu', type=float, default=1, help="milliseconds of cpu to handle every event")
+    parser.add_argument('--cluster', action='store_true', help="run a single cluster, as started by the benchmark")
+    parsed = parser.parse_args()
+    if parsed.cluster:
+        asyncio_run(_cluster(parsed))
+    else:
+        main(parsed)
@@ -0,0 +1,81 @@
+"""
+Dice rolls of a corpus of typical and adversarial expressions through the dice pool, reporting for each one the
+verdict, the cost of the cached complexity check, the roll latency and the event loop lag while it rolls.
+The real roller is used when installed, the fake roller of the tests otherwise, evaluating arithmetic in python.
+"""
+from argparse import ArgumentParser
+from asyncio import get_running_loop as asyncio_get_running_loop, run as asyncio_run
+from importlib.util import find_spec
+from json import load as json_load
+from os.path import join as path_join
+from sys import path as sys_path
+from time import perf_counter
+
+import common  # noqa: F401
+from common import milliseconds
+from fakes import LagMonitor
+from src.utils.dice import DiceError, DicePool, DiceTimeoutError
+
+_TYPICAL = ['1d20', '1d20+5', '2d6+1d4+3', '4d6-1', '(1d8+3)*2', '3x(1d20+7)', '10d10', '1d100/2', '2d20-1d4+6*2']
+_ADVERSARIAL = ['1000d1000000', '500d6', '20x(30d6)', '(' * 10 + '1d6' + ')' * 10, '(' * 12 + '1' + ')' * 12,
+                '1d6+' * 60 + '1', '9^9^9', '2^999999999', '1d6+123456789012', '1d6+']
+
+
+def _check_cost(pool, expression, repeat):
+    start = perf_counter()
+    pool.check.__wrapped__(expression)
+    uncached = perf_counter() - start
+    start = perf_counter()
+    for _ in range(repeat):
+        pool.check(expression)
+    return uncached, (perf_counter() - start) / repeat
+
+
+async def _roll(pool, expression, rolls):
+    # Verdict of the expression, and latency of every roll
+    latencies = []
+    verdict = 'rolled'
+    for _ in range(rolls):
+        start = perf_counter()
+        try:
+            await pool.roll(expression)
+        except DiceTimeoutError:
+            verdict = 'timed out'
+        except DiceError as e:
+            verdict = f"refused: {e}" if verdict == 'rolled' else verdict
+        latencies.append(perf_counter() - start)
+    return verdict, latencies
+
+
+async def main(arguments):
+    with open(path_join('bot', 'src', 'extensions', 'games.json'), 'r', encoding='utf-8') as f:
+        config = json_load(f)
+    pool = DicePool(workers=config['dice_workers'], max_pending=config['dice_max_pending'],
+                    cpu_timeout=config['dice_cpu_timeout'], limits=config['dice_limits'],
+                    rejections_size=config['dice_rejections_size'], rejections_ttl=config['dice_rejections_ttl'])
+    await pool.warm()
+    print(f"{arguments.rolls} rolls of every expression, {config['dice_cpu_timeout']}s cpu timeout:")
+    for kind, corpus in (('typical', _TYPICAL), ('adversarial', _ADVERSARIAL)):
+        print(f"{kind}:")
+        for expression in corpus:
+            uncached, cached = _check_cost(pool, expression, 1000)
+            monitor = LagMonitor()
+            lag_task = asyncio_get_running_loop().create_task(monitor.run())
+            verdict, latencies = await _roll(pool, expression, arguments.rolls)
+            monitor.stop()
+            await lag_task
+            shown = expression if len(expression) <= 24 else expression[:21] + '...'
+            print(f"  {shown:>24}  check {uncached * 1e6:6.1f}us, cached {cached * 1e6:4.2f}us  "
+                  f"roll {milliseconds(latencies)}  loop lag max {max(monitor.lags, default=0.0) * 1000:5.1f}ms  "
+                  f"{verdict}")
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--rolls', type=int, default=20)
+    parsed = parser.parse_args()
+    if not find_spec('arithmetic_dice_roller'):
+        print("arithmetic_dice_roller is not installed, using the fake roller of the tests")
+        sys_path.insert(0, path_join('tests', 'fake_dice'))
+    asyncio_run(main(parsed))
@@ -0,0 +1,75 @@
+"""
+Import time and resident memory of every extension, and of the heavy dependencies they now load lazily or only in
+extraction workers, which extensions used to pay for as soon as they were loaded.
+Every import runs in its own interpreter with `-X importtime`, after discord and pymongo are already imported like
+they are by the bot, so only what the extension itself brings in is measured.
+"""
+from argparse import ArgumentParser
+from json import dumps as json_dumps, loads as json_loads
+from subprocess import run as subprocess_run
+from sys import argv, executable as sys_executable, modules
+
+import common  # noqa: F401
+
+_EXTENSIONS = ['core', 'games', 'mortadella', 'music']
+_DEPENDENCIES = ['yt_dlp', 'arithmetic_dice_roller', 'sympy']
+
+
+def _rss():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+
+
+def _case(module):
+    # Modules shared by the whole bot are not accounted to any extension
+    import discord  # noqa: F401
+    from discord.ext import commands  # noqa: F401
+    import pymongo  # noqa: F401
+    start = _rss()
+    try:
+        # Through the import statement machinery, which -X importtime times, unlike importlib
+        __import__(module)
+    except ImportError as e:
+        print(json_dumps({'error': str(e)}))
+        return
+    print(json_dumps({'rss': _rss() - start, 'heavy': [name for name in _DEPENDENCIES if name in modules]}))
+
+
+def _cumulative(importtime, module):
+    # Lines look like "import time:  self [us] | cumulative | imported package", nested packages are indented
+    for line in importtime.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1e6
+    return 0.0
+
+
+def _measure(module):
+    result = subprocess_run([sys_executable, '-X', 'importtime', argv[0], '--case', module], capture_output=True,
+                            text=True, check=True)
+    return {**json_loads(result.stdout), 'time': _cumulative(result.stderr, module)}
+
+
+def main(arguments):
+    print(f"import time and resident memory, best of {arguments.runs} runs:")
+    for kind, names in (('extension', [f"src.extensions.{name}" for name in _EXTENSIONS]),
+                           ('dependency', _DEPENDENCIES)):
+        for module in names:
+            runs = [_measure(module) for _ in range(arguments.runs)]
+            if 'error' in runs[0]:
+                print(f"{kind:>10} {module:>24}: not installed ({runs[0]['error']})")
+                continue
+            print(f"{kind:>10} {module:>24}: {min(run['time'] for run in runs) * 1000:8.1f}ms "
+                  f"{min(run['rss'] for run in runs) / 2 ** 20:7.1f}MiB  "
+                  f"heavy modules loaded: {', '.join(runs[0]['heavy']) or 'none'}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--case', help="import a single module, as started by the benchmark")
+    parsed = parser.parse_args()
+    if parsed.case:
+        _case(parsed.case)
+    else:
+        main(parsed)
@@ -0,0 +1,41 @@
+"""
+Lateness of voice frames played on the schedule of the discord audio player while the extraction pool works through
+bursts of cpu bound extractions, in worker processes and in worker threads, with the elapsed time of every burst.
+Every run is a separate interpreter going through the stress run of the tests, so that workers import the fake
+yt-dlp, burning a fixed cpu time for every extraction, instead of the real one.
+"""
+from argparse import ArgumentParser
+from json import loads as json_loads
+from os import environ, pathsep
+from os.path import join as path_join
+from subprocess import run as subprocess_run
+from sys import executable as sys_executable
+
+import common  # noqa: F401
+
+
+def _stress(mode, requests, arguments):
+    result = subprocess_run([sys_executable, path_join('tests', 'extraction_stress.py'), mode,
+                             '--requests', str(requests), '--workers', str(arguments.workers)],
+                            capture_output=True, text=True, check=True,
+                            env={**environ, 'PYTHONPATH': pathsep.join([path_join('tests', 'fake_ytdl'), 'bot']),
+                                 'FAKE_YTDL_CPU': str(arguments.cpu / 1000)})
+    return json_loads(result.stdout)
+
+
+def main(arguments):
+    print(f"{arguments.workers} workers, {arguments.cpu:.0f}ms of cpu for every extraction, 20ms voice frames:")
+    for requests in arguments.requests:
+        for mode in ('process', 'thread'):
+            result = _stress(mode, requests, arguments)
+            print(f"{requests:>4} extractions in {mode:>7} workers: {result['elapsed']:6.2f}s, "
+                  f"{result['frames']:>5} frames late by p50 {result['p50'] * 1000:6.2f}ms  "
+                  f"p99 {result['p99'] * 1000:6.2f}ms  max {result['max'] * 1000:6.2f}ms")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, nargs='+', default=[10, 40, 160])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--cpu', type=float, default=50, help="milliseconds of cpu each extraction burns")
+    main(parser.parse_args())
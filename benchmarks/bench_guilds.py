@@ -0,0 +1,74 @@
+"""
+Many guilds playing their own queues at the same time through the music extension: memory of every guild player,
+time to play every queue, event loop lag and gaps between songs, at increasing numbers of guilds.
+Tracks resolve right away and fake voice clients play every track for a fixed time, so only the players are measured.
+"""
+from argparse import ArgumentParser
+from asyncio import get_running_loop as asyncio_get_running_loop, run as asyncio_run, Semaphore
+from time import perf_counter
+from tracemalloc import get_traced_memory, start as tracemalloc_start, stop as tracemalloc_stop
+
+from common import milliseconds
+from fakes import FakeAudio, FakeBot, FakeChannel, FakeContext, FakeExtractionPool, FakeGuild, FakeQueueStore, \
+    LagMonitor, until
+from src.extensions import music
+from src.extensions.music import Track
+
+
+async def _extract_info(cls, search, *, cache=True):
+    return {'title': search.rsplit('/', 1)[-1], 'uploader': 'someone', 'duration': 1, 'webpage_url': search,
+            'url': f"{search}?expire=4000000000"}
+
+
+async def _play(guilds, arguments):
+    # Semaphores stick to the loop they first waited in, and each run has its own
+    music.VoiceState._VoiceState__prefetch_semaphore = Semaphore(music._config['prefetch_concurrency'])
+    cog = music.Music(FakeBot())
+    cog.queue_store = FakeQueueStore()
+    await cog.cog_load()
+    monitor = LagMonitor()
+    lag_task = asyncio_get_running_loop().create_task(monitor.run())
+    tracemalloc_start()
+    start_memory = get_traced_memory()[0]
+    for guild_id in range(1, guilds + 1):
+        channel = FakeChannel(guild_id * 10, play_time=arguments.play_time / 1000)
+        voice_state = cog.get_voice_state(FakeContext(FakeGuild(guild_id, [channel]), channel))
+        voice_state.voice = await channel.connect()
+        for index in range(arguments.tracks):
+            voice_state.music_queue.put_nowait(
+                Track(f"{guild_id}-{index}", f"https://video.test/{guild_id}/{index}", 1, guild_id))
+    memory_per_guild = (get_traced_memory()[0] - start_memory) / guilds
+    tracemalloc_stop()
+    start = perf_counter()
+    await until(lambda: all(len(voice_state.voice.played) == arguments.tracks and not voice_state.voice.is_playing()
+                            for voice_state in cog.voice_states.values()), timeout=600)
+    elapsed = perf_counter() - start
+    monitor.stop()
+    await lag_task
+    gaps = [gap for voice_state in cog.voice_states.values() for gap in voice_state.voice.gaps]
+    for voice_state in list(cog.voice_states.values()):
+        await voice_state.stop()
+    return memory_per_guild, elapsed, monitor.lags, gaps
+
+
+def main(arguments):
+    music.YTDLSource.extract_info = classmethod(_extract_info)
+    music.YTDLSource._YTDLSource__create_audio = lambda self, position=0: FakeAudio()
+    music.YTDLSource.extraction_pool = FakeExtractionPool()
+    music._config['prewarm'] = False
+    print(f"{arguments.tracks} tracks of {arguments.play_time:.0f}ms for every guild:")
+    for guilds in arguments.guilds:
+        memory_per_guild, elapsed, lags, gaps = asyncio_run(_play(guilds, arguments))
+        ideal = arguments.tracks * arguments.play_time / 1000
+        print(f"{guilds:>5} guilds: {memory_per_guild / 1024:5.1f}KiB per guild, played in {elapsed:6.2f}s "
+              f"({ideal:.2f}s of music)")
+        print(f"  loop lag {milliseconds(lags)}")
+        print(f"  song gap {milliseconds(gaps)}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--tracks', type=int, default=3)
+    parser.add_argument('--play-time', type=float, default=200, help="milliseconds each track plays")
+    main(parser.parse_args())
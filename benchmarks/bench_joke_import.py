@@ -0,0 +1,109 @@
+"""
+Bulk import of a large joke set through `.importjokes`, from a json and from a text file, against adding the same jokes
+one `.addjoke` at a time, with the export of the resulting collection.
+Part of the jokes are repeated in the file with different case and spacing, and part are already known, so that both
+the in-memory deduplication of batches and the unique index of mongo are exercised.
+An in-process fake collection stands in for mongo, blocking for a fixed latency on every round trip.
+"""
+from argparse import ArgumentParser
+from asyncio import get_running_loop as asyncio_get_running_loop, run as asyncio_run
+from json import dumps as json_dumps
+from random import choice as random_choice, seed as random_seed
+from time import perf_counter
+from tracemalloc import get_traced_memory, start as tracemalloc_start, stop as tracemalloc_stop
+
+from common import fake_mongo_util, milliseconds
+from fakes import FakeAttachment, FakeBot, FakeChannel, FakeContext, FakeDatabase, LagMonitor
+from src.extensions.mortadella import Mortadella, normalize_joke
+
+_COLLECTION = 'mortadella.jokes'
+_WORDS = ['mortadella', 'carabiniere', 'nonna', 'gatto', 'pizza', 'treno', 'prete', 'dottore', 'bar', 'calcio']
+
+
+def _jokes(amount, duplicates):
+    # Unique jokes, then some of them again with shouting and extra spaces
+    jokes = [f"{' '.join(random_choice(_WORDS) for _ in range(8))} numero {i}" for i in range(amount)]
+    return jokes + [random_choice(jokes).upper().replace(' ', '  ') for _ in range(int(amount * duplicates))]
+
+
+def _context(*attachments):
+    channel = FakeChannel(1)
+    return FakeContext(None, channel, attachments=attachments)
+
+
+def _prepare(arguments, jokes):
+    # Fresh collection holding some of the jokes already, and an extension using it
+    database = FakeDatabase()
+    for joke in jokes[:int(len(jokes) * arguments.known)]:
+        database[_COLLECTION].insert_one({'joke': joke, 'normalized': normalize_joke(joke)})
+    database[_COLLECTION].latency = arguments.latency / 1000
+    database[_COLLECTION].round_trips = 0
+    fake_mongo_util(database)
+    return database, Mortadella(FakeBot())
+
+
+async def _import(cog, attachment):
+    monitor = LagMonitor()
+    lag_task = asyncio_get_running_loop().create_task(monitor.run())
+    ctx = _context(attachment)
+    start = perf_counter()
+    await cog.import_jokes.callback(cog, ctx)
+    elapsed = perf_counter() - start
+    monitor.stop()
+    await lag_task
+    return elapsed, monitor.lags, ctx.sent[-1].description
+
+
+def _files(jokes):
+    return {'json': FakeAttachment('jokes.json', json_dumps([{'joke': joke} for joke in jokes]).encode()),
+            'text': FakeAttachment('jokes.txt', '\n'.join(jokes).encode())}
+
+
+def main(arguments):
+    random_seed(0)
+    jokes = _jokes(arguments.jokes, arguments.duplicates)
+    print(f"{len(jokes)} jokes ({arguments.duplicates:.0%} repeated, {arguments.known:.0%} already known), "
+          f"{arguments.latency}ms mongo latency:")
+    for kind, attachment in _files(jokes).items():
+        database, cog = _prepare(arguments, jokes)
+        elapsed, lags, outcome = asyncio_run(_import(cog, attachment))
+        stored = len(database[_COLLECTION].documents)
+        print(f"  {kind:>4} import of {len(attachment.data) / 2 ** 20:.1f}MiB: {elapsed:6.2f}s "
+              f"({len(jokes) / elapsed:8.0f} jokes/s), {database[_COLLECTION].round_trips} round trips, "
+              f"{stored} stored, loop lag {milliseconds(lags)}")
+        print(f"       {outcome}")
+        # Again with allocations traced, which slows everything down
+        database, cog = _prepare(arguments, jokes)
+        tracemalloc_start()
+        asyncio_run(_import(cog, attachment))
+        peak = get_traced_memory()[1]
+        tracemalloc_stop()
+        print(f"       peak memory allocated while importing, the fake collection included: {peak / 2 ** 20:.1f}MiB")
+    start = perf_counter()
+    ctx = _context()
+    asyncio_run(cog.export_jokes.callback(cog, ctx))
+    print(f"  export of {stored} jokes: {perf_counter() - start:.2f}s, {len(ctx.sent[-1]) / 2 ** 20:.1f}MiB")
+    # One command for every joke, on a sample
+    database, cog = _prepare(arguments, jokes)
+    sample = jokes[-arguments.one_by_one:]
+
+    async def one_by_one():
+        ctx = _context()
+        start = perf_counter()
+        for joke in sample:
+            await cog.add_joke.callback(cog, ctx, joke=joke)
+        return perf_counter() - start
+
+    elapsed = asyncio_run(one_by_one())
+    print(f"  one .addjoke at a time, {len(sample)} jokes: {elapsed:.2f}s ({len(sample) / elapsed:.0f} jokes/s), "
+          f"{database[_COLLECTION].round_trips} round trips, {elapsed / len(sample) * len(jokes):.0f}s for all of them")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--jokes', type=int, default=100000)
+    parser.add_argument('--duplicates', type=float, default=0.05, help="fraction of jokes repeated in the file")
+    parser.add_argument('--known', type=float, default=0.1, help="fraction of jokes already in the collection")
+    parser.add_argument('--latency', type=float, default=1, help="milliseconds for each mongo round trip")
+    parser.add_argument('--one-by-one', type=int, default=2000, help="jokes added one command at a time")
+    main(parser.parse_args())
@@ -0,0 +1,125 @@
+"""
+Joke search and listing at 10k and 1M jokes: which way `.joke <keywords>` searches, its latency and mongo round trips,
+what the in-memory index would cost at each size, and the cost of `.jokes` pages by range of ids against skip and
+limit, however deep the page.
+An in-process fake collection stands in for mongo, blocking for a fixed latency on every round trip. Its text search
+scans every joke in python, so only the round trips and the work left to the bot say something about mongo there,
+while its id ranges walk sorted ids like the _id index does, and skipped documents are walked as well.
+"""
+from argparse import ArgumentParser
+from asyncio import run as asyncio_run
+from random import choice as random_choice, seed as random_seed
+from time import perf_counter
+
+from common import fake_mongo_util, milliseconds
+from fakes import FakeBot, FakeDatabase
+from src.extensions import mortadella
+from src.extensions.mortadella import JokesCache, Mortadella
+
+_COLLECTION = 'mortadella.jokes'
+_WORDS = ['mortadella', 'carabiniere', 'nonna', 'gatto', 'pizza', 'treno', 'prete', 'dottore', 'bar', 'calcio',
+          'suocera', 'pescatore', 'maestra', 'cane', 'vigile', 'ristorante', 'medico', 'avvocato', 'scuola', 'mare']
+
+
+def _rss():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+
+
+def _database(jokes, latency):
+    # Ids start from one, like object ids they are never falsy
+    database = FakeDatabase()
+    collection = database[_COLLECTION]
+    for i in range(1, jokes + 1):
+        collection.documents[i] = {'_id': i, 'joke': f"{' '.join(random_choice(_WORDS) for _ in range(10))} {i}"}
+    collection.latency = latency
+    return database
+
+
+async def _searches(cog, collection, amount):
+    # The first search pays for the cache load or the text index, the others are measured
+    start = perf_counter()
+    await cog.search_jokes('nonna gatto')
+    first = perf_counter() - start
+    round_trips = collection.round_trips
+    latencies = []
+    for _ in range(amount):
+        keywords = f"{random_choice(_WORDS)} {random_choice(_WORDS)}"
+        start = perf_counter()
+        await cog.search_jokes(keywords)
+        latencies.append(perf_counter() - start)
+    return first, latencies, (collection.round_trips - round_trips) / amount
+
+
+async def _index_cost(mongo_util):
+    # What keeping every joke and its words in memory takes, whether search uses it or not
+    rss = _rss()
+    jokes_cache = JokesCache(mongo_util, _COLLECTION, 600, 300)
+    start = perf_counter()
+    await jokes_cache.refresh()
+    elapsed = perf_counter() - start
+    return elapsed, _rss() - rss
+
+
+def _skip_page(collection, page, page_size):
+    return list(collection.find({}, {'joke': True}).sort('_id', 1).skip((page - 1) * page_size).limit(page_size + 1))
+
+
+async def _pages(cog, mongo_util, collection, jokes, repeat):
+    # Pages at increasing depth, starting from the id their previous page ended with
+    page_size = mortadella._config['jokes_page_size']
+    results = {}
+    for page in sorted({1, 10, 100, 1000, 10000, jokes // page_size}):
+        if page > jokes // page_size:
+            continue
+        after = (page - 1) * page_size or None
+        costs = {}
+        for kind, fetch in (('range', lambda: mongo_util.run(cog._Mortadella__jokes_page, after)),
+                            ('skip', lambda: mongo_util.run(_skip_page, collection, page, page_size))):
+            latencies = []
+            examined = collection.examined
+            for _ in range(repeat):
+                start = perf_counter()
+                documents = await fetch()
+                latencies.append(perf_counter() - start)
+            assert documents[0]['_id'] == (page - 1) * page_size + 1
+            costs[kind] = (latencies, (collection.examined - examined) // repeat)
+        results[page] = costs
+    return results
+
+
+def main(arguments):
+    random_seed(0)
+    print(f"{arguments.latency}ms mongo latency, in-memory search up to "
+          f"{mortadella._config['jokes_search_memory_max']} jokes:")
+    for jokes in arguments.sizes:
+        database = _database(jokes, arguments.latency / 1000)
+        collection = database[_COLLECTION]
+        mongo_util = fake_mongo_util(database)
+        cog = Mortadella(FakeBot())
+        rss = _rss()
+        searches = arguments.searches if jokes <= mortadella._config['jokes_search_memory_max'] \
+            else arguments.text_searches
+        first, latencies, round_trips = asyncio_run(_searches(cog, collection, searches))
+        if len(cog.jokes_cache):
+            print(f"{jokes} jokes, searched in memory: first {first * 1000:.1f}ms, then {milliseconds(latencies)}, "
+                  f"{round_trips:.1f} round trips each, {(_rss() - rss) / 2 ** 20:.0f}MiB more memory")
+        else:
+            # Timing the fake text search would only time its scan
+            print(f"{jokes} jokes, searched by mongo: {round_trips:.1f} round trips each, nothing loaded in the cache, "
+                  f"{(_rss() - rss) / 2 ** 20:.0f}MiB more memory")
+        elapsed, size = asyncio_run(_index_cost(mongo_util))
+        print(f"  in-memory index of every joke: built in {elapsed:.2f}s, {size / 2 ** 20:.0f}MiB")
+        for page, costs in asyncio_run(_pages(cog, mongo_util, collection, jokes, arguments.repeat)).items():
+            print(f"  page {page:>6}: " + '  '.join(f"{kind:>5} {milliseconds(latencies)} {examined:>7} examined"
+                                                     for kind, (latencies, examined) in costs.items()))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000])
+    parser.add_argument('--latency', type=float, default=1, help="milliseconds for each mongo round trip")
+    parser.add_argument('--searches', type=int, default=200, help="searches measured in memory")
+    parser.add_argument('--text-searches', type=int, default=1, help="searches through the fake text search")
+    parser.add_argument('--repeat', type=int, default=20, help="fetches of every page")
+    main(parser.parse_args())
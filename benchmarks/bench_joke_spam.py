@@ -0,0 +1,69 @@
+"""
+Event loop latency under concurrent `.joke` spam, with mongo calls made right on the loop (as before the mongo
+executor), through the mongo executor, and served by the jokes cache.
+An in-process fake collection stands in for mongo, blocking for a fixed latency on every round trip.
+"""
+from argparse import ArgumentParser
+from asyncio import gather as asyncio_gather, get_running_loop as asyncio_get_running_loop, run as asyncio_run
+from time import perf_counter
+
+from common import fake_mongo_util, milliseconds
+from fakes import FakeDatabase, LagMonitor
+from src.extensions.mortadella import JokesCache
+
+_COLLECTION = 'mortadella.jokes'
+
+
+async def _spam(joke, concurrency, rounds):
+    # Many members asking for jokes at the same time, measuring the loop meanwhile and each joke latency
+    monitor = LagMonitor(0.005)
+    latencies = []
+
+    async def member():
+        for _ in range(rounds):
+            start = perf_counter()
+            await joke()
+            latencies.append(perf_counter() - start)
+
+    lag_task = asyncio_get_running_loop().create_task(monitor.run())
+    start = perf_counter()
+    await asyncio_gather(*(member() for _ in range(concurrency)))
+    elapsed = perf_counter() - start
+    monitor.stop()
+    await lag_task
+    return elapsed, latencies, monitor.lags
+
+
+async def main(arguments):
+    database = FakeDatabase(arguments.latency / 1000)
+    for i in range(arguments.jokes):
+        database[_COLLECTION].insert_one({'joke': f"joke number {i}"})
+    mongo_util = fake_mongo_util(database)
+    collection = database[_COLLECTION]
+    jokes_cache = JokesCache(mongo_util, _COLLECTION, 600, 300)
+
+    async def blocking_joke():
+        # Old implementation, blocking the loop for both round trips
+        if collection.count_documents({}):
+            return next(collection.aggregate([{'$sample': {'size': 1}}]))['joke']
+
+    async def executor_joke():
+        if await mongo_util.run(collection.count_documents, {}):
+            return next(await mongo_util.run(collection.aggregate, [{'$sample': {'size': 1}}]))['joke']
+
+    print(f"{arguments.concurrency} members asking {arguments.rounds} jokes each, "
+          f"{arguments.latency}ms mongo latency, {arguments.jokes} jokes")
+    for name, joke in (('blocking', blocking_joke), ('executor', executor_joke), ('cache', jokes_cache.random)):
+        elapsed, latencies, lags = await _spam(joke, arguments.concurrency, arguments.rounds)
+        print(f"{name:>8}: {len(latencies) / elapsed:8.0f} jokes/s\n"
+              f"          joke latency {milliseconds(latencies)}\n"
+              f"          loop lag     {milliseconds(lags)}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=2, help="milliseconds for each mongo round trip")
+    parser.add_argument('--jokes', type=int, default=1000)
+    asyncio_run(main(parser.parse_args()))
@@ -0,0 +1,51 @@
+"""
+Latency of `.joke` one at a time, before the jokes cache (a count and a $sample aggregate through the mongo
+executor) and after it, where misses load the whole collection and every other joke is a hit.
+An in-process fake collection stands in for mongo, blocking for a fixed latency on every round trip.
+"""
+from argparse import ArgumentParser
+from asyncio import run as asyncio_run
+from time import perf_counter
+
+from common import fake_mongo_util, milliseconds
+from fakes import FakeDatabase
+from src.extensions.mortadella import JokesCache
+
+_COLLECTION = 'mortadella.jokes'
+
+
+async def _measure(joke, amount):
+    latencies = []
+    for _ in range(amount):
+        start = perf_counter()
+        await joke()
+        latencies.append(perf_counter() - start)
+    return latencies
+
+
+async def main(arguments):
+    database = FakeDatabase(arguments.latency / 1000)
+    for i in range(arguments.jokes):
+        database[_COLLECTION].documents[i] = {'_id': i, 'joke': f"joke number {i} about something"}
+    mongo_util = fake_mongo_util(database)
+    collection = database[_COLLECTION]
+
+    async def sample_joke():
+        if await mongo_util.run(collection.count_documents, {}):
+            return next(await mongo_util.run(collection.aggregate, [{'$sample': {'size': 1}}]))['joke']
+
+    jokes_cache = JokesCache(mongo_util, _COLLECTION, 600, 300)
+    print(f"{arguments.amount} jokes, {arguments.latency}ms mongo latency, {arguments.jokes} jokes in the collection")
+    print(f"  before: {milliseconds(await _measure(sample_joke, arguments.amount))}")
+    miss = await _measure(jokes_cache.random, 1)
+    hits = await _measure(jokes_cache.random, arguments.amount)
+    print(f"   after: {milliseconds(hits)}  (hits {jokes_cache.hits}, misses {jokes_cache.misses})")
+    print(f"    miss: {miss[0] * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--amount', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=1, help="milliseconds for each mongo round trip")
+    parser.add_argument('--jokes', type=int, default=5000)
+    asyncio_run(main(parser.parse_args()))
@@ -0,0 +1,55 @@
+"""
+Extractions and gap between replays of a looped track, replaying the info it was played with against extracting it
+again every time, like the player does when its stream url expired.
+Extractions are faked with a fixed delay, and a fake voice client plays the track for a fixed time.
+"""
+from argparse import ArgumentParser
+from asyncio import run as asyncio_run, Semaphore
+from time import time
+
+from common import milliseconds
+from fakes import FakeAudio, FakeBot, FakeChannel, FakeExtractionPool, FakeQueueStore, until
+from src.extensions import music
+from src.extensions.music import Track, VoiceState
+from src.utils.cache import LRUCache
+
+
+async def _loop(arguments):
+    channel = FakeChannel(10, play_time=arguments.play_time / 1000)
+    voice_state = VoiceState(FakeBot(), 1, channel, FakeQueueStore())
+    voice = voice_state.voice = await channel.connect()
+    voice_state.loop = True
+    voice_state.music_queue.put_nowait(Track('looped', 'https://video.test/looped', 1, 1))
+    await until(lambda: len(voice_state.voice.played) == arguments.times, timeout=600)
+    await voice_state.stop()
+    return voice.gaps
+
+
+def _run(arguments, expire):
+    # Fresh cache and counters for every run, so that nothing extracted before is found
+    music.YTDLSource.extraction_pool = FakeExtractionPool(arguments.extraction / 1000, expire)
+    music.YTDLSource.info_cache = LRUCache(16)
+    music.YTDLSource.extractions = 0
+    VoiceState._VoiceState__prefetch_semaphore = Semaphore(music._config['prefetch_concurrency'])
+    gaps = asyncio_run(_loop(arguments))
+    return music.YTDLSource.extractions, gaps
+
+
+def main(arguments):
+    music.YTDLSource._YTDLSource__create_audio = lambda self, position=0: FakeAudio()
+    # Tracks shorter than the failure time count as failed, and failed tracks are always extracted again
+    music._config['track_failure_time'] = arguments.play_time / 2000
+    print(f"looped track played {arguments.times} times for {arguments.play_time:.0f}ms, "
+          f"{arguments.extraction:.0f}ms extractions:")
+    for name, expire in (('replaying its info', 4000000000),
+                         ('extracting it again', int(time()) + music._config['info_cache_expiry_margin'] - 1)):
+        extractions, gaps = _run(arguments, expire)
+        print(f"  {name:>19}: {extractions:4} extractions, replay gap {milliseconds(gaps)}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--times', type=int, default=20, help="times the looped track plays")
+    parser.add_argument('--play-time', type=float, default=50, help="milliseconds the track plays")
+    parser.add_argument('--extraction', type=float, default=500, help="milliseconds each extraction takes")
+    main(parser.parse_args())
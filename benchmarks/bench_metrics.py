@@ -0,0 +1,94 @@
+"""
+Overhead of the metrics: recording samples, timing a command with the invoke hooks, rendering the prometheus text and
+serving scrapes from the bot loop, with the event loop lag scrapes cause.
+Metrics are filled like a busy bot would have them, with many commands, mongo operations and error types.
+"""
+from argparse import ArgumentParser
+from asyncio import get_running_loop as asyncio_get_running_loop, open_connection, run as asyncio_run, \
+    sleep as asyncio_sleep
+from random import random
+from socket import socket
+from time import perf_counter
+
+from common import milliseconds
+from fakes import LagMonitor
+from src.utils.metrics import Metrics
+
+
+def _per_call(operation, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        operation()
+    return (perf_counter() - start) / repeat
+
+
+def _fill(metrics, commands):
+    for i in range(commands):
+        for _ in range(20):
+            metrics.observe('command_duration_seconds', random(), command=f"command{i}")
+        metrics.increment('command_errors_total', command=f"command{i}", error='CommandInvokeError')
+        metrics.observe('mongo_operation_seconds', random() / 100, operation=f"operation{i}")
+    metrics.set_gauge('mongo_pending', lambda: 0)
+
+
+async def _scrape(port):
+    reader, writer = await open_connection('127.0.0.1', port)
+    writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def _free_port():
+    with socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def _serving(metrics, arguments):
+    # Scrapes one after the other, while the loop lag is measured like the bot samples it
+    port = _free_port()
+    metrics.start(3600, '127.0.0.1', port)
+    await asyncio_sleep(0.1)
+    monitor = LagMonitor(0.001)
+    lag_task = asyncio_get_running_loop().create_task(monitor.run())
+    latencies = []
+    for _ in range(arguments.scrapes):
+        start = perf_counter()
+        response = await _scrape(port)
+        latencies.append(perf_counter() - start)
+        await asyncio_sleep(0.01)
+    monitor.stop()
+    await lag_task
+    return len(response), latencies, monitor.lags
+
+
+def main(arguments):
+    metrics = Metrics()
+    print(f"microseconds for each call, over {arguments.repeat} calls:")
+    observe = _per_call(lambda: metrics.observe('bench_seconds', 0.01, command='joke'), arguments.repeat)
+    increment = _per_call(lambda: metrics.increment('bench_total', command='joke', error='Error'), arguments.repeat)
+    print(f"  observe:       {observe * 1e6:.2f}")
+    print(f"  increment:     {increment * 1e6:.2f}")
+
+    def hooked_command():
+        # What the before and after invoke hooks add to every command
+        invoked_at = perf_counter()
+        metrics.observe('command_duration_seconds', perf_counter() - invoked_at, command='joke')
+
+    print(f"  command hooks: {_per_call(hooked_command, arguments.repeat) * 1e6:.2f}")
+    _fill(metrics, arguments.commands)
+    series = len(metrics.histograms) + len(metrics.counters) + len(metrics.gauges)
+    print(f"{series} series, rendering: {_per_call(metrics.render, max(1, arguments.repeat // 1000)) * 1000:.2f}ms")
+    size, latencies, lags = asyncio_run(_serving(metrics, arguments))
+    print(f"{arguments.scrapes} scrapes of {size / 1024:.0f}KiB: {milliseconds(latencies)}")
+    print(f"  loop lag while scraping: {milliseconds(lags)}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200000)
+    parser.add_argument('--commands', type=int, default=100, help="commands and mongo operations with samples")
+    parser.add_argument('--scrapes', type=int, default=100)
+    main(parser.parse_args())
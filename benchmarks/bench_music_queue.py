@@ -0,0 +1,76 @@
+"""
+Microbenchmarks of MusicQueue operations on big queues, against the deque of the asyncio queue it replaced, which
+removed with `del`, paged with `islice` from the head and shuffled in place.
+"""
+from argparse import ArgumentParser
+from collections import deque
+from itertools import islice
+from random import randrange, shuffle as random_shuffle
+from time import perf_counter
+
+import common  # noqa: F401
+from src.extensions.music import MusicQueue, Track
+
+
+def _track(i):
+    return Track(f"{i}", f"https://video.test/{i}", 60 + i % 240, i % 50)
+
+
+def _time(operation, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        operation()
+    return (perf_counter() - start) / repeat
+
+
+def _benchmarks(size, mode):
+    queue = MusicQueue(mode)
+    for i in range(size):
+        queue.put_nowait(_track(i))
+    old = deque(_track(i) for i in range(size))
+    page = 10
+
+    def queue_remove_and_put():
+        queue.put_nowait(queue.remove(randrange(len(queue))))
+
+    def old_remove_and_put():
+        index = randrange(len(old))
+        track = old[index]
+        del old[index]
+        old.append(track)
+
+    def old_by_requester():
+        requester_id = randrange(50)
+        return [(i, track) for i, track in enumerate(old) if track.requester_id == requester_id]
+
+    def old_move():
+        index = randrange(len(old))
+        track = old[index]
+        del old[index]
+        old.insert(randrange(len(old)), track)
+
+    return {
+        'indexed access': (lambda: queue[randrange(size)], lambda: old[randrange(size)]),
+        'page': (lambda: queue[(start := randrange(size - page)):start + page],
+                 lambda: list(islice(old, (start := randrange(size - page)), start + page))),
+        'remove and put back': (queue_remove_and_put, old_remove_and_put),
+        'move': (lambda: queue.move(randrange(size), randrange(size)), old_move),
+        'my tracks': (lambda: queue.by_requester(randrange(50)), old_by_requester),
+        'shuffle': (queue.shuffle, lambda: random_shuffle(old)),
+    }
+
+
+def main(arguments):
+    print(f"{arguments.size} tracks queue, {arguments.mode} scheduling, microseconds for each operation:")
+    print(f"{'operation':>20}  {'MusicQueue':>12}  {'deque':>12}")
+    for name, (new, old) in _benchmarks(arguments.size, arguments.mode).items():
+        repeat = arguments.repeat if name != 'shuffle' else max(1, arguments.repeat // 100)
+        print(f"{name:>20}  {_time(new, repeat) * 1e6:12.1f}  {_time(old, repeat) * 1e6:12.1f}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--mode', choices=list(MusicQueue.schedulers), default='fair')
+    parser.add_argument('--repeat', type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,72 @@
+"""
+CPU time per stream of the pcm and opus playback modes, reading a local test audio file through YTDLSource as fast
+as possible, and encoding pcm frames to opus like the discord voice client does.
+Needs ffmpeg, to make the test file and to play it, and libopus, to encode pcm frames.
+"""
+from argparse import ArgumentParser
+from os.path import join as path_join
+from resource import getrusage, RUSAGE_CHILDREN, RUSAGE_SELF
+from shutil import which
+from subprocess import run as subprocess_run
+from sys import exit as sys_exit
+from tempfile import TemporaryDirectory
+
+from discord import opus as discord_opus
+
+import common  # noqa: F401
+from src.extensions import music
+from src.extensions.music import Track, YTDLSource
+
+
+def _cpu_times():
+    return getrusage(RUSAGE_SELF), getrusage(RUSAGE_CHILDREN)
+
+
+def _play(path, mode, volume, encoder):
+    # Read every frame of the file, then let ffmpeg exit, so that its cpu time is accounted to this process
+    music._config['playback_mode'] = mode
+    source = YTDLSource(Track('test', path, None, 0), data={'url': path, 'webpage_url': path, 'acodec': 'opus'})
+    start_self, start_children = _cpu_times()
+    source.start(volume)
+    frames = 0
+    while data := source.read():
+        frames += 1
+        if not source.is_opus():
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+    source.cleanup()
+    end_self, end_children = _cpu_times()
+    python = (end_self.ru_utime + end_self.ru_stime) - (start_self.ru_utime + start_self.ru_stime)
+    ffmpeg = (end_children.ru_utime + end_children.ru_stime) - (start_children.ru_utime + start_children.ru_stime)
+    return frames, python, ffmpeg
+
+
+def main(arguments):
+    if not which('ffmpeg'):
+        sys_exit("ffmpeg is needed to make the test audio file and to play it")
+    if not discord_opus.is_loaded():
+        discord_opus._load_default()
+    if not discord_opus.is_loaded():
+        sys_exit("libopus is needed to encode pcm frames like the discord voice client does")
+    # Local files need none of the stream reconnection options
+    YTDLSource._YTDLSource__ffmpeg_options = {**YTDLSource._YTDLSource__ffmpeg_options, 'before_options': ''}
+    encoder = discord_opus.Encoder()
+    with TemporaryDirectory() as directory:
+        path = path_join(directory, 'test.webm')
+        subprocess_run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+                        '-t', str(arguments.duration), '-ac', '2', '-c:a', 'libopus', '-b:a', '128k', path], check=True)
+        print(f"{arguments.duration}s opus test file, cpu seconds for each minute of audio:")
+        for name, mode, volume in (('pcm, volume 0.5', 'pcm', 0.5), ('opus, volume 0.5', 'opus', 0.5),
+                                   ('opus, volume 1 (copy)', 'opus', 1)):
+            runs = [_play(path, mode, volume, encoder) for _ in range(arguments.runs)]
+            frames = sum(frames for frames, _, _ in runs)
+            minutes = frames * 0.02 / 60
+            python = sum(python for _, python, _ in runs) / minutes
+            ffmpeg = sum(ffmpeg for _, _, ffmpeg in runs) / minutes
+            print(f"{name:>22}: python {python:6.3f}s  ffmpeg {ffmpeg:6.3f}s  total {python + ffmpeg:6.3f}s")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=int, default=60, help="seconds of test audio")
+    parser.add_argument('--runs', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+"""
+Memory of queues with thousands of tracks, as compact track records and as sources holding the whole yt-dlp info
+like queue entries used to, reporting resident memory and ffmpeg processes of the bot.
+Every case runs in its own interpreter, so that resident memory is not shared between them. Sources are built
+without starting them, so the ffmpeg process that each entry used to spawn comes on top of what is shown.
+"""
+from argparse import ArgumentParser
+from json import dumps as json_dumps, loads as json_loads
+from os import getpid, listdir
+from subprocess import run as subprocess_run
+from sys import argv, executable as sys_executable
+
+import common  # noqa: F401
+from src.extensions.music import MusicQueue, Track, YTDLSource
+
+
+def _rss():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+
+
+def _ffmpeg_processes():
+    # Children of any thread of the bot running ffmpeg
+    pid = getpid()
+    children = [child for task in listdir(f"/proc/{pid}/task")
+                for child in open(f"/proc/{pid}/task/{task}/children").read().split()]
+    return sum(b'ffmpeg' in open(f"/proc/{child}/cmdline", 'rb').read() for child in children)
+
+
+def _full_info(i):
+    # Roughly what yt-dlp returns for a video: formats with signed urls, thumbnails, captions and a description
+    url = f"https://rr{i % 9}---sn-test.googlevideo.com/videoplayback?expire=4000000000&id={i}&" + 'x' * 400
+    return {'id': f"{i:011d}", 'title': f"Track number {i}", 'uploader': 'someone', 'duration': 213,
+            'webpage_url': f"https://www.youtube.com/watch?v={i:011d}", 'upload_date': '20200101',
+            'thumbnail': f"https://i.ytimg.com/vi/{i:011d}/maxresdefault.jpg", 'url': url, 'acodec': 'opus',
+            'description': 'Lorem ipsum dolor sit amet. ' * 80, 'tags': [f"tag{j}" for j in range(30)],
+            'formats': [{'format_id': str(j), 'url': f"{url}&itag={j}", 'ext': 'webm', 'acodec': 'opus',
+                         'vcodec': 'none', 'abr': 50 + j, 'filesize': 3000000 + j, 'protocol': 'https',
+                         'http_headers': {'User-Agent': 'Mozilla/5.0 ' + 'y' * 100, 'Accept': '*/*'}}
+                        for j in range(25)],
+            'thumbnails': [{'url': f"https://i.ytimg.com/vi/{i:011d}/{j}.jpg", 'id': str(j), 'height': 90 + j,
+                            'width': 120 + j} for j in range(40)],
+            'automatic_captions': {f"l{j}": [{'ext': ext, 'url': f"https://www.youtube.com/api/timedtext?v={i}&"
+                                                             f"lang=l{j}&fmt={ext}"}
+                                             for ext in ('json3', 'srv1', 'srv2', 'srv3', 'ttml', 'vtt')]
+                                   for j in range(15)}}
+
+
+def _case(case, amount):
+    # Build the queue, then report how much it grew the process
+    start = _rss()
+    queue = MusicQueue('fifo')
+    sources = []
+    for i in range(amount):
+        info = _full_info(i)
+        track = Track.from_info(info, i % 50)
+        queue.put_nowait(track)
+        if case == 'sources':
+            sources.append(YTDLSource(track, data=info))
+    print(json_dumps({'rss': _rss() - start, 'processes': _ffmpeg_processes(), 'length': len(queue)}))
+
+
+def main(arguments):
+    print(f"{arguments.tracks} queued tracks:")
+    for case in ('tracks', 'sources'):
+        result = json_loads(subprocess_run([sys_executable, argv[0], '--case', case, '--tracks', str(arguments.tracks)],
+                                           capture_output=True, text=True, check=True).stdout)
+        print(f"{case:>8}: {result['rss'] / 2 ** 20:8.1f}MiB resident, "
+              f"{result['rss'] / result['length'] / 1024:6.1f}KiB per track, {result['processes']} ffmpeg processes")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--tracks', type=int, default=5000)
+    parser.add_argument('--case', choices=['tracks', 'sources'])
+    parsed = parser.parse_args()
+    if parsed.case:
+        _case(parsed.case, parsed.tracks)
+    else:
+        main(parsed)
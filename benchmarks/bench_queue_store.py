@@ -0,0 +1,122 @@
+"""
+Saving and restoring music players through the queue store.
+Saving: many guilds changing their queues at random times, written with one mongo write for each change and with
+the debounced and batched writes of the queue store, counting mongo round trips and event loop lag.
+Restoring: players saved before a crash, reconnected by a new music cog, measuring how long until all are back.
+An in-process fake collection stands in for mongo, blocking for a fixed latency on every round trip.
+"""
+from argparse import ArgumentParser
+from asyncio import gather as asyncio_gather, get_running_loop as asyncio_get_running_loop, run as asyncio_run, \
+    Semaphore, sleep as asyncio_sleep
+from random import uniform
+from time import perf_counter
+
+from pymongo import ReplaceOne
+
+from common import fake_mongo_util, milliseconds
+from fakes import FakeAudio, FakeBot, FakeChannel, FakeDatabase, FakeExtractionPool, FakeGuild, LagMonitor
+from src.extensions import music
+from src.extensions.music import QueueStore, Track, VoiceState
+
+_COLLECTION = music._config['queue_store_collection']
+
+
+class SavedPlayer(object):
+    """
+    Stand-in for the voice state of a guild, with a record of some queued tracks.
+    """
+
+    def __init__(self, guild_id, tracks):
+        self.guild_id = guild_id
+        self.tracks = tracks
+
+    def to_record(self):
+        return {'voice_channel_id': self.guild_id * 10, 'text_channel_id': self.guild_id * 10 + 1,
+                'tracks': [Track(f"{i}", f"https://video.test/{self.guild_id}/{i}", 60, 1).to_record()
+                           for i in range(self.tracks)], 'loop': False, 'volume': 0.5, 'queue_mode': 'fifo'}
+
+
+async def _save(arguments, write):
+    # Every guild changes its queue some times, at random moments of the same span
+    players = [SavedPlayer(guild_id, arguments.tracks) for guild_id in range(1, arguments.guilds + 1)]
+
+    async def changes(player):
+        for _ in range(arguments.changes):
+            await asyncio_sleep(uniform(0, arguments.span / arguments.changes))
+            await write(player)
+
+    monitor = LagMonitor()
+    lag_task = asyncio_get_running_loop().create_task(monitor.run())
+    start = perf_counter()
+    await asyncio_gather(*(changes(player) for player in players))
+    elapsed = perf_counter() - start
+    monitor.stop()
+    await lag_task
+    return elapsed, monitor.lags
+
+
+async def _saving(arguments, mongo_util, database):
+    print(f"saving {arguments.guilds} guilds, {arguments.changes} changes each over {arguments.span}s:")
+    collection = database[_COLLECTION]
+
+    async def write_each(player):
+        await mongo_util.run(collection.bulk_write, [ReplaceOne({'_id': player.guild_id}, player.to_record(),
+                                                                upsert=True)], ordered=False)
+
+    collection.round_trips = 0
+    elapsed, lags = await _save(arguments, write_each)
+    print(f"  write each change: {collection.round_trips:6d} round trips in {elapsed:.2f}s, lag {milliseconds(lags)}")
+
+    store = QueueStore(_COLLECTION, arguments.delay)
+
+    async def mark(player):
+        store.mark(player.guild_id, player)
+
+    collection.round_trips = 0
+    elapsed, lags = await _save(arguments, mark)
+    await store.close()
+    print(f"    queue store ({arguments.delay}s): {collection.round_trips:6d} round trips in {elapsed:.2f}s, "
+          f"lag {milliseconds(lags)}")
+
+
+async def _restoring(arguments, database):
+    # Saved players of every guild are already in mongo, like after a crash
+    guilds = [FakeGuild(guild_id, [FakeChannel(guild_id * 10, play_time=3600), FakeChannel(guild_id * 10 + 1)])
+              for guild_id in range(1, arguments.guilds + 1)]
+    collection = database[_COLLECTION]
+    collection.round_trips = 0
+    cog = music.Music(FakeBot(guilds))
+    start = perf_counter()
+    await cog.cog_load()
+    while len(cog.voice_states) < arguments.guilds:
+        await asyncio_sleep(0.001)
+    restored = perf_counter() - start
+    while not all(voice_state.voice.played for voice_state in cog.voice_states.values()):
+        await asyncio_sleep(0.001)
+    playing = perf_counter() - start
+    tracks = sum(len(voice_state.music_queue) + 1 for voice_state in cog.voice_states.values())
+    await cog.cog_unload()
+    print(f"restoring {arguments.guilds} guilds after a crash, {tracks} tracks: reconnected in {restored:.3f}s, "
+          f"all playing in {playing:.3f}s, {collection.round_trips} round trips")
+
+
+async def main(arguments):
+    database = FakeDatabase(arguments.latency / 1000)
+    mongo_util = fake_mongo_util(database)
+    music.YTDLSource.extraction_pool = FakeExtractionPool()
+    music.YTDLSource._YTDLSource__create_audio = lambda self, position=0: FakeAudio()
+    VoiceState._VoiceState__prefetch_semaphore = Semaphore(music._config['prefetch_concurrency'])
+    music._config['prewarm'] = False
+    await _saving(arguments, mongo_util, database)
+    await _restoring(arguments, database)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, default=500)
+    parser.add_argument('--tracks', type=int, default=20, help="queued tracks of every guild")
+    parser.add_argument('--changes', type=int, default=20, help="queue changes of every guild")
+    parser.add_argument('--span', type=float, default=2, help="seconds over which changes happen")
+    parser.add_argument('--delay', type=float, default=0.5, help="seconds the queue store waits before writing")
+    parser.add_argument('--latency', type=float, default=1, help="milliseconds for each mongo round trip")
+    asyncio_run(main(parser.parse_args()))
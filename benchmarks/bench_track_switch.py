@@ -0,0 +1,56 @@
+"""
+Gap between songs, from the end of a track to the start of the next one, with and without prefetching the next
+queued tracks while the current one plays.
+Extractions are faked with a fixed delay, and fake voice clients play every track for a fixed time.
+"""
+from argparse import ArgumentParser
+from asyncio import gather as asyncio_gather, run as asyncio_run, Semaphore, sleep as asyncio_sleep
+
+from common import milliseconds
+from fakes import FakeAudio, FakeBot, FakeChannel, FakeExtractionPool, FakeQueueStore
+from src.extensions import music
+from src.extensions.music import Track, VoiceState
+from src.utils.cache import LRUCache
+
+
+async def _play(arguments, prefetch_amount):
+    music._config['prefetch_amount'] = prefetch_amount
+    music.YTDLSource.info_cache = LRUCache(music._config['info_cache_size'])
+    bot = FakeBot()
+    queue_store = FakeQueueStore()
+    voice_states = []
+    for guild_id in range(1, arguments.guilds + 1):
+        channel = FakeChannel(guild_id, play_time=arguments.play_time / 1000)
+        voice_state = VoiceState(bot, guild_id, channel, queue_store)
+        voice_state.voice = await channel.connect()
+        # Unresolved entries, like the ones of playlists
+        for index in range(arguments.tracks):
+            voice_state.music_queue.put_nowait(Track(f"{index}", f"https://video.test/{guild_id}/{index}", 1, 1))
+        voice_states.append(voice_state)
+    while any(len(voice_state.voice.played) < arguments.tracks or voice_state.voice.is_playing()
+              for voice_state in voice_states):
+        await asyncio_sleep(0.01)
+    gaps = [gap for voice_state in voice_states for gap in voice_state.voice.gaps]
+    await asyncio_gather(*(voice_state.stop() for voice_state in voice_states))
+    return gaps
+
+
+async def main(arguments):
+    # Prefetched info goes through the info cache like it does in the bot, only extractions are slow
+    music.YTDLSource.extraction_pool = FakeExtractionPool(arguments.extraction / 1000)
+    music.YTDLSource._YTDLSource__create_audio = lambda self, position=0: FakeAudio()
+    VoiceState._VoiceState__prefetch_semaphore = Semaphore(music._config['prefetch_concurrency'])
+    prefetch_amount = music._config['prefetch_amount']
+    print(f"{arguments.guilds} guilds playing {arguments.tracks} tracks of {arguments.play_time:.0f}ms, "
+          f"{arguments.extraction:.0f}ms extractions")
+    print(f"without prefetch: {milliseconds(await _play(arguments, 0))}")
+    print(f"   with prefetch: {milliseconds(await _play(arguments, prefetch_amount))}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--tracks', type=int, default=5)
+    parser.add_argument('--play-time', type=float, default=1000, help="milliseconds each track plays")
+    parser.add_argument('--extraction', type=float, default=500, help="milliseconds each extraction takes")
+    asyncio_run(main(parser.parse_args()))
@@ -0,0 +1,30 @@
+from math import ceil as math_ceil
+from os import chdir, environ
+from os.path import abspath, dirname, join as path_join
+from sys import path as sys_path
+
+# Benchmarks run from anywhere like the bot does from the repository root, sharing the fakes of the tests
+_root = dirname(dirname(abspath(__file__)))
+chdir(_root)
+environ.setdefault('BOT_CONFIG', 'bot_config.json')
+sys_path.insert(0, path_join(_root, 'bot'))
+sys_path.insert(0, path_join(_root, 'tests'))
+
+
+def quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, math_ceil(q * len(values)) - 1)] if values else 0.0
+
+
+def milliseconds(values):
+    # Summary of durations in seconds, in milliseconds
+    return (f"p50 {quantile(values, 0.5) * 1000:8.2f}ms  p99 {quantile(values, 0.99) * 1000:8.2f}ms  "
+            f"max {max(values, default=0.0) * 1000:8.2f}ms")
+
+
+def fake_mongo_util(database):
+    # Real mongo utility, with its executor and breaker, in front of an in-process fake database
+    from src.utils.mongo import MongoUtil
+    mongo_util = MongoUtil('mongodb://127.0.0.1:1', 8)
+    MongoUtil._MongoUtil__db = database
+    return mongo_util
@@ -0,0 +1,81 @@
+from argparse import ArgumentParser
+from json import load as json_load
+from logging import basicConfig as logging_basicConfig, getLogger, INFO
+from os import environ, getenv as os_getenv
+from os.path import dirname, join as path_join
+from subprocess import Popen
+from sys import executable
+from time import sleep
+from urllib.request import Request, urlopen
+
+# Setting up basic config and root logger
+logging_basicConfig(format='[%(asctime)s] [%(name)-24s] [%(levelname)-8s] - %(message)s',
+                    datefmt="%Y-%m-%d %H:%M:%S", level=INFO)
+logger = getLogger('launcher')
+
+# Get bot level config
+with open(path_join('bot', os_getenv('BOT_CONFIG')), 'r', encoding='utf-8') as f:
+    _bot_config = json_load(f)
+
+
+def recommended_shard_count(token):
+    # Ask discord how many shards the bot should use
+    request = Request('https://discord.com/api/v10/gateway/bot',
+                      headers={'Authorization': f"Bot {token}", 'User-Agent': f"DiscordBot ({_bot_config['url']})"})
+    with urlopen(request, timeout=10) as response:
+        return json_load(response)['shards']
+
+
+def cluster_shards(shard_count, clusters):
+    # Contiguous ranges of shards, as even as possible, one for each cluster
+    return [list(range(cluster * shard_count // clusters, (cluster + 1) * shard_count // clusters))
+            for cluster in range(clusters)]
+
+
+def start_cluster(cluster_id, shard_ids, shard_count):
+    # Every cluster is a brand new interpreter, so nothing is inherited from the launcher
+    env = {**environ, 'CLUSTER_ID': str(cluster_id), 'SHARD_IDS': ','.join(map(str, shard_ids)),
+           'SHARD_COUNT': str(shard_count)}
+    if cluster_id < len(_bot_config['cluster_configs']):
+        env['BOT_CONFIG'] = _bot_config['cluster_configs'][cluster_id]
+    logger.info(f"Starting cluster {cluster_id} with shards {shard_ids} and config {env['BOT_CONFIG']}")
+    return Popen([executable, path_join(dirname(__file__), 'main.py')], env=env)
+
+
+def main():
+    parser = ArgumentParser(description="Run the bot as multiple processes, each one with a cluster of shards.")
+    parser.add_argument('--clusters', type=int, default=_bot_config['clusters'], help="number of processes")
+    parser.add_argument('--shards', type=int, default=_bot_config['shard_count'], help="total number of shards")
+    parser.add_argument('--dry-run', action='store_true', help="only show how shards are assigned to clusters")
+    args = parser.parse_args()
+    shard_count = args.shards or recommended_shard_count(os_getenv('DISCORD_TOKEN'))
+    assignment = cluster_shards(shard_count, min(args.clusters, shard_count))
+    if args.dry_run:
+        for cluster_id, shard_ids in enumerate(assignment):
+            print(f"Cluster {cluster_id}: shards {shard_ids} of {shard_count}")
+        return
+    clusters = {cluster_id: start_cluster(cluster_id, shard_ids, shard_count)
+                for cluster_id, shard_ids in enumerate(assignment)}
+    try:
+        # Restart clusters that crashed, and stop once all of them were shut down on purpose
+        while clusters:
+            sleep(_bot_config['cluster_restart_delay'])
+            for cluster_id, process in list(clusters.items()):
+                if process.poll() is None:
+                    continue
+                if process.returncode:
+                    logger.error(f"Cluster {cluster_id} exited with code {process.returncode}, restarting")
+                    clusters[cluster_id] = start_cluster(cluster_id, assignment[cluster_id], shard_count)
+                else:
+                    logger.info(f"Cluster {cluster_id} shut down")
+                    del clusters[cluster_id]
+    except KeyboardInterrupt:
+        logger.info("Stopping every cluster")
+        for process in clusters.values():
+            process.terminate()
+        for process in clusters.values():
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
-from asyncio import run as asyncio_run
+from asyncio import gather as asyncio_gather, get_running_loop as asyncio_get_running_loop, run as asyncio_run
 from json import load as json_load
 from logging import basicConfig as logging_basicConfig, getLogger, INFO
 from os import getenv as os_getenv
 from os.path import join as path_join
+from time import perf_counter
 from urllib.parse import quote_plus
 
 import discord
 from discord.ext import commands as discord_commands
 
+from src.utils.metrics import Metrics
 from src.utils.mongo import MongoUtil
 
 # Setting up basic config and root logger
@@ -21,12 +23,24 @@ with open(path_join('bot', os_getenv('BOT_CONFIG')), 'r', encoding='utf-8') as f
 __intents = discord.Intents.default()
 __intents.message_content = True
 __intents.voice_states = True
-bot = discord_commands.Bot(command_prefix=_bot_config['command_prefix'],
-                           case_insensitive=True,
-                           description=_bot_config['bot_description'],
-                           intents=__intents)
+__bot_options = dict(command_prefix=_bot_config['command_prefix'],
+                     case_insensitive=True,
+                     description=_bot_config['bot_description'],
+                     intents=__intents)
+# Cluster and shards are given by the launcher, a single process runs every shard otherwise
+__cluster_id = int(os_getenv('CLUSTER_ID', '0'))
+if _bot_config['sharded']:
+    bot = discord_commands.AutoShardedBot(
+        shard_ids=[int(shard_id) for shard_id in os_getenv('SHARD_IDS').split(',')] if os_getenv('SHARD_IDS') else None,
+        shard_count=int(os_getenv('SHARD_COUNT')) if os_getenv('SHARD_COUNT') else _bot_config['shard_count'],
+        **__bot_options)
+else:
+    bot = discord_commands.Bot(**__bot_options)
 __token = os_getenv('DISCORD_TOKEN')
 __embeds_color = int(_bot_config['embeds_color'], 16)
+# Startup phases durations, reported once the bot is ready
+__startup_start = perf_counter()
+__startup_times: dict[str, float] = {}
 
 
 @bot.event
@@ -36,6 +50,13 @@ async def on_ready():
                               activity=discord.Activity(type=discord.ActivityType.listening,
                                                         name=f'{bot.command_prefix}help'))
     logger.info(f"Odoaldo is online: command prefix is {bot.command_prefix}")
+    if __startup_times:
+        __startup_times['ready'] = perf_counter() - __startup_start
+        logger.info("Startup times: " + ', '.join(f"{phase} {seconds:.2f}s"
+                                                  for phase, seconds in __startup_times.items()))
+        __startup_times.clear()
+    if bot.shard_count:
+        logger.info(f"Cluster {__cluster_id} is running shards {sorted(bot.shards)} of {bot.shard_count}")
 
 
 @bot.event
@@ -44,6 +65,17 @@ async def on_command(ctx: discord_commands.Context):
                 f"invoked by @{ctx.author.name} in #{ctx.channel.name}")
 
 
+@bot.before_invoke
+async def before_invoke(ctx: discord_commands.Context):
+    ctx.invoked_at = perf_counter()
+
+
+@bot.after_invoke
+async def after_invoke(ctx: discord_commands.Context):
+    # Time spent by every command, whether it failed or not
+    Metrics().observe('command_duration_seconds', perf_counter() - ctx.invoked_at, command=ctx.command.qualified_name)
+
+
 @bot.event
 async def on_command_completion(ctx: discord_commands.Context):
     logger.info(f"Command {bot.command_prefix}{ctx.command} successfully executed")
@@ -52,6 +84,8 @@ async def on_command_completion(ctx: discord_commands.Context):
 @bot.event
 async def on_command_error(ctx: discord_commands.Context, error: discord_commands.CommandError):
     logger.error(f"{error.__class__.__name__}: {error}")
+    Metrics().increment('command_errors_total', command=ctx.command.qualified_name if ctx.command else 'unknown',
+                        error=type(error).__name__)
     # Match type of error
     match error:
         case discord_commands.CommandNotFound():
@@ -102,6 +136,40 @@ async def shutdown(ctx: discord_commands.Context):
     await bot.close()
 
 
+@bot.command(name='stats',
+             aliases=['metrics'],
+             brief=_bot_config['stats_brief'],
+             description=_bot_config['stats_description'])
+@discord_commands.has_permissions(administrator=True)
+async def stats(ctx: discord_commands.Context):
+    metrics = Metrics()
+    embed_msg = discord.Embed(title="Stats", color=__embeds_color)
+    # Slowest commands first, with their errors
+    errors = {}
+    for labels, count in metrics.labelled(metrics.counters, 'command_errors_total'):
+        errors[labels['command']] = errors.get(labels['command'], 0) + count
+    commands = sorted(metrics.labelled(metrics.histograms, 'command_duration_seconds'),
+                      key=lambda item: item[1].quantile(0.95), reverse=True)
+    embed_msg.add_field(name="Commands", inline=False, value='\n'.join(
+        f"`{labels['command']}` {histogram.count} runs, {errors.get(labels['command'], 0)} errors, "
+        f"mean {histogram.mean * 1000:.0f}ms, p95 ≤ {histogram.quantile(0.95) * 1000:.0f}ms"
+        for labels, histogram in commands[:_bot_config['stats_commands']]) or "No commands yet")
+    operations = sorted(metrics.labelled(metrics.histograms, 'mongo_operation_seconds'),
+                        key=lambda item: item[1].count, reverse=True)
+    embed_msg.add_field(name="Mongo", inline=False, value='\n'.join(
+        f"`{labels['operation']}` {histogram.count} ops, mean {histogram.mean * 1000:.1f}ms, "
+        f"p95 ≤ {histogram.quantile(0.95) * 1000:.0f}ms"
+        for labels, histogram in operations[:_bot_config['stats_commands']]) or "No operations yet")
+    loop_lag = metrics.histogram('event_loop_lag_seconds')
+    if loop_lag:
+        embed_msg.add_field(name="Event loop lag", value=f"mean {loop_lag.mean * 1000:.1f}ms, "
+                                                         f"p99 ≤ {loop_lag.quantile(0.99) * 1000:.0f}ms")
+    embed_msg.add_field(name="Gauges", value='\n'.join(
+        f"`{name}` {func()}" for (name, _), func in metrics.gauges.items()) or "Nothing")
+    embed_msg.add_field(name="Gateway latency", value=f"{bot.latency * 1000:.0f}ms")
+    await ctx.send(embed=embed_msg)
+
+
 @bot.command(name='getextensions',
              aliases=['getexts', 'gexts', 'extensions', 'exts'],
              brief=_bot_config['get_extensions_brief'],
@@ -220,6 +288,33 @@ async def reload_extensions(ctx: discord_commands.Context,
     await ctx.send(embed=embed_msg)
 
 
+async def timed(phase, coro):
+    # Await a startup phase, keeping track of how long it took
+    start = perf_counter()
+    try:
+        return await coro
+    finally:
+        __startup_times[phase] = perf_counter() - start
+
+
+async def load_extension(extension):
+    try:
+        await bot.load_extension(_bot_config['extensions_directory'] + extension)
+        logger.info(f"{extension} extension loaded")
+    except Exception as e:
+        logger.error(f"Failed to load {extension} extension: [{type(e).__name__}: {e}]")
+
+
+async def load_init_data(mongo_util):
+    # Extensions only read init data when commands use it, so loading it does not hold back connecting
+    start = perf_counter()
+    try:
+        await mongo_util.run(mongo_util.load_init_data, deadline=_bot_config['mongo_init_data_timeout'])
+        logger.info(f"Mongo init data ready in {perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.error(f"Failed to load mongo init data: [{type(e).__name__}: {e}]")
+
+
 async def main():
     # Log basic bot information
     logger.info(f"{'-' * 80}")
@@ -232,26 +327,34 @@ async def main():
     mongo_uri = 'mongodb://%s:%s@%s:%s' % (
         quote_plus(os_getenv('MONGO_USER')), quote_plus(os_getenv('MONGO_PASSWORD')),
         os_getenv('MONGO_HOST'), os_getenv('MONGO_PORT'))
-    mongo_util = MongoUtil(mongo_uri=mongo_uri)
-    # Test reachability
-    ping = mongo_util.ping()
+    mongo_util = MongoUtil(mongo_uri=mongo_uri, max_workers=_bot_config['mongo_max_workers'],
+                           options=_bot_config['mongo_options'])
+    Metrics().set_gauge('mongo_pending', lambda: mongo_util.pending)
+    # Every cluster serves its metrics on its own port
+    Metrics().start(_bot_config['loop_lag_interval'], _bot_config['metrics_host'],
+                    _bot_config['metrics_port'] and _bot_config['metrics_port'] + __cluster_id)
+    # Log in first, it is quick and gives extensions a running bot to start their background tasks on
+    await timed('login', bot.login(__token))
+    logger.info(f"Available extensions: {_bot_config['available_extensions']}")
+    logger.info(f"Loading startup extensions: {_bot_config['startup_extensions']}")
+    # Test mongo reachability while loading startup extensions, since they only use mongo later on
+    ping, _ = await asyncio_gather(
+        timed('mongo ping', mongo_util.run(mongo_util.ping)),
+        timed('extensions', asyncio_gather(*(load_extension(extension)
+                                             for extension in _bot_config['startup_extensions']))))
     if ping:
         logger.critical("Odoaldo won't raise from the sandwiches' crumbles")
         logger.critical(f"Failed to locate and connect to mongo instance: [{type(ping).__name__}: {ping}]")
-    else:
-        logger.info("Mongo instance is reachable")
-        # Load extensions' init data
-        mongo_util.load_init_data()
-        logger.info(f"Available extensions: {_bot_config['available_extensions']}")
-        logger.info(f"Loading startup extensions: {_bot_config['startup_extensions']}")
-        # Try and load startup extensions
-        for extension in _bot_config['startup_extensions']:
-            try:
-                await bot.load_extension(_bot_config['extensions_directory'] + extension)
-                logger.info(f"{extension} extension loaded")
-            except Exception as e:
-                logger.error(f"Failed to load {extension} extension: [{type(e).__name__}: {e}]")
-        await bot.start(__token)
+        await bot.close()
+        return
+    logger.info("Mongo instance is reachable")
+    # Init data is loaded while connecting, only once for all clusters
+    init_data = asyncio_get_running_loop().create_task(load_init_data(mongo_util)) if not __cluster_id else None
+    try:
+        await bot.connect()
+    finally:
+        if init_data:
+            init_data.cancel()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,15 @@
+from asyncio import get_running_loop as asyncio_get_running_loop, shield as asyncio_shield, TimeoutError, \
+    wait_for as asyncio_wait_for
 from json import load as json_load
 from logging import getLogger
 from os import getenv as os_getenv
 from os.path import join as path_join
 
-from discord import Embed as DiscordEmbed
+from discord import Embed as DiscordEmbed, Member as DiscordMember
 from discord.ext import commands as discord_commands
 
 from ..utils.mongo import MongoUtil
+from ..utils.purge import PurgeEngine
 
 # Setting up extension logger
 logger = getLogger(__name__.split('.', 1)[-1])
@@ -18,6 +21,15 @@ with open(path_join('bot', 'src', 'extensions', 'core.json'), 'r', encoding='utf
     _config = json_load(f)
 
 
+class ClearFlags(discord_commands.FlagConverter, delimiter=' ', prefix='--'):
+    """
+    Optional filters of the clear command.
+    """
+
+    author: DiscordMember = discord_commands.flag(default=None, description=_config['clear_author'])
+    contains: str = discord_commands.flag(default=None, description=_config['clear_contains'])
+
+
 class Core(discord_commands.Cog):
     """
     Core bot extension.
@@ -35,9 +47,41 @@ class Core(discord_commands.Cog):
                               description=_config['clear_description'])
     @discord_commands.has_permissions(administrator=True)
     async def clear(self, ctx: discord_commands.Context,
-                    amount: int = discord_commands.parameter(default=1, description=_config['clear_amount'])):
-        logger.info(f"Clearing {amount} messages from #{ctx.channel}")
-        await ctx.channel.purge(limit=amount + 1)
+                    amount: int = discord_commands.parameter(default=1, description=_config['clear_amount']), *,
+                    flags: ClearFlags):
+        contains = flags.contains.lower() if flags.contains else None
+        check = None
+        if flags.author or contains:
+            def check(message):
+                return ((not flags.author or message.author.id == flags.author.id)
+                        and (not contains or contains in message.content.lower()))
+        logger.info(f"Clearing {amount} messages from #{ctx.channel}"
+                    f"{f' by {flags.author}' if flags.author else ''}"
+                    f"{f' containing `{flags.contains}`' if flags.contains else ''}")
+        engine = PurgeEngine(ctx.channel, limit=amount, check=check, before=ctx.message,
+                             max_scan=_config['clear_max_scan'], queue_size=_config['clear_queue_size'])
+        await ctx.message.delete()
+        status = await ctx.send(embed=self.__clear_embed(engine))
+        purge = asyncio_get_running_loop().create_task(engine.run())
+        try:
+            # Progress is shown by editing a single message, not more often than its own rate limit allows
+            while not purge.done():
+                try:
+                    await asyncio_wait_for(asyncio_shield(purge), _config['clear_progress_interval'])
+                except TimeoutError:
+                    await status.edit(embed=self.__clear_embed(engine))
+            # Purge errors go to the command error handler
+            await purge
+            await status.edit(embed=self.__clear_embed(engine))
+        finally:
+            await status.delete(delay=_config['clear_status_delete_after'])
+
+    def __clear_embed(self, engine):
+        message = _config['clear_done_message'] if engine.elapsed else _config['clear_progress_message']
+        return DiscordEmbed(description=message.format(deleted=engine.deleted, matched=engine.matched,
+                                                       amount=engine.limit, scanned=engine.scanned,
+                                                       elapsed=engine.elapsed),
+                            color=self.__embeds_color)
 
     @discord_commands.command(name='ping',
                               aliases=['marco'],
@@ -81,7 +125,10 @@ class Core(discord_commands.Cog):
                               description=_config['reset_database_description'])
     @discord_commands.has_permissions(administrator=True)
     async def reset_database(self, ctx: discord_commands.Context):
-        self.__mongo_util.load_init_data(reset=True)
+        await self.__mongo_util.run(self.__mongo_util.load_init_data, reset=True,
+                                    deadline=_bot_config['mongo_init_data_timeout'])
+        # Let extensions drop their cached data
+        self.bot.dispatch('database_reset')
         embed_msg = DiscordEmbed(description=_config['reset_database_message'], color=self.__embeds_color)
         await ctx.send(embed=embed_msg)
 
@@ -1,12 +1,14 @@
+from asyncio import get_running_loop as asyncio_get_running_loop, Task
 from io import StringIO
 from json import load as json_load
 from logging import getLogger
 from os.path import join as path_join
 
-from arithmetic_dice_roller.roller import Roller as ArithmeticDiceRoller, RollerError as ArithmeticDiceRollerError
 from discord import Embed as DiscordEmbed, File as DiscordFile
 from discord.ext import commands as discord_commands
 
+from ..utils.dice import DiceError, DicePool
+
 # Setting up extension logger
 logger = getLogger(__name__.split('.', 1)[-1])
 
@@ -24,6 +26,30 @@ class Games(discord_commands.Cog):
         self.bot = bot
         self.description = _config['extension_description']
         self.__embeds_color = int(_config['embeds_color'], 16)
+        # Rolls run in their own processes, which are the only ones importing the roller
+        self.dice_pool = DicePool(workers=_config['dice_workers'], max_pending=_config['dice_max_pending'],
+                                  cpu_timeout=_config['dice_cpu_timeout'], limits=_config['dice_limits'],
+                                  rejections_size=_config['dice_rejections_size'],
+                                  rejections_ttl=_config['dice_rejections_ttl'])
+        self.__prewarm_task: Task = None
+
+    async def cog_load(self):
+        if _config['prewarm']:
+            self.__prewarm_task = asyncio_get_running_loop().create_task(self.prewarm())
+
+    async def cog_unload(self):
+        if self.__prewarm_task:
+            self.__prewarm_task.cancel()
+        self.dice_pool.shutdown()
+
+    async def prewarm(self):
+        # Start roller processes in the background once connected, so that the first roll does not wait for them
+        await self.bot.wait_until_ready()
+        try:
+            await self.dice_pool.warm()
+            logger.info("Dice roller ready")
+        except DiceError as e:
+            logger.warning(f"Failed to start dice roller: [{type(e).__name__}: {e}]")
 
     @discord_commands.command(name='rolldice',
                               aliases=['roll', 'r', 'rolld', 'rdice', 'rd'],
@@ -33,27 +59,27 @@ class Games(discord_commands.Cog):
                         expression: str = discord_commands.parameter(description=_config['roll_dice_expression']),
                         *,
                         label: str = discord_commands.parameter(default=None, description=_config['roll_dice_label'])):
-        # Create roller for expression
-        roller = ArithmeticDiceRoller(expression, label)
+        # Roll expression away from the event loop
         try:
-            roller.roll()
+            roll = await self.dice_pool.roll(expression, label)
             # Compose embed with roll information
-            embed_msg = DiscordEmbed(title=roller.label if roller.label else "No label roll", color=self.__embeds_color)
+            embed_msg = DiscordEmbed(title=roll['label'] if roll['label'] else "No label roll",
+                                     color=self.__embeds_color)
             embed_msg.add_field(name="Requested by", value=ctx.author.mention)
-            embed_msg.add_field(name="Original expression", value=f"```{roller.expression}```", inline=False)
+            embed_msg.add_field(name="Original expression", value=f"```{roll['expression']}```", inline=False)
             # And create text file with full roll breakdown
             file_roll_info = StringIO()
-            file_roll_info.write(f"Original expression:\n{roller.expression}\n\n"
-                                 f"Expanded expression:\n{roller.no_nx_expression}\n\n"
-                                 f"Rolls:\n" + '\n'.join(f" - {roll[0]} = {roll[1]} {roll[2]}" for roll in roller.rolls)
-                                 + "\n\n" + f"Evaluated expression:\n{roller.no_dice_expression}\n\n"
-                                            f"Final result: {roller.final_result}")
+            file_roll_info.write(f"Original expression:\n{roll['expression']}\n\n"
+                                 f"Expanded expression:\n{roll['no_nx_expression']}\n\n"
+                                 f"Rolls:\n" + '\n'.join(f" - {r[0]} = {r[1]} {r[2]}" for r in roll['rolls'])
+                                 + "\n\n" + f"Evaluated expression:\n{roll['no_dice_expression']}\n\n"
+                                              f"Final result: {roll['final_result']}")
             file_roll_info.seek(0)
-            embed_msg.add_field(name="Final result", value=f"```{roller.final_result}```")
+            embed_msg.add_field(name="Final result", value=f"```{roll['final_result']}```")
             # Send both message and text file
             await ctx.send(embed=embed_msg)
             await ctx.send(file=DiscordFile(file_roll_info, 'rollinfo.txt'))
-        except ArithmeticDiceRollerError as error:
+        except DiceError as error:
             raise discord_commands.CommandInvokeError(error)
 
 
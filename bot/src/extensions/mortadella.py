@@ -1,11 +1,21 @@
-from json import load as json_load
+from asyncio import Lock
+from io import BytesIO, TextIOWrapper
+from itertools import islice
+from json import dumps as json_dumps, load as json_load
 from logging import getLogger
-from os.path import join as path_join
+from os.path import join as path_join, splitext
+from random import choice as random_choice
+from re import compile as re_compile
+from tempfile import SpooledTemporaryFile
+from time import monotonic
+from unicodedata import normalize as unicode_normalize
 
-from discord import Embed as DiscordEmbed
+from discord import ButtonStyle, Embed as DiscordEmbed, File as DiscordFile, Interaction, ui as discord_ui
 from discord.ext import commands as discord_commands
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
-from ..utils.mongo import MongoUtil
+from ..utils.metrics import Metrics
+from ..utils.mongo import iter_json_array, MongoUtil
 
 # Setting up extension logger
 logger = getLogger(__name__.split('.', 1)[-1])
@@ -15,6 +25,132 @@ with open(path_join('bot', 'src', 'extensions', 'mortadella.json'), 'r', encodin
     _config = json_load(f)
 
 
+# Words used for searching jokes
+_WORD = re_compile(r'\w+')
+
+
+def normalize_joke(joke: str):
+    # Jokes differing only in case, width or spacing are the same joke
+    return ' '.join(unicode_normalize('NFKC', joke).casefold().split())
+
+
+def joke_words(text: str):
+    return set(_WORD.findall(normalize_joke(text)))
+
+
+class JokesCache:
+    """
+    In memory jokes cache, for constant time random sampling, with an inverted index of words for searching.
+    """
+
+    def __init__(self, mongo_util: MongoUtil, collection: str, ttl: float, load_timeout: float):
+        self.__mongo_util = mongo_util
+        self.__collection = collection
+        self.__ttl = ttl
+        self.__load_timeout = load_timeout
+        self.__jokes: list[str] = []
+        self.__index: dict[str, set[int]] = {}
+        self.__loaded_at: float = None
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.__jokes)
+
+    @property
+    def is_stale(self):
+        return self.__loaded_at is None or monotonic() - self.__loaded_at > self.__ttl
+
+    async def random(self):
+        # Reload jokes when expired, then pick one in constant time
+        if self.is_stale:
+            self.misses += 1
+            await self.refresh()
+        else:
+            self.hits += 1
+        return random_choice(self.__jokes) if self.__jokes else None
+
+    async def refresh(self):
+        async with self.__lock:
+            # Concurrent misses only need one reload
+            if not self.is_stale:
+                return
+            # Walking the whole collection takes longer than a single operation is allowed to
+            self.__jokes = await self.__mongo_util.run(self.__load_jokes, deadline=self.__load_timeout)
+            self.__index.clear()
+            for i, joke in enumerate(self.__jokes):
+                self.__index_joke(i, joke)
+            self.__loaded_at = monotonic()
+        logger.info(f"Jokes cache refreshed with {len(self.__jokes)} objects from {self.__collection} "
+                    f"(hits: {self.hits}, misses: {self.misses})")
+
+    def __load_jokes(self):
+        # Blocking load of the whole collection, meant to be run inside the mongo executor
+        return [document['joke'] for document in
+                self.__mongo_util.db()[self.__collection].find({}, {'_id': False, 'joke': True})]
+
+    def __index_joke(self, i, joke):
+        for word in joke_words(joke):
+            self.__index.setdefault(word, set()).add(i)
+
+    async def search(self, keywords: str, limit: int):
+        # Best jokes are the ones with the most keywords, found by merging the postings of each word
+        if self.is_stale:
+            await self.refresh()
+        scores: dict[int, int] = {}
+        for word in joke_words(keywords):
+            for i in self.__index.get(word, ()):
+                scores[i] = scores.get(i, 0) + 1
+        return [self.__jokes[i] for i in sorted(scores, key=scores.get, reverse=True)[:limit]]
+
+    def add(self, joke: str):
+        # Keep the cache in sync with inserts, unless it has to be reloaded anyway
+        if not self.is_stale:
+            self.__jokes.append(joke)
+            self.__index_joke(len(self.__jokes) - 1, joke)
+
+    def invalidate(self):
+        self.__loaded_at = None
+
+
+class JokesPages(discord_ui.View):
+    """
+    JokesPages view, paging through jokes by ranges of ids, so that every page costs the same.
+    """
+
+    def __init__(self, fetch, embeds_color):
+        super().__init__(timeout=_config['jokes_pages_timeout'])
+        self.__fetch = fetch
+        self.__embeds_color = embeds_color
+        # Ids after which each visited page starts, to go back without skipping documents
+        self.__starts = [None]
+        self.__last_id = None
+
+    async def page(self):
+        documents = await self.__fetch(self.__starts[-1])
+        page_size = _config['jokes_page_size']
+        self.__last_id = documents[page_size - 1]['_id'] if len(documents) > page_size else None
+        self.previous.disabled = len(self.__starts) == 1
+        self.next.disabled = self.__last_id is None
+        start = (len(self.__starts) - 1) * page_size
+        embed_msg = DiscordEmbed(color=self.__embeds_color, description='\n'.join(
+            f"`{i + 1}.` {joke['joke'][:_config['jokes_page_preview']]}"
+            for i, joke in enumerate(documents[:page_size], start=start)) or _config['joke_empty_message'])
+        embed_msg.set_footer(text=f"Page {len(self.__starts)}")
+        return embed_msg
+
+    @discord_ui.button(label='◀', style=ButtonStyle.secondary)
+    async def previous(self, interaction: Interaction, button: discord_ui.Button):
+        self.__starts.pop()
+        await interaction.response.edit_message(embed=await self.page(), view=self)
+
+    @discord_ui.button(label='▶', style=ButtonStyle.secondary)
+    async def next(self, interaction: Interaction, button: discord_ui.Button):
+        self.__starts.append(self.__last_id)
+        await interaction.response.edit_message(embed=await self.page(), view=self)
+
+
 class Mortadella(discord_commands.Cog):
     """
     Mortadella bot extension.
@@ -23,9 +159,54 @@ class Mortadella(discord_commands.Cog):
     def __init__(self, bot: discord_commands.Bot):
         self.bot = bot
         self.description = _config['extension_description']
-        self.__mongo_db = MongoUtil().db()
+        self.__mongo_util = MongoUtil()
+        self.__mongo_db = self.__mongo_util.db()
         self.__jokes_collection = 'mortadella.jokes'
+        self.jokes_cache = JokesCache(self.__mongo_util, self.__jokes_collection, _config['jokes_cache_ttl'],
+                                      _config['jokes_collection_timeout'])
         self.__embeds_color = int(_config['embeds_color'], 16)
+        self.__indexed = False
+        self.__text_indexed = False
+
+    async def __ensure_index(self):
+        # Give normalized text to jokes missing it, then let mongo refuse duplicates
+        if not self.__indexed:
+            await self.__mongo_util.run(self.__backfill_normalized, deadline=_config['jokes_collection_timeout'])
+            self.__indexed = True
+
+    def __backfill_normalized(self):
+        # Blocking backfill, meant to be run inside the mongo executor, dropping the duplicates it finds
+        collection = self.__mongo_db[self.__jokes_collection]
+        collection.create_index('normalized', unique=True, partialFilterExpression={'normalized': {'$exists': True}})
+        backfilled = duplicates = 0
+        for document in collection.find({'normalized': {'$exists': False}}, {'joke': True}):
+            try:
+                collection.update_one({'_id': document['_id']},
+                                      {'$set': {'normalized': normalize_joke(document['joke'])}})
+                backfilled += 1
+            except DuplicateKeyError:
+                collection.delete_one({'_id': document['_id']})
+                duplicates += 1
+        if backfilled or duplicates:
+            logger.info(f"Normalized {backfilled} objects of {self.__jokes_collection}, "
+                        f"removing {duplicates} duplicates")
+
+    async def cog_load(self):
+        # Show how well the jokes cache does in stats and metrics
+        Metrics().set_gauge('jokes_cache_hits', lambda: self.jokes_cache.hits)
+        Metrics().set_gauge('jokes_cache_misses', lambda: self.jokes_cache.misses)
+        Metrics().set_gauge('jokes_cache_size', lambda: len(self.jokes_cache))
+
+    async def cog_unload(self):
+        Metrics().remove_gauge('jokes_cache_hits')
+        Metrics().remove_gauge('jokes_cache_misses')
+        Metrics().remove_gauge('jokes_cache_size')
+
+    @discord_commands.Cog.listener()
+    async def on_database_reset(self):
+        # Init data was reloaded, so cached jokes are not valid anymore, and new ones need normalizing
+        self.jokes_cache.invalidate()
+        self.__indexed = False
 
     @discord_commands.command(name='mortadella',
                               aliases=['morta', 'della', 'mortade'],
@@ -39,17 +220,66 @@ class Mortadella(discord_commands.Cog):
                               aliases=['pun'],
                               brief=_config['joke_brief'],
                               description=_config['joke_description'])
-    async def joke(self, ctx: discord_commands.Context):
-        collection = self.__mongo_db[self.__jokes_collection]
+    async def joke(self, ctx: discord_commands.Context,
+                   *,
+                   keywords: str = discord_commands.parameter(default=None, description=_config['joke_keywords'])):
+        if keywords:
+            # Get one of the best matching jokes
+            jokes = await self.search_jokes(keywords)
+            if jokes:
+                embed_msg = DiscordEmbed(description=random_choice(jokes), color=self.__embeds_color)
+            else:
+                embed_msg = DiscordEmbed(description=_config['joke_not_found'].format(keywords),
+                                         color=self.__embeds_color)
+            await ctx.send(embed=embed_msg)
+            return
         # Get random joke if collection has any
-        if collection.count_documents({}):
-            embed_msg = DiscordEmbed(description=collection.aggregate([{'$sample': {'size': 1}}]).next()['joke'],
-                                     color=self.__embeds_color)
+        joke = await self.jokes_cache.random()
+        if joke:
+            embed_msg = DiscordEmbed(description=joke, color=self.__embeds_color)
         else:
             embed_msg = DiscordEmbed(description=_config['joke_empty_message'], color=self.__embeds_color)
             logger.warning(f"No objects available in {self.__jokes_collection} mongo collection")
         await ctx.send(embed=embed_msg)
 
+    async def search_jokes(self, keywords):
+        # Small collections are searched in the cache, bigger ones by mongo text search without ever loading them,
+        # telling them apart by the count kept in collection metadata unless the cache already knows
+        if self.jokes_cache.is_stale:
+            size = await self.__mongo_util.run(self.__mongo_db[self.__jokes_collection].estimated_document_count)
+        else:
+            size = len(self.jokes_cache)
+        if size <= _config['jokes_search_memory_max']:
+            return await self.jokes_cache.search(keywords, _config['jokes_search_results'])
+        if not self.__text_indexed:
+            # Building the index walks the whole collection
+            await self.__mongo_util.run(self.__mongo_db[self.__jokes_collection].create_index, [('joke', 'text')],
+                                        default_language=_config['jokes_search_language'],
+                                        deadline=_config['jokes_collection_timeout'])
+            self.__text_indexed = True
+        return await self.__mongo_util.run(self.__text_search, keywords)
+
+    def __text_search(self, keywords):
+        # Blocking text search, meant to be run inside the mongo executor
+        cursor = self.__mongo_db[self.__jokes_collection].find(
+            {'$text': {'$search': keywords}}, {'_id': False, 'joke': True, 'score': {'$meta': 'textScore'}})
+        return [document['joke'] for document in
+                cursor.sort([('score', {'$meta': 'textScore'})]).limit(_config['jokes_search_results'])]
+
+    def __jokes_page(self, after):
+        # Blocking page load, meant to be run inside the mongo executor, with one more joke to know if others follow
+        return list(self.__mongo_db[self.__jokes_collection].find({'_id': {'$gt': after}} if after else {},
+                                                                  {'joke': True})
+                    .sort('_id', 1).limit(_config['jokes_page_size'] + 1))
+
+    @discord_commands.command(name='jokes',
+                              aliases=['listjokes', 'puns'],
+                              brief=_config['jokes_brief'],
+                              description=_config['jokes_description'])
+    async def jokes(self, ctx: discord_commands.Context):
+        view = JokesPages(lambda after: self.__mongo_util.run(self.__jokes_page, after), self.__embeds_color)
+        await ctx.send(embed=await view.page(), view=view)
+
     @discord_commands.command(name='addjoke',
                               aliases=['addj'],
                               brief=_config['add_joke_brief'],
@@ -57,12 +287,100 @@ class Mortadella(discord_commands.Cog):
     async def add_joke(self, ctx: discord_commands.Context,
                        *,
                        joke: str = discord_commands.parameter(description=_config['add_joke_joke'])):
-        self.__mongo_db[self.__jokes_collection].insert_one({'joke': joke})
-        embed_msg = DiscordEmbed(description=_config['add_joke_added'].format(ctx.author.mention),
+        await self.__ensure_index()
+        try:
+            await self.__mongo_util.run(self.__mongo_db[self.__jokes_collection].insert_one,
+                                        {'joke': joke, 'normalized': normalize_joke(joke)})
+        except DuplicateKeyError:
+            embed_msg = DiscordEmbed(description=_config['add_joke_duplicate'].format(ctx.author.mention),
+                                     color=self.__embeds_color)
+        else:
+            self.jokes_cache.add(joke)
+            embed_msg = DiscordEmbed(description=_config['add_joke_added'].format(ctx.author.mention),
+                                     color=self.__embeds_color)
+            logger.info(f"New object added by @{ctx.author.name} to {self.__jokes_collection} mongo collection")
+        await ctx.send(embed=embed_msg)
+
+    @staticmethod
+    def __read_jokes(file_name, data: bytes):
+        # Jokes from a json array of strings or of objects with a joke, or from a text file with one joke per line
+        if splitext(file_name)[1].lower() == '.json':
+            for item in iter_json_array(TextIOWrapper(BytesIO(data), encoding='utf-8')):
+                yield item.get('joke') if isinstance(item, dict) else item
+        else:
+            yield from TextIOWrapper(BytesIO(data), encoding='utf-8')
+
+    def __insert_jokes(self, documents):
+        # Blocking unordered insert, meant to be run inside the mongo executor, where duplicates are just skipped
+        try:
+            return len(self.__mongo_db[self.__jokes_collection].insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            return e.details['nInserted']
+
+    @discord_commands.command(name='importjokes',
+                              aliases=['importj'],
+                              brief=_config['import_jokes_brief'],
+                              description=_config['import_jokes_description'])
+    @discord_commands.has_permissions(administrator=True)
+    async def import_jokes(self, ctx: discord_commands.Context):
+        if not ctx.message.attachments:
+            embed_msg = DiscordEmbed(description=_config['import_jokes_no_file'], color=self.__embeds_color)
+            await ctx.send(embed=embed_msg)
+            return
+        attachment = ctx.message.attachments[0]
+        await self.__ensure_index()
+        async with ctx.typing():
+            # Insert jokes in batches, dropping the ones repeated inside the file before mongo even sees them
+            jokes = self.__read_jokes(attachment.filename, await attachment.read())
+            seen = set()
+            read = imported = 0
+            try:
+                while batch := list(islice(jokes, _config['import_jokes_batch'])):
+                    read += len(batch)
+                    documents = []
+                    for joke in batch:
+                        if not isinstance(joke, str) or not joke.strip():
+                            continue
+                        normalized = normalize_joke(joke)
+                        if normalized not in seen:
+                            seen.add(normalized)
+                            documents.append({'joke': joke.strip(), 'normalized': normalized})
+                    if documents:
+                        imported += await self.__mongo_util.run(self.__insert_jokes, documents)
+            except (UnicodeDecodeError, ValueError) as e:
+                raise discord_commands.BadArgument(f"Could not read {attachment.filename}: {e}")
+            finally:
+                self.jokes_cache.invalidate()
+        logger.info(f"Imported {imported} of {read} objects by @{ctx.author.name} to {self.__jokes_collection}")
+        embed_msg = DiscordEmbed(description=_config['import_jokes_done'].format(imported, read - imported),
                                  color=self.__embeds_color)
-        logger.info(f"New object added by @{ctx.author.name} to {self.__jokes_collection} mongo collection")
         await ctx.send(embed=embed_msg)
 
+    def __export_jokes(self):
+        # Blocking export through a cursor, meant to be run inside the mongo executor, spilling to disk when big
+        file = SpooledTemporaryFile(max_size=_config['export_jokes_memory'])
+        file.write(b'[')
+        cursor = self.__mongo_db[self.__jokes_collection].find({}, {'_id': False, 'joke': True},
+                                                               batch_size=_config['import_jokes_batch'])
+        for i, document in enumerate(cursor):
+            file.write(f"{',' if i else ''}\n  {json_dumps({'joke': document['joke']}, ensure_ascii=False)}".encode())
+        file.write(b'\n]\n')
+        file.seek(0)
+        return file
+
+    @discord_commands.command(name='exportjokes',
+                              aliases=['exportj'],
+                              brief=_config['export_jokes_brief'],
+                              description=_config['export_jokes_description'])
+    @discord_commands.has_permissions(administrator=True)
+    async def export_jokes(self, ctx: discord_commands.Context):
+        async with ctx.typing():
+            file = await self.__mongo_util.run(self.__export_jokes, deadline=_config['jokes_collection_timeout'])
+            with file:
+                await ctx.send(file=DiscordFile(file, f"{self.__jokes_collection}.json"))
+
 
 async def setup(bot):
     await bot.add_cog(Mortadella(bot))
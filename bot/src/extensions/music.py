@@ -1,16 +1,30 @@
-from asyncio import Event, get_event_loop as asyncio_get_event_loop, Queue, TimeoutError
-from functools import partial as functools_partial
-from itertools import islice
+from asyncio import Event, gather as asyncio_gather, get_running_loop as asyncio_get_running_loop, Semaphore, \
+    sleep as asyncio_sleep, Task, TimeoutError, wait as asyncio_wait
+from itertools import count
 from json import load as json_load
 from logging import getLogger
 from math import ceil as math_ceil
+from os import pipe as os_pipe
 from os.path import join as path_join
 from random import shuffle as random_shuffle
+from shlex import split as shlex_split
+from threading import Thread
+from time import perf_counter, time
+from urllib.parse import parse_qs, urlsplit, urlunsplit
 
 from async_timeout import timeout
-from discord import Embed as DiscordEmbed, FFmpegPCMAudio, PCMVolumeTransformer, VoiceClient
-from discord.ext import commands as discord_commands
-from yt_dlp import utils as ytdl_utils, YoutubeDL
+from discord import AudioSource, DiscordException, Embed as DiscordEmbed, FFmpegOpusAudio, FFmpegPCMAudio, \
+    PCMVolumeTransformer, VoiceClient
+from discord.ext import commands as discord_commands, tasks as discord_tasks
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import PyMongoError
+from sortedcontainers import SortedList
+
+from ..utils.audio_cache import AudioCache
+from ..utils.cache import LRUCache, MongoCache
+from ..utils.extraction import ExtractionError, ExtractionPool
+from ..utils.metrics import Histogram, Metrics
+from ..utils.mongo import MongoUtil
 
 # Setting up extension logger
 logger = getLogger(__name__.split('.', 1)[-1])
@@ -19,9 +33,6 @@ logger = getLogger(__name__.split('.', 1)[-1])
 with open(path_join('bot', 'src', 'extensions', 'music.json'), 'r', encoding='utf-8') as f:
     _config = json_load(f)
 
-# Suppress ytdl noise about console usage from errors
-ytdl_utils.bug_reports_message = lambda: ''
-
 
 class VoiceError(Exception):
     """
@@ -39,74 +50,297 @@ class YTDLError(Exception):
     pass
 
 
-class YTDLSource(PCMVolumeTransformer):
+class Track:
     """
-    YTDLSource class for music.
+    Track class for queue entries, compact until resolved into a source when starting to play.
     """
 
-    # Libraries options and ytdl object
-    __ytdl_format_options = _config['ytdl_format_options']
-    __ffmpeg_options = _config['ffmpeg_options']
-    __ytdl = YoutubeDL(__ytdl_format_options)
+    __slots__ = ('id', 'title', 'url', 'duration', 'requester_id', 'thumbnail', 'weight')
+
+    def __init__(self, title, url, duration, requester_id, thumbnail=None, weight=1.0):
+        # Stable id and scheduling weight are given by the queue
+        self.id: int = None
+        self.title = title
+        self.url = url
+        self.duration = duration
+        self.requester_id = requester_id
+        self.thumbnail = thumbnail
+        self.weight = weight
+
+    @classmethod
+    def from_info(cls, info, requester_id):
+        return cls(info.get('title'), info.get('webpage_url'), info.get('duration'), requester_id,
+                   info.get('thumbnail'))
+
+    @classmethod
+    def from_record(cls, record):
+        # Records saved before weights were stored have no weight
+        return cls(*record)
+
+    def to_record(self):
+        # Compact stored form, without the queue id
+        return [self.title, self.url, self.duration, self.requester_id, self.thumbnail, self.weight]
+
+
+class PlaybackHealth:
+    """
+    PlaybackHealth class, collecting voice playback quality of a guild.
+    """
+
+    # Discord audio frames always last 20ms
+    frame_length = 0.02
+
+    def __init__(self):
+        self.frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        self.underruns = 0
+        self.reconnects = 0
+        self.restarts = 0
+        self.errors = 0
+        self.read_latency = Histogram()
+        self.first_audio = Histogram()
+
+    def record_read(self, latency):
+        # Reads slower than a frame delay the player, and the time lost is made of frames never played
+        self.frames += 1
+        self.read_latency.observe(latency)
+        if latency > self.frame_length:
+            self.late_frames += 1
+            self.dropped_frames += int(latency / self.frame_length) - 1
+            Metrics().increment('voice_late_frames_total')
+        if latency > _config['voice_underrun_time']:
+            self.underruns += 1
+            Metrics().increment('voice_underruns_total')
+            return True
+        return False
+
+    def record_reconnect(self):
+        self.reconnects += 1
+        Metrics().increment('voice_ffmpeg_reconnects_total')
+
+    def record_first_audio(self, delay):
+        self.first_audio.observe(delay)
+        Metrics().observe('voice_time_to_first_audio_seconds', delay)
+
+
+class FFmpegMonitor:
+    """
+    FFmpegMonitor class, reading ffmpeg stderr in a thread to log its warnings and notice stream reconnects.
+    """
 
-    def __init__(self, ctx: discord_commands.Context, source: FFmpegPCMAudio, *, data, volume=0.5):
-        # Parent constructor
-        super().__init__(source, volume)
+    def __init__(self, health: PlaybackHealth):
+        self.__health = health
+        read_fd, write_fd = os_pipe()
+        self.stderr = open(write_fd, 'wb')
+        self.__reader = open(read_fd, 'rb')
+        Thread(target=self.__run, daemon=True, name='ffmpeg-monitor').start()
+
+    def __run(self):
+        # Lines end when ffmpeg exits and closes its side of the pipe, ffmpeg only writes warnings and errors there
+        with self.__reader:
+            for line in self.__reader:
+                message = line.decode(errors='replace').strip()
+                if b'Will reconnect' in line:
+                    logger.warning(f"Ffmpeg reconnecting: {message}")
+                    self.__health.record_reconnect()
+                elif message:
+                    logger.warning(f"Ffmpeg: {message}")
+
+    def spawned(self):
+        # Ffmpeg holds its own copy of the pipe, so only the reader is left here
+        self.stderr.close()
+
+
+class YTDLSource(AudioSource):
+    """
+    YTDLSource class for music, wrapping the actual ffmpeg audio.
+    """
+
+    # Libraries options and ytdl extraction workers
+    __ffmpeg_options = _config['ffmpeg_options']
+    extraction_pool = ExtractionPool(_config['ytdl_format_options'], workers=_config['extraction_workers'],
+                                     processes=_config['extraction_mode'] == 'process',
+                                     max_pending=_config['extraction_max_pending'],
+                                     timeout=_config['extraction_timeout'])
+    # Extracted info cache, only keeping the fields needed for playing
+    __info_fields = ('title', 'uploader', 'uploader_url', 'upload_date', 'thumbnail', 'duration', 'webpage_url',
+                     'url', 'ext', 'acodec', 'http_headers')
+    info_cache = (MongoCache(_config['info_cache_size'], 'music.info_cache')
+                  if _config['info_cache_backend'] == 'mongo' else LRUCache(_config['info_cache_size']))
+    # Number of ytdl extract_info invocations
+    extractions = 0
+    # Opus files cache for popular tracks
+    audio_cache = AudioCache(_config['audio_cache_directory'], _config['audio_cache_max_size_mb'] * 2 ** 20,
+                             _config['audio_cache_min_plays'], _config['audio_cache_max_duration'],
+                             _config['audio_cache_concurrency'],
+                             shlex_split(__ffmpeg_options['before_options'])) \
+        if _config['audio_cache_enabled'] else None
+
+    def __init__(self, track: Track, *, data, volume=0.5, health: PlaybackHealth = None):
+        # Audio is only created when starting to play
+        self.audio: AudioSource = None
+        self.__volume = volume
+        # Playback quality of this track, and of the guild as a whole
+        self.health = health or PlaybackHealth()
+        self.__started_at: float = None
+        self.__frames = 0
+        self.__underruns = 0
+        self.__restarts = 0
         # Get various information about the request and the source data
-        self.requester = ctx.author
-        self.channel = ctx.channel
+        self.track = track
         self.data = data
         self.uploader = data.get('uploader')
         self.uploader_url = data.get('uploader_url')
+        # Livestreams and some extractors have neither upload date nor duration
         date = data.get('upload_date')
-        self.upload_date = f"{date[0:4]}.{date[4:6]}.{date[6:8]}"
+        self.upload_date = f"{date[0:4]}.{date[4:6]}.{date[6:8]}" if date else _config['unknown_upload_date']
         self.title = data.get('title')
         self.thumbnail = data.get('thumbnail')
-        self.duration = self.parse_duration(int(data.get('duration')))
+        self.duration_seconds = int(data.get('duration') or 0)
+        self.duration = self.parse_duration(self.duration_seconds) or _config['unknown_duration']
         self.url = data.get('webpage_url')
         self.stream_url = data.get('url')
+        self.expires_at = self.stream_expiry(self.stream_url)
 
     def __str__(self):
         return f"**{self.title}** by **{self.uploader}**"
 
-    @classmethod
-    async def create(cls, ctx: discord_commands.Context, search, *, loop=None):
-        # Static method to create class object
-        loop = loop or asyncio_get_event_loop()
-        # Run a partial of ytdl extract_info method with search, inside executor
-        data = await loop.run_in_executor(None, functools_partial(cls.__ytdl.extract_info, search, download=False,
-                                                                  process=False))
-        # Find info in data and get first result of playlists
+    @property
+    def volume(self):
+        return self.__volume
+
+    @volume.setter
+    def volume(self, value):
+        # Only pcm audio can change volume while playing, opus audio gets it from ffmpeg when starting
+        self.__volume = value
+        if isinstance(self.audio, PCMVolumeTransformer):
+            self.audio.volume = value
+
+    def read(self):
+        # Called by the player thread every 20ms, so only measure here, restarting ffmpeg when it keeps stalling
+        start = perf_counter()
+        data = self.audio.read()
         if not data:
-            raise YTDLError(f"Could not find any music that matches `{search}`")
-        if 'entries' not in data:
-            process_info = data
-        else:
-            process_info = None
-            for entry in data['entries']:
-                if entry:
-                    process_info = entry
-                    break
-            if process_info is None:
-                raise YTDLError(f"Could not find anything that matches `{search}`")
-        webpage_url = process_info['webpage_url']
-        # Get actual info and get first result of playlists
-        processed_info = await loop.run_in_executor(None, functools_partial(cls.__ytdl.extract_info, webpage_url,
-                                                                            download=False))
-        if processed_info is None:
-            raise YTDLError(f"Could not fetch `{webpage_url}`")
-        if 'entries' not in processed_info:
-            info = processed_info
-        else:
-            info = None
-            while info is None:
-                try:
-                    info = processed_info['entries'].pop(0)
-                except IndexError:
-                    raise YTDLError(f"Could not retrieve any matches for `{webpage_url}`")
-        # Create object and audio with ffmpeg options
-        return cls(ctx, FFmpegPCMAudio(info['url'], before_options=cls.__ffmpeg_options['before_options'],
-                                       options=cls.__ffmpeg_options['options']), data=info)
+            return data
+        self.__frames += 1
+        # The first read waits for ffmpeg to open the stream, so it is the time to first audio instead
+        if self.__frames == 1:
+            self.health.record_first_audio(perf_counter() - self.__started_at)
+        elif self.health.record_read(perf_counter() - start):
+            self.__underruns += 1
+            if (self.__underruns >= _config['voice_underrun_restart']
+                    and self.__restarts < _config['voice_max_restarts']):
+                self.__restart()
+        return data
+
+    def __restart(self):
+        # Start again from where playback got, dropping the stalled ffmpeg
+        position = self.__frames * PlaybackHealth.frame_length
+        logger.warning(f"Restarting audio of {self.url} at {position:.1f}s after {self.__underruns} underruns")
+        self.__underruns = 0
+        self.__restarts += 1
+        self.health.restarts += 1
+        Metrics().increment('voice_restarts_total')
+        stalled, self.audio = self.audio, self.__create_audio(position)
+        stalled.cleanup()
+
+    def is_opus(self):
+        return self.audio.is_opus()
+
+    def cleanup(self):
+        if self.audio:
+            self.audio.cleanup()
+
+    def start(self, volume):
+        # Prepare audio right before playing
+        self.volume = volume
+        self.__started_at = perf_counter()
+        if self.audio is None:
+            self.audio = self.__create_audio()
+        if self.audio_cache:
+            self.audio_cache.record_play(self.data)
+
+    def __create_audio(self, position=0):
+        # Prefer cached opus files, seeking when restarting
+        seek = f" -ss {position:.2f}" if position else ''
+        path = self.audio_cache.get(self.url) if self.audio_cache else None
+        monitor = FFmpegMonitor(self.health)
+        try:
+            if path:
+                return self.__opus_audio(path, self.__volume, monitor, opus_input=True, before_options=seek or None)
+            before_options = self.__ffmpeg_options['before_options'] + seek
+            if _config['playback_mode'] == 'opus':
+                return self.__opus_audio(self.stream_url, self.__volume, monitor,
+                                         opus_input=self.data.get('acodec') == 'opus', before_options=before_options)
+            return self.__remote_audio(self.stream_url, self.__volume, monitor, before_options)
+        finally:
+            monitor.spawned()
+
+    @classmethod
+    def __remote_audio(cls, source, volume, monitor: FFmpegMonitor, before_options):
+        return PCMVolumeTransformer(FFmpegPCMAudio(source, before_options=before_options, stderr=monitor.stderr,
+                                                   options=cls.__ffmpeg_options['options']), volume)
+
+    @classmethod
+    def __opus_audio(cls, source, volume, monitor: FFmpegMonitor, *, opus_input, before_options=None):
+        # Opus input at full volume passes through untouched (discord.py maps the opus codec to copy),
+        # otherwise ffmpeg applies the volume filter and encodes once, skipping python side pcm work
+        if opus_input and volume == 1:
+            return FFmpegOpusAudio(source, codec='opus', before_options=before_options, stderr=monitor.stderr,
+                                   options=cls.__ffmpeg_options['options'])
+        return FFmpegOpusAudio(source, before_options=before_options, stderr=monitor.stderr,
+                               options=f"{cls.__ffmpeg_options['options']} -filter:a volume={volume}")
+
+    @classmethod
+    async def extract_info(cls, search, *, cache=True):
+        # Look for the normalized query in the cache first, unless a fresh extraction is needed
+        query_key = f"query:{cls.normalize_search(search)}"
+        info = await cls.info_cache.get(query_key) if cache else None
+        if info is not None:
+            return info
+        try:
+            # Find what the search points to with a flat extraction inside the workers
+            cls.extractions += 1
+            webpage_url = await cls.extraction_pool.webpage_url(search)
+            # Different queries can lead to the same url, which might already be cached
+            url_key = f"url:{webpage_url}"
+            info = await cls.info_cache.get(url_key) if cache else None
+            if info is None:
+                cls.extractions += 1
+                info = await cls.extraction_pool.info(webpage_url, cls.__info_fields)
+                await cls.info_cache.set(url_key, info, cls.stream_expiry(info['url']))
+        except ExtractionError as e:
+            raise YTDLError(str(e))
+        await cls.info_cache.set(query_key, info, cls.stream_expiry(info['url']))
+        return info
+
+    @classmethod
+    async def extract_playlist(cls, url):
+        # Flat extraction of playlist entries, leaving the full extraction of each for when it is about to play
+        try:
+            cls.extractions += 1
+            return await cls.extraction_pool.playlist(url, _config['playlist_max_entries'])
+        except ExtractionError as e:
+            raise YTDLError(str(e))
+
+    @staticmethod
+    def normalize_search(search):
+        # Free text searches ignore case and spacing, while urls only ignore case where it does not matter,
+        # since paths and queries tell videos apart
+        search = search.strip()
+        url = urlsplit(search)
+        if url.scheme and url.netloc:
+            return urlunsplit((url.scheme.lower(), url.netloc.lower(), url.path, url.query, url.fragment))
+        return ' '.join(search.casefold().split())
+
+    @staticmethod
+    def stream_expiry(stream_url):
+        # Signed stream urls carry their expiration timestamp, otherwise use a default lifetime
+        expire = parse_qs(urlsplit(stream_url).query).get('expire')
+        if expire and expire[0].isdigit():
+            return int(expire[0]) - _config['info_cache_expiry_margin']
+        return time() + _config['info_cache_default_ttl']
 
     @staticmethod
     def parse_duration(duration):
@@ -140,7 +374,7 @@ class MusicInfo:
         embed_msg = (
             DiscordEmbed(title='Now playing', description=f"```\n{self.source.title}\n```", color=self.__embeds_color))
         embed_msg.add_field(name='Duration', value=self.source.duration)
-        embed_msg.add_field(name='Requested by', value=self.source.requester.mention)
+        embed_msg.add_field(name='Requested by', value=f"<@{self.source.track.requester_id}>")
         embed_msg.add_field(name='Uploader', value=f"[{self.source.uploader}]({self.source.uploader_url})")
         embed_msg.add_field(name='Upload date', value=self.source.upload_date)
         embed_msg.add_field(name='URL', value=f"[Click me]({self.source.url})")
@@ -149,31 +383,237 @@ class MusicInfo:
         return embed_msg
 
 
-class MusicQueue(Queue):
+class FIFOScheduler:
+    """
+    FIFOScheduler class, ordering tracks by arrival.
+    """
+
+    name = 'fifo'
+
+    def order(self, track: Track, last_order, weight):
+        return last_order + 1 if last_order is not None else 0.0
+
+    def served(self, order):
+        pass
+
+
+class FairScheduler:
+    """
+    FairScheduler class, weighted fair queuing across requesters using virtual finish times as orders.
+    """
+
+    name = 'fair'
+
+    def __init__(self):
+        self.__virtual_time = 0.0
+        self.__finish_times: dict[int, float] = {}
+
+    def cost(self, track: Track):
+        return track.duration or _config['fair_queue_default_duration']
+
+    def order(self, track: Track, last_order, weight):
+        # Tracks start after both the current virtual time and the previous track of the same requester
+        start = max(self.__virtual_time, self.__finish_times.get(track.requester_id, 0.0))
+        self.__finish_times[track.requester_id] = start + self.cost(track) / weight
+        return self.__finish_times[track.requester_id]
+
+    def served(self, order):
+        self.__virtual_time = max(self.__virtual_time, order)
+
+
+class RoundRobinScheduler(FairScheduler):
     """
-    MusicQueue class.
+    RoundRobinScheduler class, taking one track from each requester in turn.
     """
 
+    name = 'roundrobin'
+
+    def cost(self, track: Track):
+        return 1
+
+    def order(self, track: Track, last_order, weight):
+        # Every requester gets a single track each round, whatever their weight
+        return super().order(track, last_order, 1.0)
+
+
+class MusicQueue:
+    """
+    MusicQueue class, an async queue with logarithmic indexed access, stable entry ids and lookup by requester.
+    Tracks are kept sorted by the orders given by the scheduler, so the queue always shows what plays next.
+    """
+
+    schedulers = {scheduler.name: scheduler for scheduler in (FIFOScheduler, RoundRobinScheduler, FairScheduler)}
+
+    def __init__(self, scheduler=None):
+        self.__ids = count(1)
+        self.__not_empty = Event()
+        self.scheduler = self.schedulers[scheduler or _config['queue_mode']]()
+        self.clear()
+
     def __getitem__(self, item):
         if isinstance(item, slice):
-            return list(islice(self._queue, item.start, item.stop, item.step))
+            start, stop, step = item.indices(len(self.__entries))
+            return [self.__tracks[entry_id] for _, entry_id in self.__entries.islice(start, stop)][::step]
         else:
-            return self._queue[item]
+            return self.__tracks[self.__entries[item][1]]
 
     def __iter__(self):
-        return self._queue.__iter__()
+        return (self.__tracks[entry_id] for _, entry_id in self.__entries)
 
     def __len__(self):
-        return self.qsize()
+        return len(self.__entries)
+
+    def __add(self, track: Track, order: float):
+        # Entries are sorted by order, both in the whole queue and for each requester
+        self.__tracks[track.id] = track
+        self.__orders[track.id] = order
+        self.__entries.add((order, track.id))
+        self.__requesters.setdefault(track.requester_id, SortedList()).add((order, track.id))
+
+    def __discard(self, entry_id):
+        track = self.__tracks.pop(entry_id)
+        entry = (self.__orders.pop(entry_id), entry_id)
+        self.__entries.remove(entry)
+        requester_entries = self.__requesters[track.requester_id]
+        requester_entries.remove(entry)
+        if not requester_entries:
+            del self.__requesters[track.requester_id]
+        return track
+
+    def __renumber(self):
+        # Spread orders again when there is no room left between two of them, starting from the first one
+        tracks = list(self)
+        first = self.__entries[0][0]
+        self.clear()
+        for i, track in enumerate(tracks):
+            self.__add(track, first + i)
+
+    def put_nowait(self, track: Track, weight=1.0):
+        track.id = next(self.__ids)
+        track.weight = weight
+        self.__add(track, self.scheduler.order(track, self.__entries[-1][0] if self.__entries else None, weight))
+        self.__not_empty.set()
+
+    async def put(self, track: Track, weight=1.0):
+        self.put_nowait(track, weight)
+
+    async def get(self):
+        while not self.__entries:
+            self.__not_empty.clear()
+            await self.__not_empty.wait()
+        order, entry_id = self.__entries[0]
+        self.scheduler.served(order)
+        return self.__discard(entry_id)
+
+    def set_scheduler(self, name):
+        # Give new orders to queued tracks, keeping their current relative order for each requester
+        self.scheduler = self.schedulers[name]()
+        tracks = list(self)
+        self.clear()
+        for track in tracks:
+            self.__add(track, self.scheduler.order(track, self.__entries[-1][0] if self.__entries else None,
+                                                   track.weight))
 
     def clear(self):
-        self._queue.clear()
+        self.__tracks: dict[int, Track] = {}
+        self.__orders: dict[int, float] = {}
+        self.__entries = SortedList()
+        self.__requesters: dict[int, SortedList] = {}
 
     def shuffle(self):
-        random_shuffle(self._queue)
+        # Shuffled tracks take the same orders, so that schedulers keep their virtual time
+        orders = [order for order, _ in self.__entries]
+        tracks = list(self)
+        random_shuffle(tracks)
+        self.clear()
+        for order, track in zip(orders, tracks):
+            self.__add(track, order)
 
     def remove(self, index):
-        del self._queue[index]
+        return self.__discard(self.__entries[index][1])
+
+    def index(self, entry_id):
+        return self.__entries.index((self.__orders[entry_id], entry_id))
+
+    def move(self, index, position):
+        # Take the track out and put it back with an order between its new neighbours
+        track = self.remove(index)
+        position = max(0, min(position, len(self.__entries)))
+        for _ in range(2):
+            before = self.__entries[position - 1][0] if position > 0 else None
+            after = self.__entries[position][0] if position < len(self.__entries) else None
+            if before is None:
+                order = after - 1 if after is not None else 0.0
+            elif after is None:
+                order = before + 1
+            else:
+                order = (before + after) / 2
+                if not before < order < after:
+                    self.__renumber()
+                    continue
+            break
+        self.__add(track, order)
+        return track
+
+    def by_requester(self, requester_id):
+        # Positions and tracks of a single requester
+        return [(self.__entries.index(entry), self.__tracks[entry[1]])
+                for entry in self.__requesters.get(requester_id, ())]
+
+
+class QueueStore(object):
+    """
+    QueueStore class, saving guild players to mongo with debounced and batched writes.
+    """
+
+    def __init__(self, collection, delay):
+        self.__mongo_util = MongoUtil()
+        self.__collection = collection
+        self.__delay = delay
+        self.__dirty: dict[int, 'VoiceState'] = {}
+        self.__flush_task: Task = None
+        self.__closing = False
+
+    def mark(self, guild_id, voice_state=None):
+        # Remember what changed, and write everything at once after a while
+        self.__dirty[guild_id] = voice_state
+        if self.__flush_task is None or self.__flush_task.done():
+            self.__flush_task = asyncio_get_running_loop().create_task(self.__delayed_flush())
+
+    async def __delayed_flush(self):
+        await asyncio_sleep(self.__delay)
+        await self.flush()
+
+    async def flush(self):
+        if not self.__dirty:
+            return
+        # Records are taken only now, so that many changes end up in a single write
+        dirty, self.__dirty = self.__dirty, {}
+        operations = []
+        for guild_id, voice_state in dirty.items():
+            record = voice_state.to_record() if voice_state else None
+            operations.append(ReplaceOne({'_id': guild_id}, record, upsert=True) if record else
+                              DeleteOne({'_id': guild_id}))
+        try:
+            await self.__mongo_util.run(self.__mongo_util.db()[self.__collection].bulk_write, operations,
+                                        ordered=False)
+        except PyMongoError as e:
+            logger.warning(f"Failed to save {len(operations)} music queues: [{type(e).__name__}: {e}]")
+            # Try again after a while, unless something newer was marked in the meantime
+            for guild_id, voice_state in dirty.items():
+                self.__dirty.setdefault(guild_id, voice_state)
+            if not self.__closing:
+                self.__flush_task = asyncio_get_running_loop().create_task(self.__delayed_flush())
+
+    async def load(self):
+        return await self.__mongo_util.run(lambda: list(self.__mongo_util.db()[self.__collection].find()))
+
+    async def close(self):
+        # Stop waiting and write what is left right away, for the last time
+        self.__closing = True
+        if self.__flush_task:
+            self.__flush_task.cancel()
+        await self.flush()
 
 
 class VoiceState:
@@ -181,17 +621,31 @@ class VoiceState:
     VoiceState class for bot voice.
     """
 
-    def __init__(self, bot: discord_commands.Bot, ctx: discord_commands.Context):
-        # Constructor with bot object and context for playing, specific current music and queue, looping and volume
+    # Shared bound on concurrent prefetches across guilds
+    __prefetch_semaphore = Semaphore(_config['prefetch_concurrency'])
+
+    def __init__(self, bot: discord_commands.Bot, guild_id, text_channel, queue_store: QueueStore):
+        # Constructor with bot object and channel for playing, specific current music and queue, looping and volume
         self.bot = bot
-        self.__ctx = ctx
+        self.guild_id = guild_id
+        self.queue_store = queue_store
+        self.text_channel = text_channel
         self.current: MusicInfo = None
         self.voice: VoiceClient = None
         self.next = Event()
         self.music_queue = MusicQueue()
         self.__loop = False
         self.__volume = _config['starting_volume']
+        self.__embeds_color = int(_config['embeds_color'], 16)
         self.skip_votes = set()
+        self.__prefetches: dict[Track, Task] = {}
+        self.__resolving: set[Track] = set()
+        self.__prefetch_handle = None
+        self.__track_started_at: float = None
+        self.__track_ended_at: float = None
+        self.__track_failed = False
+        self.__extractions: dict[int, set[Task]] = {}
+        self.health = PlaybackHealth()
         self.audio_player = bot.loop.create_task(self.audio_player_task())
 
     def __del__(self):
@@ -211,41 +665,162 @@ class VoiceState:
 
     @volume.setter
     def volume(self, value):
+        # Also change the playing track, which only applies right away to pcm audio
         self.__volume = value
+        if self.current:
+            self.current.source.volume = value
 
     @property
     def is_playing(self):
         return self.voice and self.current
 
+    @property
+    def is_idle(self):
+        # Idle when neither connected nor waiting for music anymore
+        return not self.voice and self.audio_player.done()
+
+    def to_record(self):
+        # Compact record of the player, with the current track first, or nothing when there is nothing to restore
+        tracks = list(self.music_queue)
+        if self.current and self.voice and (self.voice.is_playing() or self.voice.is_paused()):
+            tracks.insert(0, self.current.source.track)
+        if not self.voice or not tracks:
+            return None
+        return {'voice_channel_id': self.voice.channel.id, 'text_channel_id': self.text_channel.id,
+                'tracks': [track.to_record() for track in tracks], 'loop': self.__loop, 'volume': self.__volume,
+                'queue_mode': self.music_queue.scheduler.name}
+
+    def save(self):
+        self.queue_store.mark(self.guild_id, self)
+
     async def audio_player_task(self):
         while True:
             self.next.clear()
-            if not self.__loop:
+            if not self.__loop or not self.current:
                 # Try to get the next song within an amount of seconds
                 try:
                     async with timeout(_config['voice_timeout']):
-                        self.current = await self.music_queue.get()
+                        track = await self.music_queue.get()
                 except TimeoutError:
                     # If no song is added to the queue, stop
                     self.bot.loop.create_task(self.stop())
+                    self.save()
                     return
+                # Wait for an ongoing prefetch, or resolve the track here if it was missed or is still waiting for
+                # a prefetch slot, since the track about to play goes before any other
+                prefetch = self.__prefetches.get(track)
+                if prefetch and track not in self.__resolving:
+                    prefetch.cancel()
+                    prefetch = None
+                info = await (prefetch or self.__resolve(track))
+                if info is None:
+                    await self.__send_unavailable(track)
+                    continue
             else:
-                # If loop, recreate the same source
-                new_source = await YTDLSource.create(self.__ctx, self.current.source.url, loop=self.bot.loop)
-                new_source = MusicInfo(new_source)
-                self.current = new_source
-            # Then update volume and play
-            self.current.source.volume = self.__volume
-            self.voice.play(self.current.source, after=self.play_next_song)
+                # If loop, replay the same info, extracting it again only if expired or if playing it failed
+                track = self.current.source.track
+                info = self.current.source.data
+                if self.__track_failed or self.current.source.expires_at <= time():
+                    info = await self.__resolve(track, cache=False)
+                    if info is None:
+                        self.__loop = False
+                        continue
+            source = None
+            try:
+                source = YTDLSource(track, data=info, health=self.health)
+                self.current = MusicInfo(source)
+                self.__track_failed = False
+                # Then prepare audio with volume and play
+                source.start(self.__volume)
+                # Set before playing, since the after callback can already run while play returns
+                self.__track_started_at = perf_counter()
+                self.voice.play(source, after=self.play_next_song)
+            except Exception as e:
+                # A track that cannot be played is skipped, the player has to keep going for the rest of the queue
+                logger.error(f"Failed to play {track.url}: [{type(e).__name__}: {e}]")
+                if source:
+                    source.cleanup()
+                self.current = None
+                await self.__send_unavailable(track)
+                continue
+            self.save()
+            if self.__track_ended_at is not None:
+                logger.info(f"Track switch on <{self.voice.channel.name}> "
+                            f"took {(perf_counter() - self.__track_ended_at) * 1000:.1f}ms")
             logger.info(f"Playing music on <{self.voice.channel.name}> "
-                        f"requested by @{self.current.source.requester.name} in #{self.__ctx.channel.name}")
-            await self.current.source.channel.send(embed=self.current.create_embed())
+                        f"requested by user {track.requester_id} in #{self.text_channel.name}")
+            # Prefetch next tracks shortly before the current one ends
+            self.__prefetch_handle = self.bot.loop.call_later(
+                max(0, self.current.source.duration_seconds - _config['prefetch_lead_time']), self.prefetch)
+            await self.__send(self.current.create_embed())
             await self.next.wait()
+            self.__prefetch_handle.cancel()
+
+    async def __send(self, embed_msg):
+        # Messages are not worth stopping the player for
+        try:
+            await self.text_channel.send(embed=embed_msg)
+        except DiscordException as e:
+            logger.warning(f"Failed to send player message to #{self.text_channel}: [{type(e).__name__}: {e}]")
+
+    async def __send_unavailable(self, track: Track):
+        await self.__send(DiscordEmbed(description=_config['play_unavailable'].format(track.title),
+                                       color=self.__embeds_color))
+
+    def prefetch(self):
+        # Resolve the info of the next queued tracks concurrently, refreshing the cached one if expired
+        for track in self.music_queue[:_config['prefetch_amount']]:
+            if track not in self.__prefetches:
+                self.__prefetches[track] = self.bot.loop.create_task(self.__prefetch(track))
+
+    async def __prefetch(self, track: Track):
+        try:
+            async with self.__prefetch_semaphore:
+                self.__resolving.add(track)
+                return await self.__resolve(track)
+        finally:
+            self.__resolving.discard(track)
+            self.__prefetches.pop(track, None)
+
+    @staticmethod
+    async def __resolve(track: Track, *, cache=True):
+        try:
+            return await YTDLSource.extract_info(track.url, cache=cache)
+        except YTDLError as e:
+            logger.warning(f"Failed to resolve {track.url}: [{type(e).__name__}: {e}]")
+            return None
+
+    async def extract_info(self, ctx: discord_commands.Context, search):
+        # Keep track of extractions by requester, so that they can be cancelled if the requester leaves
+        extraction = self.bot.loop.create_task(YTDLSource.extract_info(search))
+        requester_extractions = self.__extractions.setdefault(ctx.author.id, set())
+        requester_extractions.add(extraction)
+        try:
+            await asyncio_wait({extraction})
+        finally:
+            requester_extractions.discard(extraction)
+            if not requester_extractions:
+                self.__extractions.pop(ctx.author.id, None)
+        if extraction.cancelled():
+            raise YTDLError(f"Request for `{search}` was cancelled")
+        return extraction.result()
+
+    def cancel_extractions(self, requester_id=None):
+        # Cancel pending extractions of a requester, or all of them
+        for extraction in [extraction for user_id, extractions in self.__extractions.items()
+                           if requester_id is None or user_id == requester_id for extraction in extractions]:
+            extraction.cancel()
 
     def play_next_song(self, error=None):
+        self.__track_ended_at = perf_counter()
+        # Ffmpeg dying on a dead stream url ends the track right away, without any error
+        self.__track_failed = bool(error) or (self.__track_ended_at - self.__track_started_at
+                                              < _config['track_failure_time'])
+        self.next.set()
         if error:
+            self.health.errors += 1
+            Metrics().increment('voice_errors_total')
             raise VoiceError(error)
-        self.next.set()
 
     def skip(self):
         # Clear votes pool and skip
@@ -254,8 +829,14 @@ class VoiceState:
             self.voice.stop()
 
     async def stop(self):
-        # Stopping clears the queue and disconnects
+        # Stopping clears the queue, ends the player task and disconnects
         self.music_queue.clear()
+        self.audio_player.cancel()
+        if self.__prefetch_handle:
+            self.__prefetch_handle.cancel()
+        for prefetch in list(self.__prefetches.values()):
+            prefetch.cancel()
+        self.cancel_extractions()
         if self.voice:
             logger.info(f"Disconnecting from <{self.voice.channel.name}>")
             await self.voice.disconnect()
@@ -271,17 +852,112 @@ class Music(discord_commands.Cog):
         self.bot = bot
         self.description = _config['extension_description']
         self.__embeds_color = int(_config['embeds_color'], 16)
-        self.voice_state: VoiceState = None
+        self.voice_states: dict[int, VoiceState] = {}
+        self.queue_store = QueueStore(_config['queue_store_collection'], _config['queue_store_delay'])
+        self.__restore_task: Task = None
+        self.__prewarm_task: Task = None
 
     def get_voice_state(self, ctx: discord_commands.Context):
-        # Get existing voice or create it
-        if not self.voice_state:
-            self.voice_state = VoiceState(self.bot, ctx)
-        return self.voice_state
+        # Get existing guild voice or create it, replacing the ones whose player already ended
+        voice_state = self.voice_states.get(ctx.guild.id)
+        if not voice_state or voice_state.is_idle:
+            voice_state = VoiceState(self.bot, ctx.guild.id, ctx.channel, self.queue_store)
+            self.voice_states[ctx.guild.id] = voice_state
+        return voice_state
+
+    async def restore_voice_states(self):
+        # Reconnect players saved before a restart or reload, tracks are resolved only when they are about to play
+        await self.bot.wait_until_ready()
+        attempts = _config['queue_store_restore_attempts']
+        for attempt in range(1, attempts + 1):
+            try:
+                records = await self.queue_store.load()
+                break
+            except PyMongoError as e:
+                logger.warning(f"Failed to load saved music queues ({attempt}/{attempts}): [{type(e).__name__}: {e}]")
+                if attempt == attempts:
+                    # Saved queues stay in mongo, for the next start
+                    logger.error("Giving up restoring music players")
+                    return
+                await asyncio_sleep(_config['queue_store_restore_retry_delay'])
+        for record in records:
+            guild = self.bot.get_guild(record['_id'])
+            if not guild or guild.id in self.voice_states:
+                continue
+            voice_channel = guild.get_channel(record['voice_channel_id'])
+            text_channel = guild.get_channel(record['text_channel_id'])
+            if not voice_channel or not text_channel:
+                self.queue_store.mark(guild.id)
+                continue
+            voice_state = VoiceState(self.bot, guild.id, text_channel, self.queue_store)
+            try:
+                logger.info(f"Restoring music player on <{voice_channel.name}> with {len(record['tracks'])} tracks")
+                voice_state.voice = await voice_channel.connect()
+            except (DiscordException, TimeoutError) as e:
+                logger.warning(f"Failed to restore music player on <{voice_channel.name}>: [{type(e).__name__}: {e}]")
+                voice_state.audio_player.cancel()
+                self.queue_store.mark(guild.id)
+                continue
+            voice_state.loop = record['loop']
+            voice_state.volume = record['volume']
+            voice_state.music_queue.set_scheduler(record['queue_mode'])
+            for track_record in record['tracks']:
+                track = Track.from_record(track_record)
+                voice_state.music_queue.put_nowait(track, track.weight)
+            self.voice_states[guild.id] = voice_state
 
-    def cog_unload(self):
-        # Stop voice task
-        self.bot.loop.create_task(self.voice_state.stop())
+    @staticmethod
+    def requester_weight(ctx: discord_commands.Context):
+        # Administrators get a bigger share of the queue with fair scheduling
+        return _config['fair_queue_admin_weight'] if ctx.author.guild_permissions.administrator else 1.0
+
+    @discord_tasks.loop(seconds=_config['voice_states_eviction_interval'])
+    async def evict_idle_voice_states(self):
+        # Drop voice states of guilds that are not using the music player anymore
+        for guild_id in [guild_id for guild_id, voice_state in self.voice_states.items() if voice_state.is_idle]:
+            logger.info(f"Evicting idle voice state of guild {guild_id}")
+            del self.voice_states[guild_id]
+
+    async def cog_load(self):
+        # Start idle voice states eviction, and restore saved players once connected
+        self.evict_idle_voice_states.start()
+        Metrics().set_gauge('extraction_pending', lambda: YTDLSource.extraction_pool.pending)
+        Metrics().set_gauge('music_voice_states', lambda: len(self.voice_states))
+        self.__restore_task = asyncio_get_running_loop().create_task(self.restore_voice_states())
+        if _config['prewarm']:
+            self.__prewarm_task = asyncio_get_running_loop().create_task(self.prewarm())
+
+    async def prewarm(self):
+        # Start extraction workers in the background once connected, so that the first track does not wait for them
+        await self.bot.wait_until_ready()
+        try:
+            await YTDLSource.extraction_pool.warm()
+            logger.info("Extraction workers ready")
+        except ExtractionError as e:
+            logger.warning(f"Failed to start extraction workers: [{type(e).__name__}: {e}]")
+
+    async def cog_unload(self):
+        # Stop eviction, save pending queues and stop every guild voice, without forgetting their saved state
+        self.evict_idle_voice_states.cancel()
+        Metrics().remove_gauge('extraction_pending')
+        Metrics().remove_gauge('music_voice_states')
+        self.__restore_task.cancel()
+        if self.__prewarm_task:
+            self.__prewarm_task.cancel()
+        YTDLSource.extraction_pool.shutdown()
+        if YTDLSource.audio_cache:
+            YTDLSource.audio_cache.close()
+        await self.queue_store.close()
+        await asyncio_gather(*(voice_state.stop() for voice_state in self.voice_states.values()))
+        self.voice_states.clear()
+
+    @discord_commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        # Requesters leaving the bot voice channel do not need their pending extractions anymore
+        voice_state = self.voice_states.get(member.guild.id)
+        if voice_state and voice_state.voice and before.channel == voice_state.voice.channel \
+                and after.channel != before.channel:
+            voice_state.cancel_extractions(member.id)
 
     def cog_check(self, ctx: discord_commands.Context):
         # DM messages check
@@ -290,8 +966,13 @@ class Music(discord_commands.Cog):
         return True
 
     async def cog_before_invoke(self, ctx: discord_commands.Context):
-        # Get voice before every command
-        self.voice_state = self.get_voice_state(ctx)
+        # Get guild voice before every command, and keep answering where music was last asked for
+        ctx.voice_state = self.get_voice_state(ctx)
+        ctx.voice_state.text_channel = ctx.channel
+
+    async def cog_after_invoke(self, ctx: discord_commands.Context):
+        # Commands may have changed the queue or the player, so save them
+        ctx.voice_state.save()
 
     @discord_commands.command(name='connect',
                               aliases=['join', 'voice'],
@@ -304,11 +985,12 @@ class Music(discord_commands.Cog):
             await ctx.send(embed=embed_msg)
         else:
             destination_channel = ctx.author.voice.channel
-            if self.voice_state.voice:
+            if ctx.voice_state.voice:
                 if ctx.voice_client.channel != destination_channel and ctx.author.guild_permissions.administrator:
                     # Move to voice channel
-                    logger.info(f"Moving from <{self.voice_state.voice.channel.name}> to <{destination_channel.name}>")
-                    await self.voice_state.voice.move_to(destination_channel)
+                    logger.info(
+                        f"Moving from <{ctx.voice_state.voice.channel.name}> to <{destination_channel.name}>")
+                    await ctx.voice_state.voice.move_to(destination_channel)
                     await ctx.message.add_reaction('🆙')
                 else:
                     embed_msg = DiscordEmbed(description=_config['connect_no_move'].format(ctx.author.mention),
@@ -317,7 +999,7 @@ class Music(discord_commands.Cog):
             else:
                 # Connect to voice channel
                 logger.info(f"Connecting to <{destination_channel.name}>")
-                self.voice_state.voice = await destination_channel.connect()
+                ctx.voice_state.voice = await destination_channel.connect()
                 await ctx.message.add_reaction('🆙')
 
     @discord_commands.command(name='disconnect',
@@ -325,12 +1007,12 @@ class Music(discord_commands.Cog):
                               brief=_config['disconnect_brief'],
                               description=_config['disconnect_description'])
     async def disconnect(self, ctx: discord_commands.Context):
-        if not self.voice_state.voice:
+        if not ctx.voice_state.voice:
             embed_msg = DiscordEmbed(description=_config['disconnect_no_voice'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
-            await self.voice_state.stop()
-            self.voice_state = None
+            await ctx.voice_state.stop()
+            self.voice_states.pop(ctx.guild.id, None)
 
     @discord_commands.command(name='setvolume',
                               aliases=['volume', 'vol'],
@@ -339,7 +1021,7 @@ class Music(discord_commands.Cog):
     async def set_volume(self, ctx: discord_commands.Context,
                          volume: int = discord_commands.parameter(description=_config['set_volume_volume'])):
         embed_msg = DiscordEmbed(color=self.__embeds_color)
-        if not self.voice_state.is_playing:
+        if not ctx.voice_state.is_playing:
             embed_msg.description = _config['no_player']
             await ctx.send(embed=embed_msg)
         else:
@@ -348,7 +1030,7 @@ class Music(discord_commands.Cog):
                 volume = 0
             elif volume > 100:
                 volume = 100
-            self.voice_state.volume = volume / 100
+            ctx.voice_state.volume = volume / 100
             embed_msg.description = _config['set_volume_set'].format(volume)
             await ctx.send(embed=embed_msg)
 
@@ -357,29 +1039,29 @@ class Music(discord_commands.Cog):
                               brief=_config['now_playing_brief'],
                               description=_config['now_playing_description'])
     async def now_playing(self, ctx: discord_commands.Context):
-        if not self.voice_state.is_playing:
+        if not ctx.voice_state.is_playing:
             embed_msg = DiscordEmbed(description=_config['no_player'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
             # Show currently playing music
-            await ctx.send(embed=self.voice_state.current.create_embed())
+            await ctx.send(embed=ctx.voice_state.current.create_embed())
 
     @discord_commands.command(name='pauseresume',
                               aliases=['pause', 'resume'],
                               brief=_config['pause_resume_brief'],
                               description=_config['pause_resume_description'])
     async def pause_resume(self, ctx: discord_commands.Context):
-        if not self.voice_state.is_playing:
+        if not ctx.voice_state.is_playing:
             embed_msg = DiscordEmbed(description=_config['no_player'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
             # Toggle pause
-            if self.voice_state.voice.is_playing():
-                logger.info(f"Music player pausing on <{self.voice_state.voice.channel.name}>")
-                self.voice_state.voice.pause()
-            elif self.voice_state.voice.is_paused():
-                logger.info(f"Music player resuming on <{self.voice_state.voice.channel.name}>")
-                self.voice_state.voice.resume()
+            if ctx.voice_state.voice.is_playing():
+                logger.info(f"Music player pausing on <{ctx.voice_state.voice.channel.name}>")
+                ctx.voice_state.voice.pause()
+            elif ctx.voice_state.voice.is_paused():
+                logger.info(f"Music player resuming on <{ctx.voice_state.voice.channel.name}>")
+                ctx.voice_state.voice.resume()
             await ctx.message.add_reaction('⏯️')
 
     @discord_commands.command(name='stop',
@@ -387,14 +1069,14 @@ class Music(discord_commands.Cog):
                               brief=_config['stop_brief'],
                               description=_config['stop_description'])
     async def stop(self, ctx: discord_commands.Context):
-        if not self.voice_state.is_playing:
+        if not ctx.voice_state.is_playing:
             embed_msg = DiscordEmbed(description=_config['no_player'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
             # Stop music
-            logger.info(f"Music player stopping on <{self.voice_state.voice.channel.name}>")
-            self.voice_state.music_queue.clear()
-            self.voice_state.voice.stop()
+            logger.info(f"Music player stopping on <{ctx.voice_state.voice.channel.name}>")
+            ctx.voice_state.music_queue.clear()
+            ctx.voice_state.voice.stop()
             await ctx.message.add_reaction('⏹️')
 
     @discord_commands.command(name='skip',
@@ -402,19 +1084,20 @@ class Music(discord_commands.Cog):
                               brief=_config['skip_brief'],
                               description=_config['skip_description'].format(_config['skip_votes_amount']))
     async def skip(self, ctx: discord_commands.Context):
-        if not self.voice_state.is_playing:
+        if not ctx.voice_state.is_playing:
             embed_msg = DiscordEmbed(description=_config['no_player'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
             voter = ctx.author
-            if voter.id not in self.voice_state.skip_votes:
-                self.voice_state.skip_votes.add(voter.id)
-                total_votes = len(self.voice_state.skip_votes)
-                if total_votes >= _config['skip_votes_amount'] or voter == self.voice_state.current.source.requester:
+            if voter.id not in ctx.voice_state.skip_votes:
+                ctx.voice_state.skip_votes.add(voter.id)
+                total_votes = len(ctx.voice_state.skip_votes)
+                if (total_votes >= _config['skip_votes_amount']
+                        or voter.id == ctx.voice_state.current.source.track.requester_id):
                     # Skip music
-                    logger.info(f"Music player skipping on <{self.voice_state.voice.channel.name}>")
+                    logger.info(f"Music player skipping on <{ctx.voice_state.voice.channel.name}>")
                     await ctx.message.add_reaction('⏭️')
-                    self.voice_state.skip()
+                    ctx.voice_state.skip()
                 else:
                     embed_msg = DiscordEmbed(
                         description=_config['skip_vote_added'].format(total_votes, _config['skip_votes_amount']),
@@ -432,7 +1115,7 @@ class Music(discord_commands.Cog):
     async def show_queue(self, ctx: discord_commands.Context,
                          page: int = discord_commands.parameter(description=_config['show_queue_page'], default=1)):
         embed_msg = DiscordEmbed(color=self.__embeds_color)
-        queue_len = len(self.voice_state.music_queue)
+        queue_len = len(ctx.voice_state.music_queue)
         if not queue_len:
             embed_msg.description = _config['queue_empty']
         else:
@@ -445,8 +1128,8 @@ class Music(discord_commands.Cog):
                 page = pages
             start = (page - 1) * page_density
             end = start + page_density
-            queue = '\n'.join([f"`{i + 1}.` [**{music.source.title}**]({music.source.url})" for i, music in
-                               enumerate(self.voice_state.music_queue[start:end], start=start)])
+            queue = '\n'.join([f"`{i + 1}.` [**{music.title}**]({music.url})" for i, music in
+                               enumerate(ctx.voice_state.music_queue[start:end], start=start)])
             embed_msg.description = f"Queue (**{queue_len} tracks):**\n\n{queue}"
             embed_msg.set_footer(text=f"Page {page}/{pages}")
         await ctx.send(embed=embed_msg)
@@ -456,13 +1139,13 @@ class Music(discord_commands.Cog):
                               brief=_config['shuffle_queue_brief'],
                               description=_config['shuffle_queue_description'])
     async def shuffle_queue(self, ctx: discord_commands.Context):
-        if not len(self.voice_state.music_queue):
+        if not len(ctx.voice_state.music_queue):
             embed_msg = DiscordEmbed(description=_config['queue_empty'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
             # Shuffle music in queue
             logger.info("Music player shuffling queue")
-            self.voice_state.music_queue.shuffle()
+            ctx.voice_state.music_queue.shuffle()
             await ctx.message.add_reaction('🔀')
 
     @discord_commands.command(name='removefromqueue',
@@ -472,50 +1155,163 @@ class Music(discord_commands.Cog):
     async def remove_from_queue(self, ctx: discord_commands.Context,
                                 index: int = discord_commands.parameter(description=_config['remove_from_queue_index'],
                                                                         default=1)):
-        if not len(self.voice_state.music_queue):
+        if not len(ctx.voice_state.music_queue):
             embed_msg = DiscordEmbed(description=_config['queue_empty'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
             # Remove music
             logger.info(f"Music player removing track at index {index - 1} from queue")
-            self.voice_state.music_queue.remove(index - 1)
+            ctx.voice_state.music_queue.remove(index - 1)
             await ctx.message.add_reaction('⤴️')
 
+    @discord_commands.command(name='movetrack',
+                              aliases=['move', 'mv'],
+                              brief=_config['move_track_brief'],
+                              description=_config['move_track_description'])
+    async def move_track(self, ctx: discord_commands.Context,
+                         index: int = discord_commands.parameter(description=_config['move_track_index']),
+                         position: int = discord_commands.parameter(description=_config['move_track_position'])):
+        if not len(ctx.voice_state.music_queue):
+            embed_msg = DiscordEmbed(description=_config['queue_empty'], color=self.__embeds_color)
+            await ctx.send(embed=embed_msg)
+        else:
+            # Move music
+            logger.info(f"Music player moving track at index {index - 1} to {position - 1} in queue")
+            ctx.voice_state.music_queue.move(index - 1, position - 1)
+            await ctx.message.add_reaction('↕️')
+
+    @discord_commands.command(name='mytracks',
+                              aliases=['mine', 'myqueue'],
+                              brief=_config['my_tracks_brief'],
+                              description=_config['my_tracks_description'])
+    async def my_tracks(self, ctx: discord_commands.Context):
+        embed_msg = DiscordEmbed(color=self.__embeds_color)
+        tracks = ctx.voice_state.music_queue.by_requester(ctx.author.id)
+        if not tracks:
+            embed_msg.description = _config['my_tracks_none'].format(ctx.author.mention)
+        else:
+            # Show first page of requester tracks, with their positions in the queue
+            page_density = _config['show_queue_page_density']
+            queue = '\n'.join([f"`{i + 1}.` [**{music.title}**]({music.url})" for i, music in tracks[:page_density]])
+            embed_msg.description = f"{ctx.author.mention} tracks (**{len(tracks)}**):\n\n{queue}"
+        await ctx.send(embed=embed_msg)
+
+    @discord_commands.command(name='queuemode',
+                              aliases=['qmode', 'scheduling'],
+                              brief=_config['queue_mode_brief'],
+                              description=_config['queue_mode_description'])
+    @discord_commands.has_permissions(administrator=True)
+    async def queue_mode(self, ctx: discord_commands.Context,
+                         mode: str = discord_commands.parameter(description=_config['queue_mode_mode'], default=None)):
+        embed_msg = DiscordEmbed(color=self.__embeds_color)
+        if mode is None:
+            embed_msg.description = _config['queue_mode_current'].format(ctx.voice_state.music_queue.scheduler.name)
+        elif mode.lower() not in MusicQueue.schedulers:
+            embed_msg.description = _config['queue_mode_unknown'].format(mode, ', '.join(MusicQueue.schedulers))
+        else:
+            # Change scheduling of the queue
+            logger.info(f"Music player switching queue to {mode.lower()} scheduling")
+            ctx.voice_state.music_queue.set_scheduler(mode.lower())
+            embed_msg.description = _config['queue_mode_set'].format(mode.lower())
+        await ctx.send(embed=embed_msg)
+
     @discord_commands.command(name='looptrack',
                               aliases=['loop', 'repeat'],
                               brief=_config['loop_track_brief'],
                               description=_config['loop_track_description'])
     async def loop_track(self, ctx: discord_commands.Context):
-        if not self.voice_state.is_playing:
+        if not ctx.voice_state.is_playing:
             embed_msg = DiscordEmbed(description=_config['no_player'], color=self.__embeds_color)
             await ctx.send(embed=embed_msg)
         else:
             # Toggle current track loop
-            logger.info(f"Music player {'disabling' if self.voice_state.loop else 'enabling'} current track repeat")
-            self.voice_state.loop = not self.voice_state.loop
+            logger.info(f"Music player {'disabling' if ctx.voice_state.loop else 'enabling'} current track repeat")
+            ctx.voice_state.loop = not ctx.voice_state.loop
             await ctx.message.add_reaction('🔂')
 
+    @discord_commands.command(name='voicehealth',
+                              aliases=['vhealth', 'playbackhealth'],
+                              brief=_config['voice_health_brief'],
+                              description=_config['voice_health_description'])
+    async def voice_health(self, ctx: discord_commands.Context):
+        health = ctx.voice_state.health
+        embed_msg = DiscordEmbed(color=self.__embeds_color)
+        if not health.frames:
+            embed_msg.description = _config['voice_health_none']
+        else:
+            embed_msg.description = _config['voice_health_info'].format(
+                health.frames, health.late_frames, health.late_frames / health.frames, health.dropped_frames,
+                health.read_latency.mean * 1000, health.read_latency.quantile(0.99) * 1000, health.underruns,
+                health.reconnects, health.restarts, health.errors, health.first_audio.mean * 1000,
+                health.first_audio.quantile(0.95) * 1000)
+        await ctx.send(embed=embed_msg)
+
+    @discord_commands.command(name='musiccache',
+                              aliases=['mcache'],
+                              brief=_config['music_cache_brief'],
+                              description=_config['music_cache_description'])
+    async def music_cache(self, ctx: discord_commands.Context):
+        info_cache = YTDLSource.info_cache
+        embed_msg = DiscordEmbed(description=_config['music_cache_info'].format(
+            _config['info_cache_backend'], len(info_cache), info_cache.max_size, info_cache.hits, info_cache.misses,
+            info_cache.hit_ratio), color=self.__embeds_color)
+        audio_cache = YTDLSource.audio_cache
+        if audio_cache:
+            embed_msg.description += '\n\n' + _config['music_cache_audio'].format(
+                len(audio_cache), audio_cache.size / 2 ** 20, audio_cache.max_size / 2 ** 20)
+        else:
+            embed_msg.description += '\n\n' + _config['music_cache_audio_disabled']
+        await ctx.send(embed=embed_msg)
+
     @discord_commands.command(name='play',
                               aliases=['music'],
                               brief=_config['play_brief'],
                               description=_config['play_description'])
     async def play(self, ctx: discord_commands.Context, *,
                    search: str = discord_commands.parameter(description=_config['play_search'])):
-        if not self.voice_state.voice:
+        if not ctx.voice_state.voice:
             await ctx.invoke(self.connect)
         async with ctx.typing():
             # Try and enqueue requested music
             try:
-                source = await YTDLSource.create(ctx, search, loop=self.bot.loop)
+                info = await ctx.voice_state.extract_info(ctx, search)
             except YTDLError as e:
                 raise YTDLError(f"Inner error while enqueuing music: {str(e)}")
             else:
-                logger.info(f"Music player enqueuing track requested by @{source.requester.name}")
-                track = MusicInfo(source)
-                await self.voice_state.music_queue.put(track)
-                embed_msg = DiscordEmbed(description=f"Enqueued {str(source)}", color=self.__embeds_color)
+                logger.info(f"Music player enqueuing track requested by @{ctx.author.name}")
+                await ctx.voice_state.music_queue.put(Track.from_info(info, ctx.author.id),
+                                                      self.requester_weight(ctx))
+                embed_msg = DiscordEmbed(description=f"Enqueued **{info['title']}** by **{info['uploader']}**",
+                                         color=self.__embeds_color)
                 await ctx.send(embed=embed_msg)
 
+    @discord_commands.command(name='playlist',
+                              aliases=['playall', 'pl'],
+                              brief=_config['playlist_brief'],
+                              description=_config['playlist_description'].format(_config['playlist_max_entries']))
+    async def playlist(self, ctx: discord_commands.Context, *,
+                       url: str = discord_commands.parameter(description=_config['playlist_url'])):
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self.connect)
+        async with ctx.typing():
+            # Try and enqueue the whole playlist as unresolved entries
+            try:
+                entries = await YTDLSource.extract_playlist(url)
+            except YTDLError as e:
+                raise YTDLError(f"Inner error while enqueuing playlist: {str(e)}")
+            logger.info(f"Music player enqueuing {len(entries)} playlist tracks requested by @{ctx.author.name}")
+            tracks = (Track(title or track_url, track_url, duration, ctx.author.id)
+                      for title, track_url, duration in entries)
+            weight = self.requester_weight(ctx)
+            for i, track in enumerate(tracks, start=1):
+                await ctx.voice_state.music_queue.put(track, weight)
+                # Let other tasks run between batches
+                if not i % _config['playlist_enqueue_batch']:
+                    await asyncio_sleep(0)
+            embed_msg = DiscordEmbed(description=_config['playlist_enqueued'].format(len(entries)),
+                                     color=self.__embeds_color)
+            await ctx.send(embed=embed_msg)
+
 
 async def setup(bot):
     await bot.add_cog(Music(bot))
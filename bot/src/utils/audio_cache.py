@@ -0,0 +1,109 @@
+from asyncio import CancelledError, create_subprocess_exec, get_running_loop as asyncio_get_running_loop, Semaphore, \
+    Task
+from asyncio.subprocess import DEVNULL, PIPE
+from collections import Counter, OrderedDict
+from hashlib import sha1
+from logging import getLogger
+from os import makedirs, remove, replace, scandir, utime
+from os.path import exists as path_exists, getsize, join as path_join
+
+# Setting up util logger
+logger = getLogger(__name__.split('.', 1)[-1])
+
+
+class AudioCache(object):
+    """
+    Size bounded LRU cache of popular tracks, stored on disk as opus files.
+    """
+
+    def __init__(self, directory, max_size, min_plays, max_duration, concurrency, before_options=()):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self.__min_plays = min_plays
+        self.__max_duration = max_duration
+        self.__before_options = list(before_options)
+        self.__plays = Counter()
+        self.__files: OrderedDict[str, int] = OrderedDict()
+        self.__transcodes: dict[str, Task] = {}
+        self.__semaphore = Semaphore(concurrency)
+        makedirs(directory, exist_ok=True)
+        # Restore files left by previous runs, least recently used first, and drop unfinished ones
+        for entry in sorted(scandir(directory), key=lambda e: e.stat().st_mtime):
+            if entry.name.endswith('.opus'):
+                self.__files[entry.name] = entry.stat().st_size
+                self.size += entry.stat().st_size
+            else:
+                remove(entry.path)
+        self.__evict()
+
+    def __len__(self):
+        return len(self.__files)
+
+    @staticmethod
+    def __file_name(url):
+        return f"{sha1(url.encode()).hexdigest()}.opus"
+
+    def get(self, url):
+        # Get cached file path, marking it as the most recently used
+        file_name = self.__file_name(url)
+        if file_name not in self.__files:
+            return None
+        self.__files.move_to_end(file_name)
+        path = path_join(self.directory, file_name)
+        utime(path)
+        return path
+
+    def record_play(self, info):
+        # Count plays and start caching tracks as soon as they get popular enough
+        url = info['webpage_url']
+        self.__plays[url] += 1
+        file_name = self.__file_name(url)
+        if (self.__plays[url] >= self.__min_plays and file_name not in self.__files
+                and file_name not in self.__transcodes and (info.get('duration') or 0) <= self.__max_duration):
+            self.__transcodes[file_name] = asyncio_get_running_loop().create_task(self.__transcode(file_name, info))
+
+    async def __transcode(self, file_name, info):
+        path = path_join(self.directory, file_name)
+        part_path = f"{path}.part"
+        process = None
+        try:
+            async with self.__semaphore:
+                # Opus streams only need remuxing, everything else is encoded once by ffmpeg
+                codec_options = (['-c:a', 'copy'] if info.get('acodec') == 'opus' else
+                                 ['-c:a', 'libopus', '-ar', '48000', '-ac', '2', '-b:a', '128k'])
+                process = await create_subprocess_exec('ffmpeg', *self.__before_options, '-i', info['url'], '-vn',
+                                                       '-map_metadata', '-1', *codec_options, '-f', 'opus',
+                                                       '-loglevel', 'error', '-y', part_path,
+                                                       stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE)
+                _, stderr = await process.communicate()
+            if process.returncode:
+                logger.warning(f"Failed to cache audio of {info['webpage_url']}: {stderr.decode().strip()}")
+                return
+            replace(part_path, path)
+            self.__files[file_name] = getsize(path)
+            self.size += self.__files[file_name]
+            logger.info(f"Cached audio of {info['webpage_url']} ({self.__files[file_name] / 2 ** 20:.1f}MB)")
+            self.__evict()
+        except OSError as e:
+            logger.warning(f"Failed to cache audio of {info['webpage_url']}: [{type(e).__name__}: {e}]")
+        except CancelledError:
+            if process and process.returncode is None:
+                process.kill()
+            raise
+        finally:
+            self.__transcodes.pop(file_name, None)
+            # Unfinished files are never kept
+            if path_exists(part_path):
+                remove(part_path)
+
+    def __evict(self):
+        # Remove least recently used files until the cache fits its size again
+        while self.size > self.max_size and self.__files:
+            file_name, size = self.__files.popitem(last=False)
+            self.size -= size
+            remove(path_join(self.directory, file_name))
+
+    def close(self):
+        for transcode in list(self.__transcodes.values()):
+            transcode.cancel()
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from time import time
+
+from .mongo import MongoUtil
+
+
+class LRUCache(object):
+    """
+    Size bounded LRU cache with per entry expiration, kept in memory.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[object, float]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _get(self, key):
+        # Expired entries are dropped on lookup, valid ones become the most recently used
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        # Evict least recently used entries
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key):
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value, expires_at):
+        self._set(key, value, expires_at)
+
+
+class MongoCache(LRUCache):
+    """
+    LRU cache backed by a mongo collection, surviving restarts and shared between processes.
+    """
+
+    def __init__(self, max_size, collection):
+        super().__init__(max_size)
+        self.__mongo_util = MongoUtil()
+        self.__collection = collection
+        self.__indexed = False
+
+    async def __ensure_index(self):
+        # Let mongo delete expired documents on its own
+        if not self.__indexed:
+            await self.__mongo_util.run(self.__mongo_util.db()[self.__collection].create_index, 'expires_at',
+                                        expireAfterSeconds=0)
+            self.__indexed = True
+
+    async def get(self, key):
+        value = self._get(key)
+        if value is None:
+            # Fall back to the collection, then keep the document in memory as well
+            await self.__ensure_index()
+            document = await self.__mongo_util.run(self.__mongo_util.db()[self.__collection].find_one,
+                                                   {'_id': key, 'expires_at': {'$gt': datetime.now(timezone.utc)}})
+            if document is not None:
+                value = document['value']
+                self._set(key, value, document['expires_at'].replace(tzinfo=timezone.utc).timestamp())
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value, expires_at):
+        self._set(key, value, expires_at)
+        await self.__ensure_index()
+        await self.__mongo_util.run(self.__mongo_util.db()[self.__collection].replace_one, {'_id': key},
+                                    {'value': value,
+                                     'expires_at': datetime.fromtimestamp(expires_at, timezone.utc)},
+                                    upsert=True)
@@ -0,0 +1,178 @@
+from asyncio import gather as asyncio_gather, get_running_loop as asyncio_get_running_loop, TimeoutError, \
+    wait_for as asyncio_wait_for
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from logging import getLogger
+from math import ceil as math_ceil
+from multiprocessing import get_context as multiprocessing_get_context
+from re import compile as re_compile
+from resource import getrlimit, getrusage, RLIM_INFINITY, RLIMIT_CPU, RUSAGE_SELF, setrlimit
+from signal import ITIMER_PROF, setitimer, SIGPROF, signal
+from time import time
+
+from .cache import LRUCache
+
+# Setting up util logger
+logger = getLogger(__name__.split('.', 1)[-1])
+
+# Expression parts that make rolls expensive
+_DICE = re_compile(r'(\d*)d(\d+)')
+_REPETITION = re_compile(r'(\d+)x')
+_NUMBER = re_compile(r'\d+')
+
+# Worker cpu time limit for each roll
+_cpu_timeout = None
+
+
+class DiceError(Exception):
+    """
+    Dice rolling specific error class.
+    """
+
+    pass
+
+
+class DiceTimeoutError(DiceError):
+    """
+    Dice rolling timeout specific error class.
+    """
+
+    pass
+
+
+def _expired(signum, frame):
+    raise DiceTimeoutError(f"Roll took more than {_cpu_timeout}s of cpu time")
+
+
+def _init_worker(cpu_timeout):
+    global _cpu_timeout
+    # The cpu timer only runs while rolling, and interrupts sympy wherever it is stuck
+    _cpu_timeout = cpu_timeout
+    signal(SIGPROF, _expired)
+    # Imported here, so that only workers pay for sympy and mpmath
+    import arithmetic_dice_roller.roller  # noqa: F401
+
+
+def _warm():
+    # Nothing left to do, the initializer already imported the roller
+    pass
+
+
+def _limit_cpu(seconds):
+    # The kernel kills workers stuck in C code, where the itimer signal handler never gets to run
+    hard = getrlimit(RLIMIT_CPU)[1]
+    if seconds is None:
+        soft = hard
+    else:
+        # The limit counts cpu time since the worker started, whole seconds only
+        usage = getrusage(RUSAGE_SELF)
+        soft = math_ceil(usage.ru_utime + usage.ru_stime + seconds)
+        if hard != RLIM_INFINITY:
+            soft = min(soft, hard)
+    setrlimit(RLIMIT_CPU, (soft, hard))
+
+
+def _roll(expression, label):
+    from arithmetic_dice_roller.roller import Roller, RollerError
+    setitimer(ITIMER_PROF, _cpu_timeout)
+    _limit_cpu(_cpu_timeout + 1)
+    try:
+        roller = Roller(expression, label)
+        roller.roll()
+    except RollerError as e:
+        # Roller errors cannot always cross process boundaries
+        raise DiceError(str(e)) from None
+    finally:
+        setitimer(ITIMER_PROF, 0)
+        _limit_cpu(None)
+    # Only send back plain strings
+    return {'label': roller.label, 'expression': str(roller.expression),
+            'no_nx_expression': str(roller.no_nx_expression),
+            'rolls': [tuple(str(part) for part in roll) for roll in roller.rolls],
+            'no_dice_expression': str(roller.no_dice_expression), 'final_result': str(roller.final_result)}
+
+
+class DicePool(object):
+    """
+    Bounded pool of dice rolling processes, with complexity limits and cpu time limits.
+    """
+
+    def __init__(self, *, workers, max_pending, cpu_timeout, limits, rejections_size, rejections_ttl):
+        self.__workers = workers
+        self.__max_pending = max_pending
+        self.__cpu_timeout = cpu_timeout
+        self.__limits = limits
+        # Expressions that timed out are refused for a while, instead of taking a worker again
+        self.__rejections = LRUCache(rejections_size)
+        self.__rejections_ttl = rejections_ttl
+        # Static analysis is cached, since the same rolls are asked for over and over
+        self.check = lru_cache(maxsize=1024)(self.__check)
+        self.pending = 0
+        self.__executor = self.__create_executor()
+
+    def __create_executor(self):
+        # Forkserver avoids inheriting the locks held by the bot threads
+        return ProcessPoolExecutor(max_workers=self.__workers, mp_context=multiprocessing_get_context('forkserver'),
+                                   initializer=_init_worker, initargs=(self.__cpu_timeout,))
+
+    def __check(self, expression):
+        # Estimate how expensive the expression is, without rolling anything
+        if len(expression) > self.__limits['max_length']:
+            return f"Expression is longer than {self.__limits['max_length']} characters"
+        depth = 0
+        for character in expression:
+            depth += (character == '(') - (character == ')')
+            if depth > self.__limits['max_depth']:
+                return f"Expression is nested more than {self.__limits['max_depth']} times"
+        if any(len(number) > self.__limits['max_digits'] for number in _NUMBER.findall(expression)):
+            return f"Expression has numbers longer than {self.__limits['max_digits']} digits"
+        repetitions = 1
+        for repetition in _REPETITION.findall(expression):
+            repetitions *= int(repetition)
+        dice = 0
+        for count, sides in _DICE.findall(expression):
+            if int(sides) > self.__limits['max_sides']:
+                return f"Dice have more than {self.__limits['max_sides']} sides"
+            dice += int(count or 1)
+        if dice * repetitions > self.__limits['max_dice']:
+            return f"Expression rolls more than {self.__limits['max_dice']} dice"
+        return None
+
+    async def __run(self, func, *args):
+        if self.pending >= self.__max_pending:
+            raise DiceError("Too many rolls are pending, try again later")
+        self.pending += 1
+        try:
+            # Workers stop rolls on their own or get killed, this only stops waiting behind busy workers
+            return await asyncio_wait_for(
+                asyncio_get_running_loop().run_in_executor(self.__executor, func, *args), self.__cpu_timeout * 2 + 1)
+        except TimeoutError:
+            raise DiceTimeoutError(f"Roll timed out after {self.__cpu_timeout * 2 + 1}s")
+        except BrokenProcessPool:
+            # A worker died, or was killed for going over its cpu limit, so start over with new ones
+            logger.error("Dice pool broke, restarting it")
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+            self.__executor = self.__create_executor()
+            raise DiceError("Roll failed, try again later")
+        finally:
+            self.pending -= 1
+
+    async def warm(self):
+        # Workers are only started when needed, so give each one something to do
+        await asyncio_gather(*(self.__run(_warm) for _ in range(self.__workers)))
+
+    async def roll(self, expression, label=None):
+        error = self.check(expression) or await self.__rejections.get(expression)
+        if error:
+            raise DiceError(error)
+        try:
+            return await self.__run(_roll, expression, label)
+        except DiceTimeoutError as e:
+            logger.warning(f"Refusing `{expression}` for {self.__rejections_ttl}s: {e}")
+            await self.__rejections.set(expression, str(e), time() + self.__rejections_ttl)
+            raise
+
+    def shutdown(self):
+        logger.info("Shutting down dice pool")
+        self.__executor.shutdown(wait=False, cancel_futures=True)
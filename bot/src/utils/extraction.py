@@ -0,0 +1,142 @@
+from asyncio import gather as asyncio_gather, get_running_loop as asyncio_get_running_loop, TimeoutError, \
+    wait_for as asyncio_wait_for
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial as functools_partial, wraps as functools_wraps
+from logging import getLogger
+from multiprocessing import get_context as multiprocessing_get_context
+from threading import local as threading_local
+
+# Setting up util logger
+logger = getLogger(__name__.split('.', 1)[-1])
+
+# Worker state, one ytdl object for each worker thread or process
+_worker = threading_local()
+
+
+class ExtractionError(Exception):
+    """
+    Extraction specific error class.
+    """
+
+    pass
+
+
+def _init_worker(ytdl_options):
+    # Imported here, so that only workers pay for the ytdl extractors
+    from yt_dlp import utils as ytdl_utils, YoutubeDL
+    # Suppress ytdl noise about console usage from errors
+    ytdl_utils.bug_reports_message = lambda: ''
+    _worker.ytdl_options = ytdl_options
+    _worker.ytdl = YoutubeDL(ytdl_options)
+
+
+def _worker_task(func):
+    # Turn ytdl errors into plain ones, since they cannot always cross process boundaries
+    @functools_wraps(func)
+    def wrapper(*args):
+        from yt_dlp.utils import YoutubeDLError
+        try:
+            return func(*args)
+        except YoutubeDLError as e:
+            raise ExtractionError(str(e)) from None
+
+    return wrapper
+
+
+def _warm():
+    # Nothing left to do, the initializer already imported ytdl
+    pass
+
+
+@_worker_task
+def _webpage_url(search):
+    # Flat extraction, just to find what the search points to, and first result of playlists
+    data = _worker.ytdl.extract_info(search, download=False, process=False)
+    if not data:
+        raise ExtractionError(f"Could not find any music that matches `{search}`")
+    if 'entries' not in data:
+        return data['webpage_url']
+    for entry in data['entries']:
+        if entry:
+            return entry['webpage_url']
+    raise ExtractionError(f"Could not find anything that matches `{search}`")
+
+
+@_worker_task
+def _info(webpage_url, fields):
+    # Get actual info and first result of playlists, only keeping the wanted fields
+    processed_info = _worker.ytdl.extract_info(webpage_url, download=False)
+    if processed_info is None:
+        raise ExtractionError(f"Could not fetch `{webpage_url}`")
+    if 'entries' not in processed_info:
+        info = processed_info
+    else:
+        info = next((entry for entry in processed_info['entries'] if entry), None)
+        if info is None:
+            raise ExtractionError(f"Could not retrieve any matches for `{webpage_url}`")
+    return {key: info.get(key) for key in fields}
+
+
+@_worker_task
+def _playlist(url, max_entries):
+    # Flat playlist extraction, only keeping title, url and duration of each entry
+    if not hasattr(_worker, 'playlist_ytdl'):
+        from yt_dlp import YoutubeDL
+        _worker.playlist_ytdl = YoutubeDL({**_worker.ytdl_options, 'noplaylist': False,
+                                           'extract_flat': 'in_playlist', 'playlistend': max_entries})
+    data = _worker.playlist_ytdl.extract_info(url, download=False)
+    if not data or not data.get('entries'):
+        raise ExtractionError(f"Could not find any playlist at `{url}`")
+    return [(entry.get('title'), entry.get('webpage_url') or entry.get('url'), entry.get('duration'))
+            for entry in data['entries'] if entry][:max_entries]
+
+
+class ExtractionPool(object):
+    """
+    Bounded pool of extraction workers, isolated in their own processes or threads.
+    """
+
+    def __init__(self, ytdl_options, *, workers, processes, max_pending, timeout):
+        if processes:
+            # Forkserver avoids inheriting the locks held by the bot threads
+            self.__executor = ProcessPoolExecutor(max_workers=workers,
+                                                  mp_context=multiprocessing_get_context('forkserver'),
+                                                  initializer=_init_worker, initargs=(ytdl_options,))
+        else:
+            self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extraction',
+                                                 initializer=_init_worker, initargs=(ytdl_options,))
+        self.__workers = workers
+        self.__max_pending = max_pending
+        self.__timeout = timeout
+        self.pending = 0
+
+    async def __run(self, func, *args):
+        # Refuse work beyond the queue bound, and stop waiting for extractions taking too long
+        if self.pending >= self.__max_pending:
+            raise ExtractionError("Too many extractions are pending, try again later")
+        self.pending += 1
+        try:
+            return await asyncio_wait_for(
+                asyncio_get_running_loop().run_in_executor(self.__executor, functools_partial(func, *args)),
+                self.__timeout)
+        except TimeoutError:
+            raise ExtractionError(f"Extraction timed out after {self.__timeout}s")
+        finally:
+            self.pending -= 1
+
+    async def warm(self):
+        # Workers are only started when needed, so give each one something to do
+        await asyncio_gather(*(self.__run(_warm) for _ in range(self.__workers)))
+
+    async def webpage_url(self, search):
+        return await self.__run(_webpage_url, search)
+
+    async def info(self, webpage_url, fields):
+        return await self.__run(_info, webpage_url, fields)
+
+    async def playlist(self, url, max_entries):
+        return await self.__run(_playlist, url, max_entries)
+
+    def shutdown(self):
+        logger.info("Shutting down extraction pool")
+        self.__executor.shutdown(wait=False, cancel_futures=True)
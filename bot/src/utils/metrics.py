@@ -0,0 +1,159 @@
+from asyncio import get_running_loop as asyncio_get_running_loop, sleep as asyncio_sleep, start_server, Task
+from bisect import bisect_left
+from logging import getLogger
+from math import inf
+from time import perf_counter
+
+# Setting up util logger
+logger = getLogger(__name__.split('.', 1)[-1])
+
+
+class Histogram(object):
+    """
+    Histogram of durations in seconds, with fixed cumulative buckets.
+    """
+
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, inf)
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return 0.0
+
+
+class Metrics(object):
+    """
+    Metrics registry singleton, with labelled histograms, counters and gauges.
+    """
+    __instance = None
+    # Bucket bounds as rendered in the le label
+    __bounds = tuple('+Inf' if bound == inf else str(bound) for bound in Histogram.buckets)
+
+    def __new__(cls):
+        if cls.__instance is None:
+            cls.__instance = super(Metrics, cls).__new__(cls)
+            cls.__instance.histograms: dict[tuple[str, tuple], Histogram] = {}
+            cls.__instance.counters: dict[tuple[str, tuple], float] = {}
+            cls.__instance.gauges: dict[tuple[str, tuple], callable] = {}
+            cls.__instance.__tasks: list[Task] = []
+        return cls.__instance
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, func, **labels):
+        # Gauges are read only when rendered, so they cost nothing in between
+        self.gauges[(name, tuple(sorted(labels.items())))] = func
+
+    def remove_gauge(self, name, **labels):
+        self.gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def labelled(self, metrics, name):
+        # Get label dicts and values of every series of a metric
+        return [(dict(labels), value) for (metric_name, labels), value in metrics.items() if metric_name == name]
+
+    def start(self, loop_lag_interval, host=None, port=None):
+        # Sample event loop lag, and serve prometheus metrics if a port is given
+        loop = asyncio_get_running_loop()
+        self.__tasks.append(loop.create_task(self.__sample_loop_lag(loop_lag_interval)))
+        if port:
+            self.__tasks.append(loop.create_task(self.__serve(host, port)))
+
+    async def __sample_loop_lag(self, interval):
+        # Anything keeping the loop busy delays waking up from sleep
+        while True:
+            start = perf_counter()
+            await asyncio_sleep(interval)
+            self.observe('event_loop_lag_seconds', max(0.0, perf_counter() - start - interval))
+
+    async def __serve(self, host, port):
+        server = await start_server(self.__handle, host, port)
+        logger.info(f"Serving prometheus metrics on {host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    async def __handle(self, reader, writer):
+        # Bare HTTP, just enough for prometheus scrapes
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if request_line.split()[1:2] == [b'/metrics']:
+                status, body = b'200 OK', self.render().encode()
+            else:
+                status, body = b'404 Not Found', b'Not found\n'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def __labels(labels):
+        # Label pairs of a series without braces, rendered once for all of its lines
+        return ','.join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels)
+
+    def render(self):
+        # Prometheus text format, built on the bot loop, so every series is formatted as few times as possible
+        lines = []
+        types = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in types:
+                types.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            pairs = self.__labels(labels)
+            braces = f"{{{pairs}}}" if pairs else ''
+            bucket = f"{name}_bucket{{{pairs},le=" if pairs else f"{name}_bucket{{le="
+            cumulative = 0
+            for bound, count in zip(self.__bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{bucket}"{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{braces} {histogram.sum}")
+            lines.append(f"{name}_count{braces} {histogram.count}")
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in types:
+                types.add(name)
+                lines.append(f"# TYPE {name} counter")
+            pairs = self.__labels(labels)
+            lines.append(f"{name}{{{pairs}}} {value}" if pairs else f"{name} {value}")
+        for (name, labels), func in sorted(self.gauges.items(), key=lambda item: item[0]):
+            if name not in types:
+                types.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            pairs = self.__labels(labels)
+            lines.append(f"{name}{{{pairs}}} {func()}" if pairs else f"{name} {func()}")
+        return '\n'.join(lines) + '\n'
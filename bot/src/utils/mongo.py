@@ -1,38 +1,164 @@
-from json import load as json_load
+from asyncio import get_running_loop as asyncio_get_running_loop, sleep as asyncio_sleep, Task
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial as functools_partial
+from hashlib import sha1
+from json import dumps as json_dumps, JSONDecoder
 from logging import getLogger
-from os import listdir as os_listdir
+from os import getpid, listdir as os_listdir
 from os.path import join as path_join
+from time import perf_counter
 
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo import DeleteMany, MongoClient, timeout as pymongo_timeout, UpdateOne
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+from .metrics import Metrics
 
 # Setting up util logger
 logger = getLogger(__name__.split('.', 1)[-1])
 
 
+def iter_json_array(file, chunk_size=65536):
+    # Decode array items one at a time, reading the file in chunks instead of all at once
+    decoder = JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Skip separators, and the array brackets
+        while position < len(buffer) and buffer[position] in ' \t\r\n,' + ('' if started else '['):
+            started = started or buffer[position] == '['
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        if position < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # Items are only complete once something that cannot go on with them follows,
+                # since numbers like `1.5` also decode as `1` when the chunk ends after `1.`
+                if eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                    position = end
+                    yield item
+                    continue
+        if eof:
+            return
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+class MongoUnavailableError(ConnectionFailure):
+    """
+    Mongo unavailable specific error class, raised without even trying while the circuit breaker is open.
+    """
+
+    pass
+
+
 class MongoUtil(object):
     """
     Mongo utility singleton.
     """
     __instance = None
+    __pid = None
+    __mongo_uri = None
+    __max_workers = 8
+    __options = {'operation_timeout': 8, 'breaker_failures': 3, 'breaker_probe_interval': 5}
     __mongo_client = None
+    __executor = None
     __db = None
 
-    def __new__(cls, mongo_uri=None):
-        if cls.__instance is None:
+    def __new__(cls, mongo_uri=None, max_workers=None, options=None):
+        # Clients and threads do not survive forks, so forked processes get their own instance
+        if cls.__instance is None or cls.__pid != getpid():
             logger.info("Creating mongo client singleton instance")
             cls.__instance = super(MongoUtil, cls).__new__(cls)
-            cls.__mongo_client = MongoClient(mongo_uri, timeoutMS=8000)
+            cls.__instance.pending = 0
+            # Circuit breaker state, opened by consecutive failures and closed by a successful probe
+            cls.__instance.failures = 0
+            cls.__instance.__probe: Task = None
+            cls.__pid = getpid()
+            cls.__mongo_uri = mongo_uri or cls.__mongo_uri
+            cls.__max_workers = max_workers or cls.__max_workers
+            cls.__options = options or cls.__options
+            # Client connection pool and executor are sized together, so that every worker can hold a connection,
+            # and waiting for a connection or a server takes less than an operation is allowed to
+            cls.__mongo_client = MongoClient(
+                cls.__mongo_uri, timeoutMS=cls.__options['operation_timeout'] * 1000, maxPoolSize=cls.__max_workers,
+                minPoolSize=cls.__options.get('min_pool_size', 0),
+                maxIdleTimeMS=cls.__options.get('max_idle_time_ms'),
+                waitQueueTimeoutMS=cls.__options.get('wait_queue_timeout_ms'),
+                serverSelectionTimeoutMS=cls.__options.get('server_selection_timeout_ms', 30000),
+                connectTimeoutMS=cls.__options.get('connect_timeout_ms', 20000))
+            cls.__executor = ThreadPoolExecutor(max_workers=cls.__max_workers, thread_name_prefix='mongo')
             # Already prepare default database
             cls.__db = cls.__mongo_client['odoaldo']
+            Metrics().set_gauge('mongo_breaker_open', lambda: int(cls.__instance.is_open))
         return cls.__instance
 
+    @property
+    def is_open(self):
+        return self.failures >= self.__options['breaker_failures']
+
+    @staticmethod
+    def __call(deadline, func, *args, **kwargs):
+        # Every operation inside the call shares the same deadline
+        with pymongo_timeout(deadline):
+            return func(*args, **kwargs)
+
+    async def run(self, func, *args, deadline=None, **kwargs):
+        # Run blocking pymongo calls inside the bounded executor, keeping the event loop free,
+        # and fail fast while mongo is known to be unreachable
+        if self.is_open:
+            Metrics().increment('mongo_rejected_total')
+            raise MongoUnavailableError("Mongo is unavailable, try again later")
+        self.pending += 1
+        start = perf_counter()
+        try:
+            result = await asyncio_get_running_loop().run_in_executor(
+                self.__executor, functools_partial(self.__call, deadline or self.__options['operation_timeout'],
+                                                   func, *args, **kwargs))
+        except PyMongoError as error:
+            # Only connection problems and timeouts say something about mongo health
+            if isinstance(error, ConnectionFailure) or error.timeout:
+                self.__record_failure(error)
+            raise
+        finally:
+            self.pending -= 1
+            Metrics().observe('mongo_operation_seconds', perf_counter() - start,
+                              operation=getattr(func, '__name__', 'other'))
+        self.failures = 0
+        return result
+
+    def __record_failure(self, error):
+        self.failures += 1
+        if self.failures == self.__options['breaker_failures']:
+            logger.error(f"Mongo failed {self.failures} times in a row, opening circuit breaker: "
+                         f"[{type(error).__name__}: {error}]")
+            Metrics().increment('mongo_breaker_trips_total')
+            self.__probe = asyncio_get_running_loop().create_task(self.__probe_until_healthy())
+
+    async def __probe_until_healthy(self):
+        # Ping in the background, letting operations through again as soon as mongo answers
+        while True:
+            await asyncio_sleep(self.__options['breaker_probe_interval'])
+            error = await asyncio_get_running_loop().run_in_executor(self.__executor, self.ping)
+            if not error:
+                logger.info("Mongo is reachable again, closing circuit breaker")
+                self.failures = 0
+                return
+
     def ping(self):
         try:
             logger.info("Pinging mongo instance")
             self.__mongo_client.admin.command('ping')
             return ''
-        except ConnectionFailure as error:
+        except PyMongoError as error:
             return error
 
     def db(self):
@@ -42,11 +168,52 @@ class MongoUtil(object):
         logger.info(
             "Resetting mongo database to init data" if reset else "Initializing mongo database with missing data")
         init_data_path = path_join('bot', 'src', 'init_data')
+        # Existing collections are listed just once
+        collection_names = set(self.__db.list_collection_names())
         for file in os_listdir(init_data_path):
             collection = file.replace('.json', '')
-            if collection not in self.__db.list_collection_names() or reset:
-                with open(path_join(init_data_path, file), 'r', encoding='utf-8') as f:
-                    data = json_load(f)
-                logger.info(f"Resetting {collection} collection")
-                self.__db[collection].drop()
-                self.__db[collection].insert_many(data)
+            if collection not in collection_names or reset:
+                self.__sync_collection(collection, path_join(init_data_path, file))
+
+    def __sync_collection(self, collection, path):
+        # Bring the collection to the init data, only writing the documents that differ, identified by content hash
+        start = perf_counter()
+        batch_size = self.__options.get('init_data_batch_size', 500)
+        self.__db[collection].create_index('_init_hash', sparse=True)
+        existing = [(document.get('_init_hash'), document['_id'])
+                    for document in self.__db[collection].find({}, {'_init_hash': True})]
+        existing_hashes = {init_hash for init_hash, _ in existing}
+        hashes = set()
+        inserted = unchanged = 0
+        batch = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for document in iter_json_array(f):
+                # Identical documents get different hashes, by counting them
+                canonical = json_dumps(document, sort_keys=True, ensure_ascii=False)
+                init_hash = sha1(canonical.encode()).hexdigest()
+                duplicate = 1
+                while init_hash in hashes:
+                    init_hash = sha1(f"{canonical}#{duplicate}".encode()).hexdigest()
+                    duplicate += 1
+                hashes.add(init_hash)
+                if init_hash in existing_hashes:
+                    unchanged += 1
+                    continue
+                batch.append(UpdateOne({'_init_hash': init_hash},
+                                       {'$setOnInsert': {**document, '_init_hash': init_hash}}, upsert=True))
+                if len(batch) >= batch_size:
+                    inserted += self.__db[collection].bulk_write(batch, ordered=False).upserted_count
+                    batch.clear()
+                    logger.info(f"Syncing {collection} collection: {inserted} documents inserted so far")
+        if batch:
+            inserted += self.__db[collection].bulk_write(batch, ordered=False).upserted_count
+        # Everything else goes, only after inserting, so that the collection is never empty in between
+        stale = [document_id for init_hash, document_id in existing if init_hash not in hashes]
+        deleted = 0
+        for i in range(0, len(stale), batch_size):
+            deleted += self.__db[collection].bulk_write([DeleteMany({'_id': {'$in': stale[i:i + batch_size]}})],
+                                                        ordered=False).deleted_count
+        elapsed = perf_counter() - start
+        Metrics().observe('mongo_init_data_sync_seconds', elapsed, collection=collection)
+        logger.info(f"Synced {collection} collection in {elapsed:.2f}s: "
+                    f"{inserted} inserted, {deleted} deleted, {unchanged} unchanged")
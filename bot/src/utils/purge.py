@@ -0,0 +1,96 @@
+from asyncio import Queue, TaskGroup
+from datetime import timedelta
+from logging import getLogger
+from time import perf_counter
+
+from discord import NotFound
+from discord.utils import utcnow
+
+# Setting up util logger
+logger = getLogger(__name__.split('.', 1)[-1])
+
+# Discord refuses to bulk delete messages older than two weeks, the margin covers purges that take a while
+_BULK_MAX_AGE = timedelta(days=14) - timedelta(minutes=10)
+_BULK_SIZE = 100
+
+
+class PurgeEngine(object):
+    """
+    Channel purge engine, deleting messages while still fetching history, in bulk whenever discord allows it.
+    """
+
+    def __init__(self, channel, *, limit, check=None, before=None, max_scan=None, queue_size=200):
+        self.channel = channel
+        self.limit = limit
+        self.check = check
+        self.before = before
+        # Without filters every message matches, so there is no point in scanning more than needed
+        self.max_scan = max_scan if check else limit
+        self.scanned = 0
+        self.matched = 0
+        self.deleted = 0
+        self.elapsed = 0.0
+        # Bounded, so that history is only fetched as fast as messages are deleted
+        self.__bulk = Queue(queue_size)
+        self.__single = Queue(queue_size)
+
+    async def run(self):
+        # Bulk and single deletes use different routes, each lane only waits for its own rate limit bucket
+        start = perf_counter()
+        try:
+            async with TaskGroup() as tasks:
+                tasks.create_task(self.__fetch())
+                tasks.create_task(self.__delete_bulk())
+                tasks.create_task(self.__delete_single())
+        except ExceptionGroup as e:
+            # Other lanes were only cancelled because of the first failure
+            raise e.exceptions[0]
+        finally:
+            self.elapsed = perf_counter() - start
+            logger.info(f"Deleted {self.deleted} of {self.scanned} scanned messages from #{self.channel} "
+                        f"in {self.elapsed:.1f}s")
+        return self.deleted
+
+    async def __fetch(self):
+        cutoff = utcnow() - _BULK_MAX_AGE
+        async for message in self.channel.history(limit=self.max_scan, before=self.before):
+            self.scanned += 1
+            if self.check and not self.check(message):
+                continue
+            self.matched += 1
+            # History comes newest first, so old messages only start once bulk deletable ones are over
+            await (self.__bulk if message.created_at > cutoff else self.__single).put(message)
+            if self.matched >= self.limit:
+                break
+        # Tell deleting lanes that nothing else is coming, failures cancel them instead
+        await self.__bulk.put(None)
+        await self.__single.put(None)
+
+    async def __delete_bulk(self):
+        finished = False
+        while not finished:
+            # Take whatever history already queued up, without waiting for a full batch
+            batch = [await self.__bulk.get()]
+            while len(batch) < _BULK_SIZE and batch[-1] is not None and not self.__bulk.empty():
+                batch.append(self.__bulk.get_nowait())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if len(batch) > 1:
+                await self.channel.delete_messages(batch)
+                self.deleted += len(batch)
+            elif batch:
+                # Bulk deletes need at least two messages
+                await self.__delete(batch[0])
+
+    async def __delete_single(self):
+        while (message := await self.__single.get()) is not None:
+            await self.__delete(message)
+
+    async def __delete(self, message):
+        try:
+            await message.delete()
+            self.deleted += 1
+        except NotFound:
+            # Somebody else already deleted it
+            pass
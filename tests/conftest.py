@@ -0,0 +1,48 @@
+from os import chdir, environ
+from os.path import abspath, dirname, join as path_join
+from sys import path as sys_path
+
+import pytest
+
+# Modules read their config relative to the repository root, like the bot does when started from there
+_root = dirname(dirname(abspath(__file__)))
+chdir(_root)
+environ.setdefault('BOT_CONFIG', 'bot_config.json')
+sys_path.insert(0, path_join(_root, 'bot'))
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    # Mongo utility running operations in its executor as usual, against an in-process fake database
+    from fakes import FakeDatabase
+    from src.utils.mongo import MongoUtil
+    database = FakeDatabase()
+    mongo_util = MongoUtil()
+    mongo_util.failures = 0
+    monkeypatch.setattr(MongoUtil, '_MongoUtil__db', database)
+    yield database
+    # Failures of the fake database do not leave the circuit breaker open for other tests
+    mongo_util.failures = 0
+
+
+@pytest.fixture
+def player(monkeypatch):
+    # Tracks resolve right away and play fake audio, so only the players themselves are measured
+    from asyncio import Semaphore
+    from fakes import FakeAudio, FakeExtractionPool
+    from src.extensions import music
+    extracted = []
+
+    async def extract_info(cls, search, *, cache=True):
+        extracted.append((search, cache))
+        return {'title': search.rsplit('/', 1)[-1], 'uploader': 'someone', 'duration': 1, 'webpage_url': search,
+                'url': f"{search}?expire=4000000000"}
+
+    monkeypatch.setattr(music.YTDLSource, 'extract_info', classmethod(extract_info))
+    monkeypatch.setattr(music.YTDLSource, '_YTDLSource__create_audio', lambda self, position=0: FakeAudio())
+    monkeypatch.setattr(music.YTDLSource, 'extraction_pool', FakeExtractionPool())
+    monkeypatch.setitem(music._config, 'prewarm', False)
+    # Semaphores stick to the loop they first waited in, and each test runs its own
+    monkeypatch.setattr(music.VoiceState, '_VoiceState__prefetch_semaphore',
+                        Semaphore(music._config['prefetch_concurrency']))
+    return extracted
@@ -0,0 +1,60 @@
+"""
+Extraction stress run, started by the tests with the fake yt-dlp first on the python path.
+Plays voice frames in a thread on the same schedule as the discord audio player, while the extraction pool works
+through many requests at once, then prints how late frames were, as json.
+"""
+from argparse import ArgumentParser
+from asyncio import gather as asyncio_gather, run as asyncio_run
+from json import dumps as json_dumps
+from math import ceil as math_ceil
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+from src.utils.extraction import ExtractionPool
+
+# Discord audio frames always last 20ms
+_FRAME_LENGTH = 0.02
+
+
+def _play_frames(stop: Event, lateness: list):
+    # Sleep until each frame is due, like the discord audio player, recording how late every frame is sent
+    start = perf_counter()
+    frames = 0
+    while not stop.is_set():
+        frames += 1
+        due = start + frames * _FRAME_LENGTH
+        sleep(max(0.0, due - perf_counter()))
+        lateness.append(max(0.0, perf_counter() - due))
+
+
+def _quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, math_ceil(q * len(values)) - 1)]
+
+
+async def main(arguments):
+    pool = ExtractionPool({}, workers=arguments.workers, processes=arguments.mode == 'process',
+                          max_pending=arguments.requests, timeout=60)
+    # Workers start and import the extractor before playing, like prewarming does
+    await pool.warm()
+    stop = Event()
+    lateness = []
+    player = Thread(target=_play_frames, args=(stop, lateness))
+    player.start()
+    start = perf_counter()
+    infos = await asyncio_gather(*(pool.info(f"https://video.test/{i}", ('title', 'url'))
+                                   for i in range(arguments.requests)))
+    elapsed = perf_counter() - start
+    stop.set()
+    player.join()
+    pool.shutdown()
+    print(json_dumps({'extracted': len(infos), 'elapsed': elapsed, 'frames': len(lateness),
+                      'p50': _quantile(lateness, 0.5), 'p99': _quantile(lateness, 0.99), 'max': max(lateness)}))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('mode', choices=['process', 'thread'])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=40)
+    asyncio_run(main(parser.parse_args()))
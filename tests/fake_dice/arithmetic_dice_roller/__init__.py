@@ -0,0 +1,3 @@
+"""
+Fake arithmetic dice roller for dice pool tests and benchmarks, with the interface the games extension uses.
+"""
@@ -0,0 +1,64 @@
+"""
+Fake roller, expanding NxE repetitions and rolling dice like the real one, then evaluating the arithmetic in python.
+Powers are multiplied one step at a time, so that huge expressions burn cpu without ever leaving the interpreter.
+"""
+from ast import Add, BinOp, Constant, Div, Mult, parse, Pow, Sub, UAdd, UnaryOp, USub
+from random import randint
+from re import compile as re_compile
+
+_VALID = re_compile(r'[\dd+\-*/^()x]+')
+_REPETITION = re_compile(r'(\d+)x\(([^()]*)\)')
+_DICE = re_compile(r'(\d*)d(\d+)')
+
+
+class RollerError(Exception):
+    pass
+
+
+class Roller(object):
+    def __init__(self, expression, label=None):
+        if not _VALID.fullmatch(expression):
+            raise RollerError(f"Invalid expression {expression}")
+        self.expression = expression
+        self.label = label
+        self.no_nx_expression = None
+        self.rolls = []
+        self.no_dice_expression = None
+        self.final_result = None
+
+    def roll(self):
+        self.no_nx_expression = _REPETITION.sub(lambda match: '+'.join(f"({match[2]})" for _ in range(int(match[1]))),
+                                                self.expression)
+        self.no_dice_expression = _DICE.sub(self.__roll_dice, self.no_nx_expression)
+        try:
+            self.final_result = self.__evaluate(parse(self.no_dice_expression.replace('^', '**'), mode='eval').body)
+        except (SyntaxError, ZeroDivisionError) as e:
+            raise RollerError(f"Invalid expression {self.expression}: {e}") from None
+
+    def __roll_dice(self, match):
+        results = [randint(1, int(match[2])) for _ in range(int(match[1] or 1))]
+        self.rolls.append((match[0], sum(results), results))
+        return str(sum(results))
+
+    def __evaluate(self, node):
+        if isinstance(node, Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, UnaryOp) and isinstance(node.op, (UAdd, USub)):
+            value = self.__evaluate(node.operand)
+            return -value if isinstance(node.op, USub) else value
+        if isinstance(node, BinOp):
+            left, right = self.__evaluate(node.left), self.__evaluate(node.right)
+            if isinstance(node.op, Add):
+                return left + right
+            if isinstance(node.op, Sub):
+                return left - right
+            if isinstance(node.op, Mult):
+                return left * right
+            if isinstance(node.op, Div):
+                return left / right
+            if isinstance(node.op, Pow) and isinstance(right, int) and right >= 0:
+                result = 1
+                for _ in range(right):
+                    result *= left
+                return result
+        raise RollerError(f"Unsupported expression {self.expression}")
@@ -0,0 +1,27 @@
+"""
+Fake yt-dlp for extraction stress tests, burning cpu in python like real extractors do, without any network.
+"""
+from os import environ
+from time import sleep, thread_time
+
+from .utils import DownloadError
+
+
+class YoutubeDL(object):
+    def __init__(self, options):
+        self.options = options
+
+    def extract_info(self, url, download=False, process=True):
+        if 'error' in url:
+            raise DownloadError(f"Fake error for {url}")
+        if 'slow' in url:
+            sleep(float(environ.get('FAKE_YTDL_SLOW', '1')))
+        # Busy loop holding the interpreter lock, measured on the thread so that other workers do not count
+        end = thread_time() + float(environ.get('FAKE_YTDL_CPU', '0.05'))
+        while thread_time() < end:
+            pass
+        webpage_url = url if url.startswith('https://') else f"https://video.test/{url.split()[-1]}"
+        if not process:
+            return {'webpage_url': webpage_url}
+        return {'title': webpage_url.rsplit('/', 1)[-1], 'uploader': 'someone', 'duration': 180,
+                'webpage_url': webpage_url, 'url': f"https://stream.test/{webpage_url.rsplit('/', 1)[-1]}"}
@@ -0,0 +1,10 @@
+class YoutubeDLError(Exception):
+    pass
+
+
+class DownloadError(YoutubeDLError):
+    pass
+
+
+def bug_reports_message():
+    return ''
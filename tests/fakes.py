@@ -0,0 +1,599 @@
+from asyncio import Event, get_running_loop as asyncio_get_running_loop, sleep as asyncio_sleep, \
+    wait_for as asyncio_wait_for
+from bisect import bisect_right
+from contextlib import nullcontext
+from datetime import datetime
+from functools import partial as functools_partial
+from itertools import count, islice
+from math import ceil as math_ceil
+from random import sample as random_sample
+from re import compile as re_compile
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+from struct import pack, unpack
+from threading import Event as ThreadingEvent, Thread
+from time import perf_counter, sleep as time_sleep, thread_time
+from types import SimpleNamespace
+
+from bson import decode as bson_decode, encode as bson_encode
+from discord import AudioSource
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError, OperationFailure
+
+# Words of text searches
+_TEXT_WORDS = re_compile(r'\w+')
+
+
+async def until(condition, timeout=10):
+    # Poll the condition while the event loop runs everything else
+    async def wait():
+        while not condition():
+            await asyncio_sleep(0.01)
+
+    await asyncio_wait_for(wait(), timeout)
+
+
+class FakeBot(object):
+    """
+    Fake bot, with just what the extensions use outside of commands.
+    """
+
+    def __init__(self, guilds=()):
+        self.guilds = {guild.id: guild for guild in guilds}
+
+    @property
+    def loop(self):
+        return asyncio_get_running_loop()
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+
+class FakeChannel(object):
+    """
+    Fake text or voice channel, remembering sent embeds and connecting fake voice clients.
+    """
+
+    def __init__(self, channel_id, name=None, play_time=0.05):
+        self.id = channel_id
+        self.name = name or f"channel-{channel_id}"
+        self.play_time = play_time
+        self.sent = []
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, embed=None):
+        self.sent.append(embed)
+
+    async def connect(self):
+        return FakeVoiceClient(self, self.play_time)
+
+
+class FakeGuild(object):
+    def __init__(self, guild_id, channels=()):
+        self.id = guild_id
+        self.channels = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+class FakeContext(object):
+    def __init__(self, guild, channel, author_id=1, attachments=()):
+        self.guild = guild
+        self.channel = channel
+        self.author = SimpleNamespace(id=author_id, name=f"user-{author_id}", mention=f"<@{author_id}>")
+        self.message = SimpleNamespace(attachments=list(attachments))
+        self.sent = []
+
+    async def send(self, embed=None, file=None, view=None):
+        # Files are read right away, like discord does before they get closed
+        self.sent.append(embed if file is None else file.fp.read())
+
+    def typing(self):
+        return nullcontext()
+
+
+class FakeAttachment(object):
+    def __init__(self, filename, data: bytes):
+        self.filename = filename
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+
+class FakeQueueStore(object):
+    """
+    Fake music queue store, only remembering which guilds changed.
+    """
+
+    def __init__(self, records=()):
+        self.records = list(records)
+        self.marked = set()
+
+    def mark(self, guild_id, voice_state=None):
+        self.marked.add(guild_id)
+
+    async def load(self):
+        return self.records
+
+    async def close(self):
+        pass
+
+
+class FakeExtractionPool(object):
+    """
+    Fake extraction pool, taking a fixed time for every extraction, half to find the url and half to get the info.
+    """
+
+    def __init__(self, delay=0.0, expire=4000000000):
+        self.delay = delay
+        self.expire = expire
+        self.pending = 0
+
+    async def webpage_url(self, search):
+        await asyncio_sleep(self.delay / 2)
+        return search
+
+    async def info(self, webpage_url, fields):
+        await asyncio_sleep(self.delay / 2)
+        return {'title': webpage_url.rsplit('/', 1)[-1], 'uploader': 'someone', 'duration': 1,
+                'webpage_url': webpage_url, 'url': f"{webpage_url}?expire={self.expire}"}
+
+    def shutdown(self):
+        pass
+
+
+class FakeAudio(AudioSource):
+    """
+    Fake audio, made of silent frames instead of ffmpeg output.
+    """
+
+    def __init__(self):
+        self.cleaned_up = False
+
+    def read(self):
+        return b'\x00' * 3840
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class FakeVoiceClient(object):
+    """
+    Fake voice client, playing every source for a fixed time and then calling back like the discord player thread.
+    """
+
+    def __init__(self, channel, play_time):
+        self.channel = channel
+        self.play_time = play_time
+        self.played = []
+        # Time between the end of a track and the start of the next one
+        self.gaps = []
+        self.__finished_at = None
+        self.__playing = None
+        self.__after = None
+
+    def play(self, source, *, after):
+        if self.__finished_at is not None:
+            self.gaps.append(perf_counter() - self.__finished_at)
+        self.played.append(source)
+        self.__after = after
+        self.__playing = asyncio_get_running_loop().call_later(self.play_time, self.__finish)
+
+    def __finish(self, error=None):
+        self.__finished_at = perf_counter()
+        self.__playing = None
+        self.played[-1].cleanup()
+        self.__after(error)
+
+    def is_playing(self):
+        return self.__playing is not None
+
+    def is_paused(self):
+        return False
+
+    def stop(self):
+        if self.__playing:
+            self.__playing.cancel()
+            self.__finish()
+
+    async def disconnect(self):
+        self.stop()
+
+
+class FakeGateway(object):
+    """
+    Fake discord gateway, connecting a websocket for every shard that receives some events and then waits until closed.
+    Handling every event takes a fixed cpu time, like parsing it and running the listeners would.
+    """
+
+    def __init__(self, events=0, cpu=0.0):
+        self.events = events
+        self.cpu = cpu
+        self.connected = {}
+        self.handled = {}
+        self.closed = set()
+
+    async def from_client(self, client, *, initial=False, gateway=None, shard_id=None, **kwargs):
+        self.connected[shard_id] = (initial, str(gateway))
+        self.handled[shard_id] = 0
+        return FakeGatewaySocket(self, shard_id)
+
+
+class FakeGatewaySocket(object):
+    """
+    Fake websocket of a shard, connected to a fake gateway.
+    """
+
+    latency = 0.0
+
+    def __init__(self, gateway, shard_id):
+        self.gateway = gateway
+        self.shard_id = shard_id
+        self.__closed = Event()
+
+    async def poll_event(self):
+        if self.gateway.handled[self.shard_id] >= self.gateway.events:
+            await self.__closed.wait()
+            return
+        end = thread_time() + self.gateway.cpu
+        while thread_time() < end:
+            pass
+        self.gateway.handled[self.shard_id] += 1
+        # Other shards read their events in between, like with real sockets
+        await asyncio_sleep(0)
+
+    async def close(self, code=1000):
+        self.gateway.closed.add(self.shard_id)
+        self.__closed.set()
+
+
+class LagMonitor(object):
+    """
+    Event loop lag monitor, sleeping for a fixed interval and recording how late it wakes up.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+        # Stopping before the monitor got to run stops it as well
+        self.__running = True
+
+    async def run(self):
+        while self.__running:
+            start = perf_counter()
+            await asyncio_sleep(self.interval)
+            self.lags.append(perf_counter() - start - self.interval)
+
+    def stop(self):
+        self.__running = False
+
+    def quantile(self, q):
+        lags = sorted(self.lags)
+        return lags[min(len(lags) - 1, math_ceil(q * len(lags)) - 1)] if lags else 0.0
+
+
+class FakeCursor(object):
+    """
+    Fake of a pymongo cursor, running its query once iterated, with the sort, skip and limit given until then.
+    """
+
+    def __init__(self, query):
+        self.__query = query
+        self.__sort = []
+        self.__skip = 0
+        self.__limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        self.__sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, skip):
+        self.__skip = skip
+        return self
+
+    def limit(self, limit):
+        self.__limit = limit
+        return self
+
+    def __iter__(self):
+        return iter(self.__query(self.__sort, self.__skip, self.__limit))
+
+
+class FakeCollection(object):
+    """
+    In-process fake of a pymongo collection, with a fixed latency for each round trip and a switch to take it down.
+    """
+
+    def __init__(self, documents=(), latency=0.0):
+        self.documents: dict = {}
+        self.latency = latency
+        self.down = False
+        self.round_trips = 0
+        # Documents walked by queries, to compare how much work they make mongo do
+        self.examined = 0
+        self.__ids = count(1)
+        self.__sorted_ids = []
+        self.__text_field = None
+        # Values of every unique field, covering only the documents having it like partial indexes do
+        self.__unique: dict[str, dict] = {}
+        for document in documents:
+            self.__insert(dict(document))
+
+    def __round_trip(self):
+        # Blocking like a socket, so that it releases the interpreter lock as well
+        self.round_trips += 1
+        if self.down:
+            raise AutoReconnect("Fake mongo is down")
+        if self.latency:
+            time_sleep(self.latency)
+
+    def __insert(self, document):
+        document.setdefault('_id', next(self.__ids))
+        if document['_id'] in self.documents:
+            raise DuplicateKeyError(f"Duplicate _id {document['_id']}")
+        self.__check_unique(document)
+        self.documents[document['_id']] = document
+        self.__index(document)
+        return document['_id']
+
+    def __check_unique(self, document):
+        for field, values in self.__unique.items():
+            if field in document and values.get(document[field], document['_id']) != document['_id']:
+                raise DuplicateKeyError(f"Duplicate {field} {document[field]}", 11000)
+
+    def __index(self, document):
+        for field, values in self.__unique.items():
+            if field in document:
+                values[document[field]] = document['_id']
+
+    def __remove(self, document_id):
+        document = self.documents.pop(document_id, None)
+        for field, values in self.__unique.items():
+            if document is not None and field in document:
+                del values[document[field]]
+        return document
+
+    @staticmethod
+    def __project(document, projection):
+        if not projection:
+            return dict(document)
+        fields = {field for field, included in projection.items() if included}
+        if projection.get('_id', True):
+            fields.add('_id')
+        return {field: value for field, value in document.items() if field in fields}
+
+    def __matches(self, document, filter):
+        # Equality, existence and lower bounds of fields, or text search
+        for field, value in (filter or {}).items():
+            if field == '$text':
+                matched = self.__text_score(document, value['$search']) > 0
+            elif isinstance(value, dict) and '$exists' in value:
+                matched = (field in document) == value['$exists']
+            elif isinstance(value, dict) and '$gt' in value:
+                matched = field in document and document[field] > value['$gt']
+            else:
+                matched = document.get(field) == value
+            if not matched:
+                return False
+        return True
+
+    def __text_score(self, document, search):
+        # Keywords found in the text indexed field, without the stemming and stop words of mongo
+        if self.__text_field is None:
+            raise OperationFailure("text index required for $text query", 27)
+        return len(set(_TEXT_WORDS.findall(search.lower())) &
+                   set(_TEXT_WORDS.findall(document.get(self.__text_field, '').lower())))
+
+    def __ordered_ids(self):
+        # Sorted ids stand in for the _id index, rebuilt only when documents were added or removed
+        if len(self.__sorted_ids) != len(self.documents):
+            self.__sorted_ids = sorted(self.documents)
+        return self.__sorted_ids
+
+    def __query(self, filter, projection, sort, skip, limit):
+        end = skip + limit if limit else None
+        if sort == [('_id', 1)] and set(filter) <= {'_id'}:
+            # Walk the index from the start of the range, through skipped documents as well like mongo does
+            ids = self.__ordered_ids()
+            start = bisect_right(ids, filter['_id']['$gt']) if filter else 0
+            selected = [self.documents[ids[i]] for i in islice(range(start, len(ids)), skip, end)]
+            self.examined += skip + len(selected)
+        else:
+            self.examined += len(self.documents)
+            selected = [document for document in self.documents.values() if self.__matches(document, filter)]
+            for field, direction in reversed(sort):
+                if isinstance(direction, dict):
+                    selected.sort(key=lambda document: self.__text_score(document, filter['$text']['$search']),
+                                  reverse=True)
+                else:
+                    selected.sort(key=lambda document: document[field], reverse=direction == -1)
+            selected = selected[skip:end]
+        scored = [field for field, value in (projection or {}).items() if isinstance(value, dict)]
+        return [{**self.__project(document, projection),
+                 **{field: self.__text_score(document, filter['$text']['$search']) for field in scored}}
+                for document in selected]
+
+    def find(self, filter=None, projection=None, **kwargs):
+        self.__round_trip()
+        return FakeCursor(functools_partial(self.__query, filter or {}, projection))
+
+    def count_documents(self, filter):
+        self.__round_trip()
+        return sum(self.__matches(document, filter) for document in self.documents.values())
+
+    def estimated_document_count(self):
+        self.__round_trip()
+        return len(self.documents)
+
+    def aggregate(self, pipeline):
+        # Only random sampling
+        self.__round_trip()
+        return iter([dict(document) for document in
+                     random_sample(list(self.documents.values()),
+                                   min(pipeline[0]['$sample']['size'], len(self.documents)))])
+
+    def insert_one(self, document):
+        self.__round_trip()
+        return SimpleNamespace(inserted_id=self.__insert(document))
+
+    def insert_many(self, documents, ordered=True):
+        # A single round trip, reporting duplicates like mongo does once every document was tried
+        self.__round_trip()
+        inserted_ids = []
+        errors = []
+        for i, document in enumerate(documents):
+            try:
+                inserted_ids.append(self.__insert(document))
+            except DuplicateKeyError as e:
+                errors.append({'index': i, 'code': 11000, 'errmsg': str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(inserted_ids)})
+        return SimpleNamespace(inserted_ids=inserted_ids)
+
+    def update_one(self, filter, update):
+        self.__round_trip()
+        document = next((document for document in self.documents.values() if self.__matches(document, filter)), None)
+        if document is not None:
+            updated = {**document, **update['$set']}
+            self.__check_unique(updated)
+            self.__remove(document['_id'])
+            self.documents[updated['_id']] = updated
+            self.__index(updated)
+        return SimpleNamespace(matched_count=int(document is not None))
+
+    def delete_one(self, filter):
+        self.__round_trip()
+        document = next((document for document in self.documents.values() if self.__matches(document, filter)), None)
+        return SimpleNamespace(deleted_count=int(document is not None and self.__remove(document['_id']) is not None))
+
+    def bulk_write(self, operations, ordered=True):
+        self.__round_trip()
+        upserted = deleted = 0
+        for operation in operations:
+            if isinstance(operation, ReplaceOne):
+                if self.__remove(operation._filter['_id']) is None:
+                    upserted += 1
+                self.documents[operation._filter['_id']] = {**operation._doc, '_id': operation._filter['_id']}
+                self.__index(self.documents[operation._filter['_id']])
+            elif isinstance(operation, DeleteOne):
+                deleted += int(self.__remove(operation._filter['_id']) is not None)
+        return SimpleNamespace(upserted_count=upserted, deleted_count=deleted)
+
+    def create_index(self, keys, unique=False, **kwargs):
+        self.__round_trip()
+        if not isinstance(keys, str):
+            self.__text_field = next((key for key, kind in keys if kind == 'text'), self.__text_field)
+        if unique and keys not in self.__unique:
+            self.__unique[keys] = {document[keys]: document['_id'] for document in self.documents.values()
+                                   if keys in document}
+        return keys if isinstance(keys, str) else '_'.join(f"{key}_{kind}" for key, kind in keys)
+
+
+class FakeDatabase(dict):
+    """
+    In-process fake of a pymongo database, creating collections when first used.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+
+    def __missing__(self, name):
+        self[name] = FakeCollection(latency=self.latency)
+        return self[name]
+
+    def list_collection_names(self):
+        return list(self)
+
+
+class FakeMongoServer(object):
+    """
+    Stand-in mongo server speaking enough of the wire protocol for a real client, which can be paused like a stuck
+    mongod: connections are still accepted but nothing is answered until it is resumed.
+    """
+
+    def __init__(self):
+        self.__resumed = ThreadingEvent()
+        self.__resumed.set()
+        self.__connections = count(1)
+        self.commands = []
+        self.__server = ThreadingTCPServer(('127.0.0.1', 0), self.__handler(), bind_and_activate=True)
+        self.__server.daemon_threads = True
+        self.port = self.__server.server_address[1]
+        self.uri = f"mongodb://127.0.0.1:{self.port}/?directConnection=true"
+        self.__thread = Thread(target=self.__server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.__thread.start()
+
+    def pause(self):
+        self.__resumed.clear()
+
+    def resume(self):
+        self.__resumed.set()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        # Handlers waiting for the server to resume just find their connection closed
+        self.__resumed.set()
+
+    def __reply(self, command):
+        name = next(iter(command), '')
+        self.commands.append(name)
+        if name.lower() in ('hello', 'ismaster'):
+            return {'helloOk': True, 'isWritablePrimary': True, 'ismaster': True, 'maxBsonObjectSize': 16777216,
+                    'maxMessageSizeBytes': 48000000, 'maxWriteBatchSize': 100000, 'localTime': datetime.now(),
+                    'logicalSessionTimeoutMinutes': 30, 'connectionId': next(self.__connections),
+                    'minWireVersion': 0, 'maxWireVersion': 17, 'readOnly': False, 'ok': 1.0}
+        if name in ('ping', 'endSessions'):
+            return {'ok': 1.0}
+        return {'ok': 0.0, 'errmsg': f"no such command: '{name}'", 'code': 59, 'codeName': 'CommandNotFound'}
+
+    def __handler(self):
+        # Private names would be mangled for the handler class, so they are bound here
+        resumed = self.__resumed
+        answer = self.__reply
+
+        class Handler(BaseRequestHandler):
+
+            def handle(self):
+                try:
+                    while True:
+                        header = self.__read(16)
+                        length, request_id, _, op_code = unpack('<iiii', header)
+                        body = self.__read(length - 16)
+                        resumed.wait()
+                        self.request.sendall(self.__respond(request_id, op_code, body))
+                except (ConnectionError, OSError):
+                    return
+
+            def __read(self, size):
+                data = b''
+                while len(data) < size:
+                    chunk = self.request.recv(size - len(data))
+                    if not chunk:
+                        raise ConnectionError("Connection closed by the client")
+                    data += chunk
+                return data
+
+            @staticmethod
+            def __respond(request_id, op_code, body):
+                if op_code == 2004:
+                    # Legacy OP_QUERY, still used by clients for the first handshake
+                    name_end = body.index(b'\x00', 4)
+                    document = bson_encode(answer(bson_decode(body[name_end + 9:])))
+                    payload = pack('<iqii', 0, 0, 0, 1) + document
+                    return pack('<iiii', 16 + len(payload), 0, request_id, 1) + payload
+                # OP_MSG, whose command is the body section right after the flags
+                document = bson_encode(answer(bson_decode(body[5:5 + unpack('<i', body[5:9])[0]])))
+                payload = pack('<IB', 0, 0) + document
+                return pack('<iiii', 16 + len(payload), 0, request_id, 2013) + payload
+
+        return Handler
@@ -0,0 +1,123 @@
+from asyncio import run as asyncio_run, sleep as asyncio_sleep
+from time import perf_counter
+
+import pytest
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+from fakes import FakeMongoServer, until
+from src.utils.metrics import Metrics
+from src.utils.mongo import MongoUnavailableError, MongoUtil
+
+# Operations must outlast the half second the client waits between checks of a server it lost, or probes never get one
+_OPTIONS = {'operation_timeout': 1, 'breaker_failures': 3, 'breaker_probe_interval': 0.1,
+            'server_selection_timeout_ms': 300, 'connect_timeout_ms': 300}
+
+
+@pytest.fixture
+def server():
+    server = FakeMongoServer()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mongo_util(monkeypatch, server):
+    # Brand new singleton talking to the stand-in server, the one shared by the other tests is put back afterwards
+    for name in ('instance', 'pid', 'mongo_uri', 'options', 'mongo_client', 'executor', 'db'):
+        monkeypatch.setattr(MongoUtil, f"_MongoUtil__{name}", getattr(MongoUtil, f"_MongoUtil__{name}"))
+    monkeypatch.setattr(MongoUtil, '_MongoUtil__instance', None)
+    monkeypatch.setattr(Metrics, '_Metrics__instance', None)
+    mongo_util = MongoUtil(server.uri, 4, _OPTIONS)
+    yield mongo_util
+    MongoUtil._MongoUtil__mongo_client.close()
+    MongoUtil._MongoUtil__executor.shutdown()
+
+
+async def _ping(mongo_util):
+    return await mongo_util.run(mongo_util.db().command, 'ping')
+
+
+async def _fail(mongo_util, times):
+    for _ in range(times):
+        with pytest.raises(ConnectionFailure):
+            await _ping(mongo_util)
+
+
+def test_operations_reach_a_healthy_server(mongo_util, server):
+    assert asyncio_run(_ping(mongo_util)) == {'ok': 1.0}
+    assert 'ping' in server.commands
+    assert not mongo_util.is_open
+
+
+def test_breaker_opens_after_consecutive_failures_and_rejects_fast(mongo_util, server):
+    server.pause()
+
+    async def scenario():
+        await _fail(mongo_util, 2)
+        assert not mongo_util.is_open
+        await _fail(mongo_util, 1)
+        # Rejected without reaching the client at all
+        start = perf_counter()
+        with pytest.raises(MongoUnavailableError):
+            await _ping(mongo_util)
+        return perf_counter() - start
+
+    rejected = asyncio_run(scenario())
+    assert mongo_util.is_open
+    assert rejected < 0.01
+    lines = Metrics().render().splitlines()
+    assert 'mongo_breaker_trips_total 1' in lines
+    assert 'mongo_rejected_total 1' in lines
+    assert 'mongo_breaker_open 1' in lines
+
+
+def test_failures_are_bounded_by_the_operation_timeout(mongo_util, server):
+    server.pause()
+
+    async def scenario():
+        start = perf_counter()
+        await _fail(mongo_util, 1)
+        return perf_counter() - start
+
+    assert asyncio_run(scenario()) < _OPTIONS['operation_timeout'] + 0.2
+
+
+def test_probe_closes_the_breaker_once_the_server_resumes(mongo_util, server):
+    server.pause()
+
+    async def scenario():
+        await _fail(mongo_util, 3)
+        # Probes keep failing while the server is still stuck
+        await asyncio_sleep(_OPTIONS['breaker_probe_interval'] * 5)
+        assert mongo_util.is_open
+        server.resume()
+        await until(lambda: not mongo_util.is_open)
+        return await _ping(mongo_util)
+
+    assert asyncio_run(scenario()) == {'ok': 1.0}
+    assert mongo_util.failures == 0
+    assert 'mongo_breaker_open 0' in Metrics().render().splitlines()
+
+
+def test_successes_reset_the_failure_count(mongo_util, server):
+    async def scenario():
+        server.pause()
+        await _fail(mongo_util, 2)
+        server.resume()
+        await _ping(mongo_util)
+        assert mongo_util.failures == 0
+        server.pause()
+        await _fail(mongo_util, 2)
+
+    asyncio_run(scenario())
+    assert not mongo_util.is_open
+
+
+def test_command_errors_do_not_count_as_failures(mongo_util, server):
+    async def scenario():
+        for _ in range(5):
+            with pytest.raises(OperationFailure):
+                await mongo_util.run(mongo_util.db().command, 'unknown')
+
+    asyncio_run(scenario())
+    assert (mongo_util.failures, mongo_util.is_open) == (0, False)
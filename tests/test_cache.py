@@ -0,0 +1,148 @@
+from asyncio import run as asyncio_run
+
+import pytest
+import yt_dlp
+
+from src.extensions import music
+from src.utils import cache as cache_module
+from src.utils.cache import LRUCache
+from src.utils.extraction import ExtractionPool
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(1000.0)
+    monkeypatch.setattr(cache_module, 'time', clock)
+    monkeypatch.setattr(music, 'time', clock)
+    return clock
+
+
+def test_lru_eviction_and_recency(clock):
+    cache = LRUCache(2)
+
+    async def scenario():
+        await cache.set('a', 1, 2000)
+        await cache.set('b', 2, 2000)
+        # Reading a makes b the least recently used one
+        assert await cache.get('a') == 1
+        await cache.set('c', 3, 2000)
+        return [await cache.get(key) for key in ('a', 'b', 'c')]
+
+    assert asyncio_run(scenario()) == [1, None, 3]
+    assert len(cache) == 2
+
+
+def test_entries_expire(clock):
+    cache = LRUCache(8)
+
+    async def scenario():
+        await cache.set('a', 1, 1500)
+        first = await cache.get('a')
+        clock.now = 1500
+        return first, await cache.get('a')
+
+    assert asyncio_run(scenario()) == (1, None)
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses, cache.hit_ratio) == (1, 1, 0.5)
+
+
+class StubYoutubeDL(object):
+    """
+    Stub of YoutubeDL, where searches point to a video named after their last word.
+    """
+
+    calls = []
+    expire = 10000
+
+    def __init__(self, options):
+        self.options = options
+
+    def extract_info(self, url, download=False, process=True):
+        self.calls.append((url, process))
+        webpage_url = url if url.startswith('https://') else f"https://video.test/{url.split()[-1].lower()}"
+        if not process:
+            return {'webpage_url': webpage_url}
+        return {'title': webpage_url.rsplit('/', 1)[-1], 'uploader': 'someone', 'duration': 180,
+                'upload_date': '20200101', 'webpage_url': webpage_url, 'formats': [],
+                'url': f"https://stream.test/{webpage_url.rsplit('/', 1)[-1]}?expire={self.expire}&sig=x"}
+
+
+@pytest.fixture
+def ytdl(monkeypatch, clock):
+    StubYoutubeDL.calls = []
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', StubYoutubeDL)
+    pool = ExtractionPool({}, workers=1, processes=False, max_pending=4, timeout=5)
+    monkeypatch.setattr(music.YTDLSource, 'extraction_pool', pool)
+    monkeypatch.setattr(music.YTDLSource, 'info_cache', LRUCache(16))
+    yield StubYoutubeDL
+    pool.shutdown()
+
+
+def _extract(*searches, cache=True):
+    async def scenario():
+        return [await music.YTDLSource.extract_info(search, cache=cache) for search in searches]
+
+    return asyncio_run(scenario())
+
+
+def test_repeated_queries_are_extracted_once(ytdl):
+    first, second, third = _extract('never gonna Rick', '  Never GONNA   rick ', 'never gonna rick')
+    assert first == second == third
+    assert first['webpage_url'] == 'https://video.test/rick'
+    assert ytdl.calls == [('never gonna Rick', False), ('https://video.test/rick', True)]
+    # Only the fields needed for playing are kept
+    assert 'formats' not in first
+
+
+def test_queries_for_the_same_url_share_the_full_extraction(ytdl):
+    _extract('never gonna rick', 'astley rick')
+    assert ytdl.calls == [('never gonna rick', False), ('https://video.test/rick', True), ('astley rick', False)]
+
+
+def test_urls_are_cached_as_well(ytdl):
+    _extract('https://video.test/rick', 'https://video.test/rick')
+    assert ytdl.calls == [('https://video.test/rick', False), ('https://video.test/rick', True)]
+
+
+def test_entries_expire_with_the_signed_stream_url(ytdl, clock):
+    _extract('never gonna rick')
+    # Stream urls are refreshed a bit before discord would fail to play them
+    clock.now = ytdl.expire - music._config['info_cache_expiry_margin'] - 1
+    _extract('never gonna rick')
+    assert len(ytdl.calls) == 2
+    clock.now = ytdl.expire - music._config['info_cache_expiry_margin']
+    _extract('never gonna rick')
+    assert len(ytdl.calls) == 4
+
+
+def test_fresh_extractions_skip_the_cache(ytdl):
+    _extract('never gonna rick')
+    _extract('never gonna rick', cache=False)
+    assert len(ytdl.calls) == 4
+
+
+def test_urls_differing_in_case_are_different_videos(ytdl):
+    lower, upper, host = _extract('https://video.test/abcdef', 'https://video.test/AbCdEf', 'HTTPS://Video.Test/AbCdEf')
+    assert lower['webpage_url'] == 'https://video.test/abcdef'
+    assert upper['webpage_url'] == host['webpage_url'] == 'https://video.test/AbCdEf'
+    # Only scheme and host are normalized
+    assert ytdl.calls == [('https://video.test/abcdef', False), ('https://video.test/abcdef', True),
+                          ('https://video.test/AbCdEf', False), ('https://video.test/AbCdEf', True)]
+
+
+@pytest.mark.parametrize('search, normalized', [
+    ('  Never GONNA   rick ', 'never gonna rick'),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'),
+    (' HTTPS://WWW.YouTube.com/watch?v=dQw4w9WgXcQ ', 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'),
+    ('https://youtu.be/DQW4W9WGXCQ', 'https://youtu.be/DQW4W9WGXCQ'),
+])
+def test_search_normalization(search, normalized):
+    assert music.YTDLSource.normalize_search(search) == normalized
@@ -0,0 +1,104 @@
+from asyncio import gather as asyncio_gather, run as asyncio_run
+from os import kill
+from os.path import join as path_join
+from signal import SIGKILL
+from time import perf_counter
+
+import pytest
+
+from src.utils.dice import DiceError, DicePool, DiceTimeoutError
+
+_LIMITS = {'max_length': 200, 'max_depth': 10, 'max_digits': 9, 'max_sides': 1000000, 'max_dice': 500}
+
+
+@pytest.fixture
+def dice_pool(monkeypatch):
+    # Workers are started from the test process, so they import the fake roller found first on its path
+    monkeypatch.syspath_prepend(path_join('tests', 'fake_dice'))
+    pools = []
+
+    def create(**options):
+        pools.append(DicePool(**{'workers': 1, 'max_pending': 4, 'cpu_timeout': 0.5, 'limits': _LIMITS,
+                                 'rejections_size': 16, 'rejections_ttl': 3600, **options}))
+        return pools[-1]
+
+    yield create
+    for pool in pools:
+        pool.shutdown()
+
+
+@pytest.mark.parametrize('expression, error', [
+    ('1+' * 101, 'longer than 200 characters'),
+    ('(' * 11 + '1' + ')' * 11, 'nested more than 10 times'),
+    ('1d6+1234567890', 'longer than 9 digits'),
+    ('1000d1000001', 'more than 1000000 sides'),
+    ('501d6', 'more than 500 dice'),
+    ('10x(10x(6d6))', 'more than 500 dice'),
+])
+def test_expensive_expressions_are_refused_before_rolling(dice_pool, expression, error):
+    with pytest.raises(DiceError, match=error):
+        asyncio_run(dice_pool().roll(expression))
+
+
+def test_checks_are_cached(dice_pool):
+    pool = dice_pool()
+    for _ in range(3):
+        assert pool.check('2d6+3') is None
+    assert (pool.check.cache_info().misses, pool.check.cache_info().hits) == (1, 2)
+
+
+def test_rolls_run_in_worker_processes(dice_pool):
+    roll = asyncio_run(dice_pool().roll('3x(1d20)+2d6+3', 'attack'))
+    assert roll['label'] == 'attack'
+    assert roll['expression'] == '3x(1d20)+2d6+3'
+    assert [expression for expression, _, _ in roll['rolls']] == ['1d20', '1d20', '1d20', '2d6']
+    assert 8 <= int(roll['final_result']) <= 75
+
+
+def test_roller_errors_become_dice_errors(dice_pool):
+    with pytest.raises(DiceError, match='Invalid expression'):
+        asyncio_run(dice_pool().roll('1d6+'))
+
+
+def test_rolls_over_the_cpu_limit_are_stopped_and_refused(dice_pool):
+    pool = dice_pool()
+
+    async def scenario():
+        with pytest.raises(DiceTimeoutError):
+            await pool.roll('2^999999999')
+        # Refused right away from then on, while other rolls still get a worker
+        start = perf_counter()
+        with pytest.raises(DiceError, match='cpu time'):
+            await pool.roll('2^999999999')
+        refused = perf_counter() - start
+        return refused, await pool.roll('1d6')
+
+    refused, roll = asyncio_run(scenario())
+    assert refused < 0.1
+    assert 1 <= int(roll['final_result']) <= 6
+
+
+def test_pending_rolls_are_bounded(dice_pool):
+    pool = dice_pool(max_pending=1)
+
+    async def scenario():
+        return await asyncio_gather(pool.roll('2^99999999'), pool.roll('1d6'), return_exceptions=True)
+
+    _, second = asyncio_run(scenario())
+    assert isinstance(second, DiceError)
+    assert 'Too many rolls' in str(second)
+
+
+def test_broken_pools_are_replaced(dice_pool):
+    pool = dice_pool()
+
+    async def scenario():
+        await pool.warm()
+        # Like the kernel does to workers stuck in C code past their cpu limit
+        for pid in list(pool._DicePool__executor._processes):
+            kill(pid, SIGKILL)
+        with pytest.raises(DiceError, match='try again later'):
+            await pool.roll('1d6')
+        return await pool.roll('1d6')
+
+    assert 1 <= int(asyncio_run(scenario())['final_result']) <= 6
@@ -0,0 +1,34 @@
+from time import sleep
+
+from src.extensions.music import FFmpegMonitor, PlaybackHealth
+
+
+def _read(lines, caplog):
+    # Write like ffmpeg does, then exit, closing the pipe
+    health = PlaybackHealth()
+    monitor = FFmpegMonitor(health)
+    monitor.stderr.write(b''.join(lines))
+    monitor.stderr.close()
+    # Empty lines are not logged
+    expected = len([line for line in lines if line.strip()])
+    for _ in range(200):
+        if len([record for record in caplog.records if record.name == 'extensions.music']) >= expected:
+            break
+        sleep(0.01)
+    return health, [record.getMessage() for record in caplog.records if record.name == 'extensions.music']
+
+
+def test_reconnects_are_counted(caplog):
+    health, messages = _read([b'[https @ 0x1] Will reconnect at 1048576 in 0 second(s), error=End of file.\n'],
+                             caplog)
+    assert health.reconnects == 1
+    assert messages == ["Ffmpeg reconnecting: [https @ 0x1] Will reconnect at 1048576 in 0 second(s), "
+                        "error=End of file."]
+
+
+def test_other_ffmpeg_output_is_logged(caplog):
+    health, messages = _read([b'[https @ 0x1] HTTP error 403 Forbidden\n', b'\n',
+                              b'https://video.test/1: Server returned 403 Forbidden (access denied)\n'], caplog)
+    assert health.reconnects == 0
+    assert messages == ["Ffmpeg: [https @ 0x1] HTTP error 403 Forbidden",
+                        "Ffmpeg: https://video.test/1: Server returned 403 Forbidden (access denied)"]
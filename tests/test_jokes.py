@@ -0,0 +1,172 @@
+from asyncio import run as asyncio_run
+from json import dumps as json_dumps, loads as json_loads
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from fakes import FakeAttachment, FakeBot, FakeChannel, FakeContext, FakeGuild
+from src.extensions import mortadella
+from src.extensions.mortadella import JokesPages, Mortadella
+from src.utils.metrics import Metrics
+from src.utils.mongo import MongoUtil
+
+_COLLECTION = 'mortadella.jokes'
+
+
+def _jokes(mongo_db, *jokes):
+    for joke in jokes:
+        mongo_db[_COLLECTION].insert_one({'joke': joke})
+
+
+def test_jokes_are_sampled_from_memory(mongo_db):
+    _jokes(mongo_db, 'first joke', 'second joke')
+    cog = Mortadella(FakeBot())
+    round_trips = mongo_db[_COLLECTION].round_trips
+
+    async def scenario():
+        return [await cog.jokes_cache.random() for _ in range(20)]
+
+    jokes = asyncio_run(scenario())
+    assert set(jokes) <= {'first joke', 'second joke'}
+    # A single load, every other joke is a hit
+    assert mongo_db[_COLLECTION].round_trips == round_trips + 1
+    assert (cog.jokes_cache.hits, cog.jokes_cache.misses) == (19, 1)
+
+
+def test_added_jokes_are_cached_right_away_and_resets_reload(mongo_db):
+    _jokes(mongo_db, 'first joke')
+    cog = Mortadella(FakeBot())
+
+    async def scenario():
+        await cog.jokes_cache.random()
+        cog.jokes_cache.add('brand new joke')
+        found = await cog.jokes_cache.search('brand', 5)
+        _jokes(mongo_db, 'joke from init data')
+        await cog.on_database_reset()
+        await cog.jokes_cache.random()
+        return found
+
+    assert asyncio_run(scenario()) == ['brand new joke']
+    assert len(cog.jokes_cache) == 2
+    assert cog.jokes_cache.misses == 2
+
+
+def test_cache_counters_show_up_in_metrics(mongo_db):
+    _jokes(mongo_db, 'first joke')
+    cog = Mortadella(FakeBot())
+
+    async def scenario():
+        await cog.cog_load()
+        for _ in range(3):
+            await cog.jokes_cache.random()
+        rendered = Metrics().render()
+        await cog.cog_unload()
+        return rendered
+
+    rendered = asyncio_run(scenario())
+    assert 'jokes_cache_hits 2\n' in rendered
+    assert 'jokes_cache_misses 1\n' in rendered
+    assert 'jokes_cache_size 1\n' in rendered
+    assert 'jokes_cache_hits' not in Metrics().render()
+
+
+def _context(*attachments):
+    channel = FakeChannel(1)
+    return FakeContext(FakeGuild(1, [channel]), channel, attachments=attachments)
+
+
+def test_imports_skip_jokes_known_or_repeated(mongo_db):
+    _jokes(mongo_db, 'Old  JOKE')
+    cog = Mortadella(FakeBot())
+    jokes = ['old joke', 'new joke', 'NEW   joke', {'joke': 'object joke'}, '  ', 42]
+    ctx = _context(FakeAttachment('jokes.json', json_dumps(jokes).encode()))
+    asyncio_run(cog.import_jokes.callback(cog, ctx))
+    stored = sorted(document['joke'] for document in mongo_db[_COLLECTION].documents.values())
+    assert stored == ['Old  JOKE', 'new joke', 'object joke']
+    assert ctx.sent[-1].description == 'Imported **2** jokes, skipped **4** duplicates or empty ones'
+
+
+def test_text_imports_have_one_joke_per_line(mongo_db):
+    cog = Mortadella(FakeBot())
+    ctx = _context(FakeAttachment('jokes.txt', b'first joke\nsecond joke\n\nFirst joke\n'))
+    asyncio_run(cog.import_jokes.callback(cog, ctx))
+    assert sorted(document['normalized'] for document in mongo_db[_COLLECTION].documents.values()) == \
+        ['first joke', 'second joke']
+
+
+def test_exports_can_be_imported_back(mongo_db):
+    _jokes(mongo_db, 'first joke', 'seconda battuta è "questa"')
+    cog = Mortadella(FakeBot())
+    ctx = _context()
+    asyncio_run(cog.export_jokes.callback(cog, ctx))
+    exported = ctx.sent[-1]
+    assert json_loads(exported) == [{'joke': 'first joke'}, {'joke': 'seconda battuta è "questa"'}]
+    mongo_db[_COLLECTION].documents.clear()
+    asyncio_run(cog.import_jokes.callback(cog, _context(FakeAttachment('jokes.json', exported))))
+    assert len(mongo_db[_COLLECTION].documents) == 2
+
+
+def test_small_collections_are_searched_in_memory(mongo_db):
+    _jokes(mongo_db, 'il gatto e la volpe', 'il gatto di nonna', 'un treno in ritardo')
+    cog = Mortadella(FakeBot())
+    found = asyncio_run(cog.search_jokes('gatto nonna'))
+    assert found == ['il gatto di nonna', 'il gatto e la volpe']
+    assert len(cog.jokes_cache) == 3
+    # Searched without a text index, which mongo would need
+    with pytest.raises(OperationFailure):
+        list(mongo_db[_COLLECTION].find({'$text': {'$search': 'gatto'}}))
+
+
+def test_big_collections_are_searched_by_mongo_without_loading_them(mongo_db, monkeypatch):
+    monkeypatch.setitem(mortadella._config, 'jokes_search_memory_max', 2)
+    _jokes(mongo_db, 'il gatto e la volpe', 'il gatto di nonna', 'un treno in ritardo')
+    deadlines = {}
+    run = MongoUtil.run
+
+    async def recording_run(self, func, *args, deadline=None, **kwargs):
+        deadlines[getattr(func, '__name__', 'other')] = deadline
+        return await run(self, func, *args, deadline=deadline, **kwargs)
+
+    monkeypatch.setattr(MongoUtil, 'run', recording_run)
+    cog = Mortadella(FakeBot())
+
+    async def scenario():
+        return [await cog.search_jokes('gatto nonna'), await cog.search_jokes('treno')]
+
+    assert asyncio_run(scenario()) == [['il gatto di nonna', 'il gatto e la volpe'], ['un treno in ritardo']]
+    assert len(cog.jokes_cache) == 0
+    # Building the text index gets as long as walking the whole collection, and happens once
+    assert deadlines['create_index'] == mortadella._config['jokes_collection_timeout']
+    # Only the two text searches went through jokes
+    assert mongo_db[_COLLECTION].examined == 6
+
+
+def test_pages_are_ranges_of_ids(mongo_db):
+    _jokes(mongo_db, *(f"joke {i}" for i in range(25)))
+    cog = Mortadella(FakeBot())
+    collection = mongo_db[_COLLECTION]
+
+    class Interaction(object):
+        def __init__(self):
+            self.response = self
+            self.edited = []
+
+        async def edit_message(self, embed=None, view=None):
+            self.edited.append(embed)
+
+    async def scenario():
+        view = JokesPages(lambda after: MongoUtil().run(cog._Mortadella__jokes_page, after), 0)
+        pages = [await view.page()]
+        interaction = Interaction()
+        for button in (view.next, view.next, view.previous):
+            examined = collection.examined
+            await button.callback(interaction)
+            # Never more than a page and the first joke of the next one, however deep
+            assert collection.examined - examined <= 11
+        return view, pages + interaction.edited
+
+    view, pages = asyncio_run(scenario())
+    assert [page.footer.text for page in pages] == ['Page 1', 'Page 2', 'Page 3', 'Page 2']
+    assert pages[2].description.splitlines() == [f"`{i + 1}.` joke {i}" for i in range(20, 25)]
+    assert pages[3].description == pages[1].description
+    assert (view.previous.disabled, view.next.disabled) == (False, False)
@@ -0,0 +1,13 @@
+from subprocess import run as subprocess_run
+from sys import executable as sys_executable
+
+
+def test_extensions_load_heavy_dependencies_lazily():
+    # Fresh interpreter, since other tests already imported everything
+    result = subprocess_run([sys_executable, '-c', 'import sys; sys.path.insert(0, "bot"); '
+                                                   'import src.extensions.games, src.extensions.music; '
+                                                   'print(" ".join(sorted(name for name in sys.modules '
+                                                   'if name.split(".")[0] in ("yt_dlp", "sympy", "mpmath", '
+                                                   '"arithmetic_dice_roller"))))'],
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.split() == []
@@ -0,0 +1,75 @@
+from asyncio import open_connection, run as asyncio_run, sleep as asyncio_sleep
+from socket import socket
+
+import pytest
+
+from src.utils.metrics import Histogram, Metrics
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    # Brand new registry, instead of the one shared by the whole test run
+    monkeypatch.setattr(Metrics, '_Metrics__instance', None)
+    return Metrics()
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram()
+    for value in [0.002] * 90 + [0.3] * 9 + [20]:
+        histogram.observe(value)
+    assert (histogram.count, round(histogram.sum, 3)) == (100, 22.88)
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.95) == 0.5
+    assert histogram.quantile(1) == float('inf')
+
+
+def test_prometheus_text(metrics):
+    metrics.observe('command_duration_seconds', 0.02, command='joke')
+    metrics.observe('command_duration_seconds', 3, command='joke')
+    metrics.increment('command_errors_total', command='say "hi"', error='CommandInvokeError')
+    metrics.increment('mongo_rejected_total')
+    metrics.set_gauge('mongo_pending', lambda: 2)
+    lines = metrics.render().splitlines()
+    assert lines[0] == '# TYPE command_duration_seconds histogram'
+    assert 'command_duration_seconds_bucket{command="joke",le="0.01"} 0' in lines
+    assert 'command_duration_seconds_bucket{command="joke",le="0.025"} 1' in lines
+    assert 'command_duration_seconds_bucket{command="joke",le="+Inf"} 2' in lines
+    assert 'command_duration_seconds_sum{command="joke"} 3.02' in lines
+    assert 'command_duration_seconds_count{command="joke"} 2' in lines
+    # Quotes would end label values early
+    assert 'command_errors_total{command="say \'hi\'",error="CommandInvokeError"} 1' in lines
+    assert 'mongo_rejected_total 1' in lines
+    assert lines[-2:] == ['# TYPE mongo_pending gauge', 'mongo_pending 2']
+
+
+def test_removed_gauges_are_not_rendered(metrics):
+    metrics.set_gauge('jokes_cache_size', lambda: 10)
+    metrics.remove_gauge('jokes_cache_size')
+    assert 'jokes_cache_size' not in metrics.render()
+
+
+def test_metrics_are_served_from_the_bot_loop(metrics):
+    with socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    async def get(path):
+        reader, writer = await open_connection('127.0.0.1', port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    async def scenario():
+        metrics.start(0.01, '127.0.0.1', port)
+        await asyncio_sleep(0.1)
+        return await get('/metrics'), await get('/other')
+
+    found, not_found = asyncio_run(scenario())
+    assert found.startswith('HTTP/1.1 200 OK\r\n')
+    # Loop lag was sampled in the meantime
+    assert 'event_loop_lag_seconds_count ' in found
+    headers, body = found.split('\r\n\r\n', 1)
+    assert f"Content-Length: {len(body.encode())}" in headers
+    assert not_found.startswith('HTTP/1.1 404 Not Found\r\n')
@@ -0,0 +1,50 @@
+from io import StringIO
+from json import dumps as json_dumps, JSONDecodeError, loads as json_loads
+
+import pytest
+
+from src.utils.mongo import iter_json_array
+
+_DOCUMENTS = [
+    '[]',
+    ' [ ] ',
+    '[1.5]',
+    '[1]',
+    '[-12, 3.25e-4, 1E+10, 0, -0.5]',
+    '[true, false, null]',
+    '["a, b]", "[\\"quoted\\"]", "\\u00e8"]',
+    '[{"joke": "x", "nested": [1, [2.75, {"a": -3e2}]]}, {"b": null}]',
+    '[\n  {"_id": 1},\n  {"_id": 2}\n]\n',
+    json_dumps([1.5] * 3000),
+    json_dumps([{'n': index * 1.25, 'text': f"joke {index}"} for index in range(500)]),
+]
+
+
+@pytest.mark.parametrize('document', _DOCUMENTS, ids=lambda document: document[:24])
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5, 7, 64, 65536])
+def test_matches_json_loads(document, chunk_size):
+    assert list(iter_json_array(StringIO(document), chunk_size)) == json_loads(document)
+
+
+def test_numbers_straddling_default_chunks():
+    document = json_dumps([1.5] * 30000)
+    assert list(iter_json_array(StringIO(document))) == json_loads(document)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 65536])
+def test_reads_items_lazily(chunk_size):
+    items = iter_json_array(StringIO('[{"a": 1}, {"b": 2}, oops]'), chunk_size)
+    assert next(items) == {'a': 1}
+    assert next(items) == {'b': 2}
+    with pytest.raises(JSONDecodeError):
+        next(items)
+
+
+@pytest.mark.parametrize('document', ['[1.5', '[1, 2', '[{"a": 1}'])
+def test_truncated_arrays(document):
+    # Truncated files either fail or stop early, they never make up items
+    try:
+        items = list(iter_json_array(StringIO(document), 2))
+    except JSONDecodeError:
+        return
+    assert items == json_loads(document + ']')[:len(items)]
@@ -0,0 +1,183 @@
+from asyncio import gather as asyncio_gather, run as asyncio_run, sleep as asyncio_sleep, wait_for as asyncio_wait_for
+from collections import defaultdict
+
+import pytest
+
+from src.extensions.music import MusicQueue, Track
+
+
+def _track(requester_id, duration=180, title=None):
+    return Track(title or f"{requester_id}", f"https://video.test/{requester_id}", duration, requester_id)
+
+
+def _drain(queue):
+    async def scenario():
+        return [await queue.get() for _ in range(len(queue))]
+
+    return asyncio_run(scenario())
+
+
+def _simulate(queue, arrivals, until):
+    # Play the queue against a fake clock, enqueueing arrivals on time, and sum up playing time of each requester
+    arrivals = sorted(arrivals, key=lambda arrival: arrival[0])
+    played = defaultdict(float)
+    starts = []
+
+    async def scenario():
+        clock = 0.0
+        index = 0
+        while clock < until:
+            while index < len(arrivals) and arrivals[index][0] <= clock:
+                _, track, weight = arrivals[index]
+                queue.put_nowait(track, weight)
+                index += 1
+            if not len(queue):
+                if index == len(arrivals):
+                    break
+                clock = arrivals[index][0]
+                continue
+            track = await queue.get()
+            starts.append((clock, track))
+            played[track.requester_id] += min(track.duration, until - clock)
+            clock += track.duration
+
+    asyncio_run(scenario())
+    return played, starts
+
+
+def test_fifo_keeps_arrival_order():
+    queue = MusicQueue('fifo')
+    for requester_id in (1, 1, 2, 1, 3):
+        queue.put_nowait(_track(requester_id))
+    assert [track.requester_id for track in _drain(queue)] == [1, 1, 2, 1, 3]
+
+
+def test_round_robin_takes_turns():
+    queue = MusicQueue('roundrobin')
+    for requester_id in (1, 1, 1, 1, 1, 2, 2, 3):
+        queue.put_nowait(_track(requester_id))
+    assert [track.requester_id for track in _drain(queue)] == [1, 2, 3, 1, 2, 1, 1, 1]
+
+
+def test_round_robin_ignores_weights():
+    queue = MusicQueue('roundrobin')
+    for requester_id, weight in ((1, 2.0), (1, 2.0), (1, 2.0), (1, 2.0), (2, 1.0), (2, 1.0)):
+        queue.put_nowait(_track(requester_id), weight)
+    # Administrators get bigger shares with fair scheduling only
+    assert [track.requester_id for track in _drain(queue)] == [1, 2, 1, 2, 1, 1]
+
+
+def test_queue_shows_what_plays_next():
+    queue = MusicQueue('roundrobin')
+    for requester_id in (1, 1, 2):
+        queue.put_nowait(_track(requester_id))
+    assert [track.requester_id for track in queue] == [1, 2, 1]
+    assert [track.requester_id for track in queue[1:]] == [2, 1]
+    assert [position for position, _ in queue.by_requester(1)] == [0, 2]
+
+
+def test_fair_shares_playing_time_whatever_the_track_lengths():
+    queue = MusicQueue('fair')
+    arrivals = [(0, _track(1, 600), 1.0) for _ in range(20)] + [(0, _track(2, 60), 1.0) for _ in range(200)]
+    played, _ = _simulate(queue, arrivals, 3600 * 2)
+    # Weighted fair queuing never lets a requester fall behind by more than the longest track
+    assert abs(played[1] - played[2]) <= 600
+    assert played[1] + played[2] == 3600 * 2
+
+
+def test_fair_shares_follow_weights():
+    queue = MusicQueue('fair')
+    arrivals = [(0, _track(1, 120), 2.0) for _ in range(100)] + [(0, _track(2, 120), 1.0) for _ in range(100)]
+    played, _ = _simulate(queue, arrivals, 3600)
+    assert abs(played[1] - 2 * played[2]) <= 2 * 120
+
+
+def test_late_requesters_are_not_starved_by_backlogs():
+    queue = MusicQueue('fair')
+    arrivals = [(0, _track(1, 180), 1.0) for _ in range(50)] + [(1800, _track(2, 180), 1.0) for _ in range(5)]
+    _, starts = _simulate(queue, arrivals, 3600 * 3)
+    first_start = next(start for start, track in starts if track.requester_id == 2)
+    # Played as soon as the track playing when it arrived is over
+    assert first_start - 1800 <= 180
+    # Idle time before arriving is not credited, so the backlog keeps its turns
+    late = [track.requester_id for start, track in starts if 1800 <= start < 1800 + 10 * 180]
+    assert late == [2, 1] * 5 or late == [1, 2] * 5
+
+
+@pytest.mark.parametrize('mode', ['fifo', 'roundrobin', 'fair'])
+def test_simulation_is_deterministic(mode):
+    def run():
+        queue = MusicQueue(mode)
+        arrivals = [(time, _track(time % 7, 60 + time % 240), 1.0 + time % 2) for time in range(0, 5000, 37)]
+        _, starts = _simulate(queue, arrivals, 3600 * 4)
+        return [(start, track.requester_id, track.duration) for start, track in starts]
+
+    assert run() == run()
+
+
+def test_changing_scheduler_keeps_each_requester_order():
+    queue = MusicQueue('fifo')
+    for index, requester_id in enumerate((1, 1, 1, 2, 2, 3)):
+        queue.put_nowait(_track(requester_id, title=f"{requester_id}-{index}"))
+    queue.set_scheduler('roundrobin')
+    assert [track.title for track in queue] == ['1-0', '2-3', '3-5', '1-1', '2-4', '1-2']
+    assert queue.scheduler.name == 'roundrobin'
+
+
+def test_weights_survive_records_and_scheduler_changes():
+    queue = MusicQueue('fifo')
+    for requester_id, weight in ((1, 2.0), (1, 2.0), (2, 1.0), (2, 1.0)):
+        queue.put_nowait(_track(requester_id, 120), weight)
+    # Tracks come back from their records with their weight, like restored queues do
+    restored = MusicQueue('fifo')
+    for track in queue:
+        track = Track.from_record(track.to_record())
+        restored.put_nowait(track, track.weight)
+    restored.set_scheduler('fair')
+    assert [track.requester_id for track in restored] == [1, 1, 2, 2]
+    assert [track.weight for track in restored] == [2.0, 2.0, 1.0, 1.0]
+
+
+def test_records_without_weights_are_still_restored():
+    track = Track.from_record(['title', 'https://video.test/1', 180, 1, None])
+    assert (track.title, track.requester_id, track.weight) == ('title', 1, 1.0)
+
+
+def test_moving_removing_and_shuffling():
+    queue = MusicQueue('fair')
+    for requester_id in (1, 2, 3, 1, 2, 3):
+        queue.put_nowait(_track(requester_id, title=f"{requester_id}"))
+    ids = [track.id for track in queue]
+    moved = queue.move(5, 0)
+    assert queue[0] is moved
+    assert queue.index(moved.id) == 0
+    removed = queue.remove(1)
+    assert removed.id == ids[0]
+    assert len(queue) == 5
+    queue.shuffle()
+    assert sorted(track.id for track in queue) == sorted(set(ids) - {removed.id})
+
+
+def test_moving_many_times_between_the_same_tracks():
+    # Orders run out of room after enough halvings, and get spread again
+    queue = MusicQueue('fifo')
+    for index in range(3):
+        queue.put_nowait(_track(1, title=f"{index}"))
+    for _ in range(200):
+        queue.move(2, 1)
+    assert len(queue) == 3
+    assert len({track.id for track in queue}) == 3
+
+
+def test_get_waits_for_tracks():
+    queue = MusicQueue('fifo')
+
+    async def scenario():
+        async def put_later():
+            await asyncio_sleep(0.01)
+            queue.put_nowait(_track(1))
+
+        track, _ = await asyncio_wait_for(asyncio_gather(queue.get(), put_later()), 1)
+        return track
+
+    assert asyncio_run(scenario()).requester_id == 1
@@ -0,0 +1,145 @@
+from asyncio import Lock, run as asyncio_run, sleep as asyncio_sleep, wait_for as asyncio_wait_for
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from discord import Forbidden, NotFound
+from discord.utils import utcnow
+
+from src.utils.purge import PurgeEngine
+
+
+def _response(status):
+    return SimpleNamespace(status=status, reason='')
+
+
+class FakeHTTP(object):
+    """
+    Fake HTTP layer, with one bucket for each route only serving a request at a time.
+    """
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.locks = {route: Lock() for route in delays}
+        self.requests = {route: [] for route in delays}
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+    async def request(self, route, payload):
+        async with self.locks[route]:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            await asyncio_sleep(self.delays[route])
+            self.concurrent -= 1
+            self.requests[route].append(payload)
+
+
+class FakeMessage(object):
+    def __init__(self, channel, message_id, age, author_id, content):
+        self.channel = channel
+        self.id = message_id
+        self.created_at = utcnow() - age
+        self.author = SimpleNamespace(id=author_id)
+        self.content = content
+
+    async def delete(self):
+        if self.id in self.channel.deleted:
+            raise NotFound(_response(404), 'Unknown Message')
+        self.channel.deleted.add(self.id)
+        await self.channel.http.request('single', self.id)
+
+
+class FakeChannel(object):
+    """
+    Fake text channel, newest messages first, one message every few hours going back in time.
+    """
+
+    def __init__(self, size, *, hours_apart=4, fail_bulk=False):
+        self.http = FakeHTTP({'history': 0.005, 'bulk': 0.02, 'single': 0.002})
+        self.deleted = set()
+        self.fail_bulk = fail_bulk
+        self.fetched = 0
+        self.messages = [FakeMessage(self, message_id, timedelta(hours=hours_apart * message_id), message_id % 3,
+                                     f"hello {message_id}" if message_id % 2 else "bye")
+                         for message_id in range(size)]
+
+    async def history(self, *, limit, before):
+        # Pages of 100 messages, like discord
+        for index, message in enumerate(self.messages[:limit]):
+            if index % 100 == 0:
+                await self.http.request('history', index)
+            self.fetched += 1
+            yield message
+
+    async def delete_messages(self, messages):
+        if self.fail_bulk:
+            raise Forbidden(_response(403), 'Missing Permissions')
+        assert 2 <= len(messages) <= 100
+        assert all(utcnow() - message.created_at < timedelta(days=14) for message in messages)
+        self.deleted.update(message.id for message in messages)
+        await self.http.request('bulk', [message.id for message in messages])
+
+    def __str__(self):
+        return 'fake'
+
+
+def _purge(engine):
+    # Hangs are failures too
+    return asyncio_run(asyncio_wait_for(engine.run(), 10))
+
+
+def test_partitions_bulk_and_single_deletes():
+    channel = FakeChannel(400)
+    engine = PurgeEngine(channel, limit=300)
+    assert _purge(engine) == 300
+    assert channel.deleted == set(range(300))
+    # Two weeks of messages four hours apart can go in bulk, the rest one by one
+    bulk = [message_id for batch in channel.http.requests['bulk'] for message_id in batch]
+    assert sorted(bulk) == list(range(84))
+    assert sorted(channel.http.requests['single']) == list(range(84, 300))
+
+
+def test_stops_fetching_history_at_limit_without_filters():
+    channel = FakeChannel(1000, hours_apart=0)
+    assert _purge(PurgeEngine(channel, limit=150, max_scan=10000)) == 150
+    assert channel.fetched == 150
+    assert all(len(batch) <= 100 for batch in channel.http.requests['bulk'])
+
+
+def test_deletes_while_fetching():
+    channel = FakeChannel(600)
+    _purge(PurgeEngine(channel, limit=600))
+    # Bulk, single and history routes were all busy at once at some point
+    assert channel.http.max_concurrent >= 2
+
+
+def test_author_and_content_filters():
+    channel = FakeChannel(400)
+    engine = PurgeEngine(channel, limit=50, max_scan=10000,
+                         check=lambda message: message.author.id == 1 and 'hello' in message.content)
+    assert _purge(engine) == 50
+    assert len(channel.deleted) == 50
+    assert all(message_id % 3 == 1 and message_id % 2 for message_id in channel.deleted)
+    assert engine.scanned > engine.matched == 50
+
+
+def test_filters_stop_at_max_scan():
+    channel = FakeChannel(400)
+    engine = PurgeEngine(channel, limit=50, max_scan=120, check=lambda message: message.author.id == 42)
+    assert _purge(engine) == 0
+    assert engine.scanned == 120
+
+
+def test_already_deleted_messages_are_skipped():
+    channel = FakeChannel(5, hours_apart=24 * 20)
+    channel.deleted.add(1)
+    assert _purge(PurgeEngine(channel, limit=5)) == 4
+
+
+def test_lane_failure_stops_the_purge():
+    channel = FakeChannel(1000, hours_apart=0, fail_bulk=True)
+    engine = PurgeEngine(channel, limit=1000, queue_size=50)
+    with pytest.raises(Forbidden):
+        _purge(engine)
+    assert not channel.deleted
+    assert engine.elapsed
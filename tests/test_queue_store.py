@@ -0,0 +1,155 @@
+from asyncio import run as asyncio_run
+
+import pytest
+
+from fakes import FakeBot, FakeChannel, FakeCollection, FakeContext, FakeGuild, until
+from src.extensions import music
+from src.extensions.music import Track
+from src.utils.mongo import MongoUtil
+
+_GUILD_ID = 1
+_VOICE_CHANNEL_ID = 10
+_TEXT_CHANNEL_ID = 11
+
+
+@pytest.fixture
+def collection(mongo_db, monkeypatch):
+    # Retries come quicker than the circuit breaker would allow, which has tests of its own
+    monkeypatch.setitem(MongoUtil._MongoUtil__options, 'breaker_failures', 1000)
+    monkeypatch.setitem(music._config, 'queue_store_delay', 0.01)
+    monkeypatch.setitem(music._config, 'queue_store_restore_attempts', 3)
+    monkeypatch.setitem(music._config, 'queue_store_restore_retry_delay', 0.1)
+    mongo_db[music._config['queue_store_collection']] = FakeCollection()
+    return mongo_db[music._config['queue_store_collection']]
+
+
+def _guild():
+    # Tracks play long enough to still be playing when the bot crashes
+    return FakeGuild(_GUILD_ID, [FakeChannel(_VOICE_CHANNEL_ID, play_time=3600), FakeChannel(_TEXT_CHANNEL_ID)])
+
+
+def _record(tracks=('a', 'b')):
+    return {'_id': _GUILD_ID, 'voice_channel_id': _VOICE_CHANNEL_ID, 'text_channel_id': _TEXT_CHANNEL_ID,
+            'tracks': [Track(title, f"https://video.test/{title}", 1, 1).to_record() for title in tracks],
+            'loop': False, 'volume': 0.5, 'queue_mode': 'fifo'}
+
+
+class SavedRecord(object):
+    """
+    Stand-in for a voice state, always saving the same record.
+    """
+
+    def __init__(self, record):
+        self.record = record
+
+    def to_record(self):
+        return self.record
+
+
+def test_players_survive_a_crash(player, collection):
+    async def before_crash():
+        cog = music.Music(FakeBot())
+        await cog.cog_load()
+        guild = _guild()
+        voice_state = cog.get_voice_state(FakeContext(guild, guild.get_channel(_TEXT_CHANNEL_ID)))
+        voice_state.voice = await guild.get_channel(_VOICE_CHANNEL_ID).connect()
+        voice_state.loop = True
+        voice_state.volume = 0.3
+        voice_state.music_queue.set_scheduler('fair')
+        for title, requester_id, weight in (('a', 1, 1.0), ('b', 2, 2.0), ('c', 1, 1.0), ('d', 2, 2.0)):
+            voice_state.music_queue.put_nowait(Track(title, f"https://video.test/{title}", 1, requester_id), weight)
+        await until(lambda: voice_state.voice.played)
+        voice_state.save()
+        await until(lambda: _GUILD_ID in collection.documents)
+        return voice_state.voice.played[0].track.title, [track.title for track in voice_state.music_queue]
+
+    async def after_crash():
+        cog = music.Music(FakeBot([_guild()]))
+        await cog.cog_load()
+        await until(lambda: _GUILD_ID in cog.voice_states)
+        voice_state = cog.voice_states[_GUILD_ID]
+        await until(lambda: voice_state.voice.played)
+        restored = voice_state.voice.played[0].track.title, [track.title for track in voice_state.music_queue], \
+            [track.weight for track in voice_state.music_queue], voice_state.loop, voice_state.volume, \
+            voice_state.music_queue.scheduler.name, voice_state.voice.channel.id, voice_state.text_channel.id
+        await cog.cog_unload()
+        return restored
+
+    # The bot dies without unloading, so only what was flushed before is left
+    playing, queued = asyncio_run(before_crash())
+    current, tracks, weights, loop, volume, queue_mode, voice_channel_id, text_channel_id = asyncio_run(after_crash())
+    assert current == playing
+    assert tracks == queued
+    assert weights == [2.0 if title in ('b', 'd') else 1.0 for title in tracks]
+    assert (loop, volume, queue_mode) == (True, 0.3, 'fair')
+    assert (voice_channel_id, text_channel_id) == (_VOICE_CHANNEL_ID, _TEXT_CHANNEL_ID)
+    # Unloading keeps the saved player for the next start
+    assert len(collection.documents[_GUILD_ID]['tracks']) == 4
+
+
+def test_failed_flushes_are_retried(collection):
+    async def scenario():
+        store = music.QueueStore(music._config['queue_store_collection'], 0.01)
+        collection.down = True
+        store.mark(_GUILD_ID, SavedRecord(_record()))
+        await until(lambda: collection.round_trips >= 2)
+        # Nothing is marked anymore, the failed write is tried again by itself
+        collection.down = False
+        await until(lambda: _GUILD_ID in collection.documents)
+        await store.close()
+
+    asyncio_run(scenario())
+    assert [track[0] for track in collection.documents[_GUILD_ID]['tracks']] == ['a', 'b']
+
+
+def test_newer_changes_win_over_failed_flushes(collection):
+    async def scenario():
+        store = music.QueueStore(music._config['queue_store_collection'], 0.01)
+        collection.down = True
+        store.mark(_GUILD_ID, SavedRecord(_record(('old',))))
+        await until(lambda: collection.round_trips >= 1)
+        store.mark(_GUILD_ID, SavedRecord(_record(('new',))))
+        collection.down = False
+        await until(lambda: _GUILD_ID in collection.documents)
+        await store.close()
+
+    asyncio_run(scenario())
+    assert [track[0] for track in collection.documents[_GUILD_ID]['tracks']] == ['new']
+
+
+def test_loading_saved_players_is_retried(player, collection):
+    collection.documents[_GUILD_ID] = _record()
+    collection.down = True
+
+    async def scenario():
+        cog = music.Music(FakeBot([_guild()]))
+        await cog.cog_load()
+        await until(lambda: collection.round_trips >= 1)
+        collection.down = False
+        await until(lambda: _GUILD_ID in cog.voice_states)
+        voice_state = cog.voice_states[_GUILD_ID]
+        await until(lambda: voice_state.voice.played)
+        played = voice_state.voice.played[0].track.title
+        await cog.cog_unload()
+        return played
+
+    assert asyncio_run(scenario()) == 'a'
+
+
+def test_loading_saved_players_gives_up(player, collection, caplog):
+    collection.documents[_GUILD_ID] = _record()
+    collection.down = True
+
+    async def scenario():
+        cog = music.Music(FakeBot([_guild()]))
+        await cog.cog_load()
+        await until(lambda: 'Giving up' in caplog.text)
+        voice_states = dict(cog.voice_states)
+        collection.down = False
+        await cog.cog_unload()
+        return voice_states
+
+    assert asyncio_run(scenario()) == {}
+    assert collection.round_trips == music._config['queue_store_restore_attempts']
+    # Saved players are left for the next start
+    assert collection.documents[_GUILD_ID] == _record()
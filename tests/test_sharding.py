@@ -0,0 +1,142 @@
+from asyncio import run as asyncio_run, sleep as asyncio_sleep
+from importlib import import_module
+from json import dump as json_dump, load as json_load
+from sys import modules
+
+import pytest
+from discord.gateway import DiscordWebSocket
+
+import launcher
+from fakes import FakeGateway
+
+
+@pytest.mark.parametrize('shard_count, clusters', [(1, 1), (4, 1), (4, 4), (10, 3), (16, 5), (100, 7), (2500, 16)])
+def test_every_shard_runs_in_a_single_cluster(shard_count, clusters):
+    assignment = launcher.cluster_shards(shard_count, clusters)
+    assert len(assignment) == clusters
+    assert [shard_id for shard_ids in assignment for shard_id in shard_ids] == list(range(shard_count))
+    # Clusters get contiguous shards, and none gets more than one shard over the others
+    assert all(shard_ids == list(range(shard_ids[0], shard_ids[-1] + 1)) for shard_ids in assignment)
+    assert max(map(len, assignment)) - min(map(len, assignment)) <= 1
+
+
+def test_dry_run_shows_the_assignment(monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['launcher.py', '--clusters', '4', '--shards', '3', '--dry-run'])
+    monkeypatch.setattr(launcher, 'Popen', lambda *args, **kwargs: pytest.fail("Dry runs start nothing"))
+    launcher.main()
+    # No cluster is left without shards
+    assert capsys.readouterr().out.splitlines() == ["Cluster 0: shards [0] of 3", "Cluster 1: shards [1] of 3",
+                                                    "Cluster 2: shards [2] of 3"]
+
+
+class FakeProcess(object):
+    """
+    Fake cluster process, exiting with the given return codes one poll after the other.
+    """
+
+    def __init__(self, returncodes):
+        self.returncodes = list(returncodes)
+        self.returncode = None
+        self.terminated = False
+
+    def poll(self):
+        self.returncode = self.returncodes.pop(0) if self.returncodes else None
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+
+    def wait(self):
+        pass
+
+
+def test_launcher_restarts_crashed_clusters(monkeypatch):
+    # Cluster 0 crashes once and is shut down by its restart, cluster 1 is shut down right away
+    started = []
+    returncodes = {0: [[None, 1], [None, 0]], 1: [[0]]}
+
+    def popen(args, env):
+        cluster_id = int(env['CLUSTER_ID'])
+        started.append((cluster_id, env['SHARD_IDS'], env['SHARD_COUNT']))
+        return FakeProcess(returncodes[cluster_id].pop(0))
+
+    monkeypatch.setattr('sys.argv', ['launcher.py', '--clusters', '2', '--shards', '5'])
+    monkeypatch.setattr(launcher, 'Popen', popen)
+    monkeypatch.setattr(launcher, 'sleep', lambda seconds: None)
+    launcher.main()
+    assert started == [(0, '0,1', '5'), (1, '2,3,4', '5'), (0, '0,1', '5')]
+
+
+def test_clusters_get_their_own_config(monkeypatch):
+    environments = []
+    monkeypatch.setitem(launcher._bot_config, 'cluster_configs', ['first.json'])
+    monkeypatch.setattr(launcher, 'Popen', lambda args, env: environments.append(env))
+    monkeypatch.setenv('BOT_CONFIG', 'bot_config.json')
+    launcher.start_cluster(0, [0, 1], 4)
+    launcher.start_cluster(1, [2, 3], 4)
+    assert [environment['BOT_CONFIG'] for environment in environments] == ['first.json', 'bot_config.json']
+
+
+@pytest.fixture
+def sharded_bot(monkeypatch, tmp_path):
+    # Bot module of a cluster started by the launcher, with a sharded config and a fake gateway
+    def load(shard_ids=None, shard_count=None, config_shard_count=None):
+        with open('bot/bot_config.json', 'r', encoding='utf-8') as f:
+            config = json_load(f)
+        config.update(sharded=True, shard_count=config_shard_count)
+        with open(tmp_path / 'sharded.json', 'w', encoding='utf-8') as f:
+            json_dump(config, f)
+        monkeypatch.setenv('BOT_CONFIG', str(tmp_path / 'sharded.json'))
+        for name, value in (('SHARD_IDS', shard_ids), ('SHARD_COUNT', shard_count)):
+            if value is None:
+                monkeypatch.delenv(name, raising=False)
+            else:
+                monkeypatch.setenv(name, value)
+        monkeypatch.delitem(modules, 'main', raising=False)
+        return import_module('main').bot
+
+    gateway = FakeGateway()
+    monkeypatch.setattr(DiscordWebSocket, 'from_client', gateway.from_client)
+    yield load, gateway
+    monkeypatch.delitem(modules, 'main', raising=False)
+
+
+async def _start_shards(bot, gateway, shards):
+    # Connect like after logging in, until every shard of the cluster is connected, then shut down
+    await bot._async_setup_hook()
+    connection = bot.loop.create_task(bot.connect())
+    while len(bot.shards) < shards and not connection.done():
+        await asyncio_sleep(0.01)
+    launched = bot.shard_count, sorted(bot.shards)
+    await bot.close()
+    await connection
+    return launched
+
+
+def test_clusters_start_only_their_shards(sharded_bot):
+    load, gateway = sharded_bot
+    bot = load(shard_ids='2,3', shard_count='4')
+    assert asyncio_run(_start_shards(bot, gateway, 2)) == (4, [2, 3])
+    # The first shard of the cluster identifies first, and every shard is closed on shutdown
+    assert gateway.connected == {2: (True, str(DiscordWebSocket.DEFAULT_GATEWAY)),
+                                 3: (False, str(DiscordWebSocket.DEFAULT_GATEWAY))}
+    assert gateway.closed == {2, 3}
+
+
+def test_single_process_runs_every_configured_shard(sharded_bot):
+    load, gateway = sharded_bot
+    bot = load(config_shard_count=3)
+    assert asyncio_run(_start_shards(bot, gateway, 3)) == (3, [0, 1, 2])
+    assert [initial for initial, _ in gateway.connected.values()] == [True, False, False]
+
+
+def test_shard_count_is_asked_to_the_gateway(sharded_bot, monkeypatch):
+    load, gateway = sharded_bot
+    bot = load()
+
+    async def get_bot_gateway(*args, **kwargs):
+        return 2, 'wss://gateway.test'
+
+    monkeypatch.setattr(bot.http, 'get_bot_gateway', get_bot_gateway)
+    assert asyncio_run(_start_shards(bot, gateway, 2)) == (2, [0, 1])
+    assert {url for _, url in gateway.connected.values()} == {'wss://gateway.test'}
@@ -0,0 +1,130 @@
+from asyncio import run as asyncio_run, sleep as asyncio_sleep
+from importlib import import_module
+from sys import modules
+from threading import Event
+from time import perf_counter
+
+import pytest
+
+from src.utils.mongo import MongoUtil
+
+
+class Startup(object):
+    """
+    Record of the startup phases of the bot, with a blocking init data load that can be held back.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.release_init_data = Event()
+        self.init_data_error = None
+        self.ping_error = ''
+
+    def record(self, event):
+        self.events.append((event, perf_counter()))
+
+    def ping(self):
+        self.record('ping')
+        return self.ping_error
+
+    def load_init_data(self, reset=False):
+        self.record('init data start')
+        self.release_init_data.wait(10)
+        if self.init_data_error:
+            raise self.init_data_error
+        self.record('init data end')
+
+    def names(self):
+        return [name for name, _ in self.events]
+
+
+@pytest.fixture
+def startup(monkeypatch, mongo_db):
+    # Bot module with a fake mongo, login and gateway connection, started as a single cluster
+    startup = Startup()
+    for name in ('MONGO_USER', 'MONGO_PASSWORD', 'MONGO_HOST', 'MONGO_PORT', 'DISCORD_TOKEN'):
+        monkeypatch.setenv(name, 'test')
+    monkeypatch.delenv('CLUSTER_ID', raising=False)
+    monkeypatch.delitem(modules, 'main', raising=False)
+    main = import_module('main')
+    monkeypatch.setattr(MongoUtil, 'ping', startup.ping)
+    monkeypatch.setattr(MongoUtil, 'load_init_data', startup.load_init_data)
+
+    async def login(token):
+        startup.record('login')
+
+    async def load_extension(name):
+        await asyncio_sleep(0.05)
+        startup.record(f"extension {name.rsplit('.', 1)[-1]}")
+
+    async def close():
+        startup.record('close')
+
+    monkeypatch.setattr(main.bot, 'login', login)
+    monkeypatch.setattr(main.bot, 'load_extension', load_extension)
+    monkeypatch.setattr(main.bot, 'close', close)
+    yield main, startup
+    startup.release_init_data.set()
+    monkeypatch.delitem(modules, 'main', raising=False)
+
+
+def test_bot_connects_before_init_data_is_loaded(startup, monkeypatch):
+    main, startup = startup
+
+    async def connect():
+        # Running until init data is loaded in the background
+        startup.record('connect')
+        startup.release_init_data.set()
+        while 'init data end' not in startup.names():
+            await asyncio_sleep(0.01)
+
+    monkeypatch.setattr(main.bot, 'connect', connect)
+    asyncio_run(main.main())
+    names = startup.names()
+    assert names.index('connect') < names.index('init data end')
+    assert names.index('ping') < names.index('connect')
+    assert all(names.index(f"extension {extension}") < names.index('connect')
+               for extension in main._bot_config['startup_extensions'])
+
+
+def test_init_data_errors_do_not_stop_the_bot(startup, monkeypatch, caplog):
+    main, startup = startup
+    startup.init_data_error = OSError("Init data file is gone")
+
+    async def connect():
+        startup.record('connect')
+        startup.release_init_data.set()
+        while 'Failed to load mongo init data' not in caplog.text:
+            await asyncio_sleep(0.01)
+        startup.record('still connected')
+
+    monkeypatch.setattr(main.bot, 'connect', connect)
+    asyncio_run(main.main())
+    assert startup.names()[-1] == 'still connected'
+
+
+def test_unreachable_mongo_stops_the_bot(startup, monkeypatch):
+    main, startup = startup
+    startup.ping_error = 'Connection refused'
+
+    async def connect():
+        pytest.fail("Connecting without mongo")
+
+    monkeypatch.setattr(main.bot, 'connect', connect)
+    asyncio_run(main.main())
+    assert 'close' in startup.names()
+    assert 'init data start' not in startup.names()
+
+
+def test_other_clusters_skip_init_data(startup, monkeypatch):
+    main, startup = startup
+    monkeypatch.setattr(main, '__cluster_id', 1)
+
+    async def connect():
+        startup.record('connect')
+        await asyncio_sleep(0.05)
+
+    monkeypatch.setattr(main.bot, 'connect', connect)
+    asyncio_run(main.main())
+    assert 'connect' in startup.names()
+    assert 'init data start' not in startup.names()
@@ -0,0 +1,153 @@
+from asyncio import run as asyncio_run, Semaphore, sleep as asyncio_sleep
+from time import perf_counter, time
+from tracemalloc import get_traced_memory, start as tracemalloc_start, stop as tracemalloc_stop
+
+import pytest
+
+from fakes import FakeAudio, FakeBot, FakeChannel, FakeContext, FakeExtractionPool, FakeGuild, FakeQueueStore, \
+    LagMonitor, until
+from src.extensions import music
+from src.extensions.music import Track
+from src.utils.cache import LRUCache
+
+_GUILDS = 300
+_TRACKS = 3
+
+
+def test_many_guilds_play_their_own_queues(player):
+    async def scenario():
+        cog = music.Music(FakeBot())
+        cog.queue_store = FakeQueueStore()
+        await cog.cog_load()
+        monitor = LagMonitor()
+        lag_task = cog.bot.loop.create_task(monitor.run())
+        tracemalloc_start()
+        start_memory = get_traced_memory()[0]
+        for guild_id in range(1, _GUILDS + 1):
+            channel = FakeChannel(guild_id * 10)
+            voice_state = cog.get_voice_state(FakeContext(FakeGuild(guild_id, [channel]), channel))
+            voice_state.voice = await channel.connect()
+            for index in range(_TRACKS):
+                voice_state.music_queue.put_nowait(
+                    Track(f"{guild_id}-{index}", f"https://video.test/{guild_id}/{index}", 1, guild_id))
+        memory_per_guild = (get_traced_memory()[0] - start_memory) / _GUILDS
+        tracemalloc_stop()
+        start = perf_counter()
+        await until(lambda: all(len(voice_state.voice.played) == _TRACKS and not voice_state.voice.is_playing()
+                                 for voice_state in cog.voice_states.values()))
+        elapsed = perf_counter() - start
+        monitor.stop()
+        await lag_task
+        print(f"\n{_GUILDS} guilds, {_TRACKS} tracks each: {memory_per_guild / 1024:.1f}KiB per guild, "
+              f"played in {elapsed:.2f}s, loop lag p50 {monitor.quantile(0.5) * 1000:.1f}ms "
+              f"p99 {monitor.quantile(0.99) * 1000:.1f}ms max {max(monitor.lags) * 1000:.1f}ms")
+
+        # Every guild played its own tracks in order, and guilds played at the same time instead of one by one
+        assert len(cog.voice_states) == _GUILDS
+        for guild_id, voice_state in cog.voice_states.items():
+            assert [source.track.title for source in voice_state.voice.played] == \
+                   [f"{guild_id}-{index}" for index in range(_TRACKS)]
+            assert len(voice_state.text_channel.sent) == _TRACKS
+        assert elapsed < _GUILDS * _TRACKS * FakeChannel(0).play_time / 10
+        assert monitor.quantile(0.99) < 0.1
+        assert memory_per_guild < 64 * 1024
+
+        # Stopped guilds are evicted, the others keep playing what they get next
+        for guild_id in range(1, _GUILDS + 1, 2):
+            await cog.voice_states[guild_id].stop()
+        await asyncio_sleep(0)
+        await cog.evict_idle_voice_states()
+        assert sorted(cog.voice_states) == list(range(2, _GUILDS + 1, 2))
+        voice_states = list(cog.voice_states.values())
+        for voice_state in voice_states:
+            voice_state.music_queue.put_nowait(Track('again', 'https://video.test/again', 1, 1))
+        await until(lambda: all(len(voice_state.voice.played) == _TRACKS + 1 for voice_state in voice_states))
+
+        # Unloading stops every player
+        await cog.cog_unload()
+        await asyncio_sleep(0)
+        assert not cog.voice_states
+        assert all(voice_state.is_idle for voice_state in voice_states)
+
+    asyncio_run(scenario())
+
+
+def test_guilds_get_a_single_voice_state_until_idle(player):
+    async def scenario():
+        cog = music.Music(FakeBot())
+        cog.queue_store = FakeQueueStore()
+        channel = FakeChannel(10)
+        ctx = FakeContext(FakeGuild(1, [channel]), channel)
+        voice_state = cog.get_voice_state(ctx)
+        assert cog.get_voice_state(ctx) is voice_state
+        other = cog.get_voice_state(FakeContext(FakeGuild(2, [channel]), channel))
+        assert other is not voice_state
+        # Players that already ended are replaced
+        await voice_state.stop()
+        await asyncio_sleep(0)
+        assert cog.get_voice_state(ctx) is not voice_state
+        await other.stop()
+
+    asyncio_run(scenario())
+
+
+def test_next_track_does_not_wait_for_a_prefetch_slot(player, monkeypatch):
+    # Every prefetch slot is taken by other guilds
+    monkeypatch.setattr(music.VoiceState, '_VoiceState__prefetch_semaphore', Semaphore(0))
+
+    async def scenario():
+        channel = FakeChannel(10)
+        voice_state = music.VoiceState(FakeBot(), 1, channel, FakeQueueStore())
+        voice_state.voice = await channel.connect()
+        for index in range(3):
+            voice_state.music_queue.put_nowait(Track(f"{index}", f"https://video.test/{index}", 1, 1))
+        await until(lambda: len(voice_state.voice.played) == 3, timeout=2)
+        await voice_state.stop()
+
+    asyncio_run(scenario())
+
+
+@pytest.fixture
+def extraction_pool(monkeypatch):
+    # Real extraction through the info cache, with fake extractions and audio
+    pool = FakeExtractionPool()
+    monkeypatch.setattr(music.YTDLSource, 'extraction_pool', pool)
+    monkeypatch.setattr(music.YTDLSource, 'info_cache', LRUCache(16))
+    monkeypatch.setattr(music.YTDLSource, 'extractions', 0)
+    monkeypatch.setattr(music.YTDLSource, '_YTDLSource__create_audio', lambda self, position=0: FakeAudio())
+    monkeypatch.setattr(music.VoiceState, '_VoiceState__prefetch_semaphore',
+                        Semaphore(music._config['prefetch_concurrency']))
+    return pool
+
+
+def _loop_track(times, play_time):
+    # Count extractor invocations while a single looped track plays over and over
+    async def scenario():
+        channel = FakeChannel(10, play_time=play_time)
+        voice_state = music.VoiceState(FakeBot(), 1, channel, FakeQueueStore())
+        voice_state.voice = await channel.connect()
+        voice_state.loop = True
+        voice_state.music_queue.put_nowait(Track('looped', 'https://video.test/looped', 1, 1))
+        await until(lambda: len(voice_state.voice.played) == times)
+        await voice_state.stop()
+
+    asyncio_run(scenario())
+    return music.YTDLSource.extractions
+
+
+def test_looped_tracks_replay_without_extracting_again(extraction_pool, monkeypatch):
+    monkeypatch.setitem(music._config, 'track_failure_time', 0.01)
+    # The flat and the full extraction of the first time only
+    assert _loop_track(10, 0.02) == 2
+
+
+def test_looped_tracks_are_extracted_again_when_expired(extraction_pool, monkeypatch):
+    monkeypatch.setitem(music._config, 'track_failure_time', 0.01)
+    extraction_pool.expire = int(time()) + music._config['info_cache_expiry_margin'] - 1
+    assert _loop_track(5, 0.02) == 2 * 5
+
+
+def test_looped_tracks_are_extracted_again_when_failing(extraction_pool, monkeypatch):
+    # Tracks ending this early are considered failed, like ffmpeg dying on a dead stream url
+    monkeypatch.setitem(music._config, 'track_failure_time', 1)
+    assert _loop_track(5, 0.02) == 2 * 5